@@ -1,21 +1,21 @@
 from flask import Flask, request, abort
-import json
+import logging
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from fsnd_common import jsonlog
+from fsnd_common.jwks import AuthError, KeyCache, check_claims
 
 
 app = Flask(__name__)
+jsonlog.setup_logging(app)
+logger = logging.getLogger(__name__)
 
 AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
 ALGORITHMS = ['RS256']
 API_AUDIENCE = @TODO_REPLACE_WITH_YOUR_API_AUDIENCE
-
-
-class AuthError(Exception):
-    def __init__(self, error, status_code):
-        self.error = error
-        self.status_code = status_code
+ISSUER = 'https://' + AUTH0_DOMAIN + '/'
+KEYS = KeyCache(ISSUER + '.well-known/jwks.json', ALGORITHMS[0])
 
 
 def get_token_auth_header():
@@ -52,33 +52,30 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+        claims = jwt.get_unverified_claims(token)
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    check_claims(claims, API_AUDIENCE, ISSUER)
+    rsa_key = KEYS.get(unverified_header['kid'])
+    if rsa_key is not None:
         try:
+            # aud and iss were checked above, the signature covers them
             payload = jwt.decode(
                 token,
                 rsa_key,
                 algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                options={'verify_aud': False, 'verify_iss': False}
             )
 
             return payload
@@ -120,5 +117,5 @@ def requires_auth(f):
 @app.route('/headers')
 @requires_auth
 def headers(payload):
-    print(payload)
+    logger.info('access granted', extra={'subject': payload.get('sub')})
     return 'Access Granted'
\ No newline at end of file
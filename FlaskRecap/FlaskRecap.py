@@ -1,8 +1,14 @@
+import logging
 from flask import Flask, request, jsonify, abort
 
+from fsnd_common import jsonlog
+from greetings_store import store_from_env
+
 app = Flask(__name__)
+jsonlog.setup_logging(app)
+logger = logging.getLogger(__name__)
 
-greetings = {
+initial_greetings = {
             'en': 'hello', 
             'es': 'Hola', 
             'ar': 'مرحبا',
@@ -12,22 +18,24 @@ greetings = {
             'ja': 'こんにちは'
             }
 
+# backend is picked with GREETINGS_BACKEND=memory|sqlite|mmap (and GREETINGS_PATH)
+greetings = store_from_env(initial_greetings)
+
 @app.route('/greeting', methods=['GET'])
 def greeting_all():
-    return jsonify({'greetings': greetings})
+    return app.response_class(greetings.body(), mimetype='application/json')
 
 @app.route('/greeting/<lang>', methods=['GET'])
 def greeting_one(lang):
-    print(lang)
-    if(lang not in greetings):
+    logger.debug('greeting lookup', extra={'lang': lang})
+    greeting = greetings.get(lang)
+    if(greeting is None):
         abort(404)
-    return jsonify({'greeting': greetings[lang
-    ]})
+    return jsonify({'greeting': greeting})
 
 @app.route('/greeting', methods=['POST'])
 def greeting_add():
     info = request.get_json()
     if('lang' not in info or 'greeting' not in info):
         abort(422)
-    greetings[info['lang']] = info['greeting']
-    return jsonify({'greetings':greetings})
+    return jsonify({'greetings': greetings.add(info['lang'], info['greeting'])})
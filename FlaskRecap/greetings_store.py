@@ -0,0 +1,228 @@
+"""
+  Key-value backends for the greetings and a per-process
+  read-through cache stamped with the backend version.
+
+  Every backend keeps a version number that is bumped on each write,
+  so a worker only reloads and re-encodes the greetings when another
+  worker (or itself) changed them.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+BACKEND_ENV = 'GREETINGS_BACKEND'
+PATH_ENV = 'GREETINGS_PATH'
+DEFAULT_PATHS = {
+    'sqlite': 'greetings.db',
+    'mmap': 'greetings.mmap'
+}
+
+
+class MemoryBackend:
+    """ Process local dict, the original behaviour, nothing is persisted """
+
+    def __init__(self, initial=None):
+        self._greetings = dict(initial or {})
+        self._version = 1
+        self._lock = threading.Lock()
+
+    def version(self):
+        return self._version
+
+    def items(self):
+        with self._lock:
+            return self._version, dict(self._greetings)
+
+    def set(self, lang, greeting):
+        with self._lock:
+            self._greetings[lang] = greeting
+            self._version += 1
+            return self._version
+
+
+class SQLiteBackend:
+    """ Greetings stored in a SQLite file shared by every worker """
+
+    def __init__(self, path, initial=None):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS greetings '
+                               '(lang TEXT PRIMARY KEY, greeting TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta '
+                               '(id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+            connection.execute('INSERT OR IGNORE INTO meta (id, version) VALUES (1, 1)')
+            connection.executemany('INSERT OR IGNORE INTO greetings (lang, greeting) VALUES (?, ?)',
+                                   (initial or {}).items())
+
+    def _connection(self):
+        """ sqlite3 connections can not be shared across threads, keep one per thread """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def version(self):
+        return self._connection().execute('SELECT version FROM meta WHERE id = 1').fetchone()[0]
+
+    def items(self):
+        connection = self._connection()
+        with connection:
+            version = connection.execute('SELECT version FROM meta WHERE id = 1').fetchone()[0]
+            greetings = dict(connection.execute('SELECT lang, greeting FROM greetings'))
+        return version, greetings
+
+    def set(self, lang, greeting):
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO greetings (lang, greeting) VALUES (?, ?)',
+                               (lang, greeting))
+            connection.execute('UPDATE meta SET version = version + 1 WHERE id = 1')
+            return connection.execute('SELECT version FROM meta WHERE id = 1').fetchone()[0]
+
+
+class MmapBackend:
+    """
+      Greetings stored as one json document in a memory-mapped file.
+      Layout: 8 byte version, 4 byte body offset, 4 byte body length,
+      utf-8 json bodies. Writers hold an exclusive flock, readers a shared one.
+      A write puts the new body next to the live one and only then points
+      the header at it, so a crash in between leaves the old greetings.
+    """
+
+    HEADER = struct.Struct('<QII')
+
+    def __init__(self, path, initial=None):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._map = None
+        self._lock = threading.Lock()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.HEADER.size:
+                self._write(1, dict(initial or {}))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _mapped(self):
+        """ Returns the file mapping, remapped when another worker resized the file """
+        size = os.fstat(self._fd).st_size
+        if self._map is None or len(self._map) != size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _read(self):
+        mapped = self._mapped()
+        version, offset, length = self.HEADER.unpack_from(mapped, 0)
+        return version, json.loads(mapped[offset:offset + length].decode('utf-8'))
+
+    def _write(self, version, greetings):
+        body = json.dumps(greetings).encode('utf-8')
+        size = os.fstat(self._fd).st_size
+        start = self.HEADER.size
+        if size >= self.HEADER.size:
+            _, offset, length = self.HEADER.unpack(os.pread(self._fd, self.HEADER.size, 0))
+            # the live body stays untouched, the new one goes before or after it
+            if start + len(body) > offset:
+                start = offset + length
+        if start + len(body) > size:
+            os.ftruncate(self._fd, start + len(body))
+        os.pwrite(self._fd, body, start)
+        os.fsync(self._fd)
+        os.pwrite(self._fd, self.HEADER.pack(version, start, len(body)), 0)
+
+    def version(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return self.HEADER.unpack_from(self._mapped(), 0)[0]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def items(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return self._read()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def set(self, lang, greeting):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                version, greetings = self._read()
+                greetings[lang] = greeting
+                self._write(version + 1, greetings)
+                return version + 1
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+    'mmap': MmapBackend
+}
+
+
+class GreetingStore:
+    """
+      Read-through cache in front of a backend.
+      Keeps the greetings and the encoded GET /greeting body
+      until the backend version moves on.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._version = None
+        self._greetings = {}
+        self._body = b''
+
+    def _refresh(self):
+        if self.backend.version() == self._version:
+            return
+        with self._lock:
+            version, greetings = self.backend.items()
+            if version != self._version:
+                self._body = json.dumps({'greetings': greetings}).encode('utf-8')
+                self._greetings = greetings
+                self._version = version
+
+    def body(self):
+        """ Returns the pre-encoded json body with every greeting """
+        self._refresh()
+        return self._body
+
+    def get(self, lang):
+        """ Returns the greeting for lang or None """
+        self._refresh()
+        return self._greetings.get(lang)
+
+    def add(self, lang, greeting):
+        """ Stores a greeting and returns only the changed entry """
+        self.backend.set(lang, greeting)
+        return {lang: greeting}
+
+
+def store_from_env(initial=None):
+    """
+      Builds a GreetingStore from GREETINGS_BACKEND (memory, sqlite or mmap)
+      and GREETINGS_PATH environment variables
+    """
+    name = os.environ.get(BACKEND_ENV, 'memory')
+    if name not in BACKENDS:
+        raise ValueError('Unknown greetings backend: {}'.format(name))
+    if name == 'memory':
+        return GreetingStore(MemoryBackend(initial))
+    path = os.environ.get(PATH_ENV, DEFAULT_PATHS[name])
+    return GreetingStore(BACKENDS[name](path, initial))
@@ -0,0 +1,169 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from greetings_store import GreetingStore, MemoryBackend, SQLiteBackend, MmapBackend, \
+    store_from_env, BACKEND_ENV, PATH_ENV
+
+INITIAL = {'en': 'hello', 'fi': 'Hei'}
+
+
+class BackendTests:
+    """Tests every backend passes, the test cases say how to open one"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = self.open_backend(INITIAL)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_backend(self, initial=None):
+        raise NotImplementedError
+
+    def test_initial_greetings(self):
+        version, greetings = self.backend.items()
+
+        self.assertEqual(greetings, INITIAL)
+        self.assertEqual(version, self.backend.version())
+
+    def test_set_bumps_version(self):
+        version = self.backend.version()
+
+        self.assertEqual(self.backend.set('ja', 'こんにちは'), version + 1)
+        self.assertEqual(self.backend.set('en', 'hi'), version + 2)
+        self.assertEqual(self.backend.items(),
+                         (version + 2, dict(INITIAL, ja='こんにちは', en='hi')))
+
+
+class MemoryBackendTestCase(BackendTests, unittest.TestCase):
+
+    def open_backend(self, initial=None):
+        return MemoryBackend(initial)
+
+    def test_initial_copied(self):
+        initial = dict(INITIAL)
+        backend = MemoryBackend(initial)
+        backend.set('es', 'Hola')
+
+        self.assertNotIn('es', initial)
+
+
+class SharedBackendTests(BackendTests):
+    """Tests of the backends every worker shares through a file"""
+
+    def test_writes_seen_by_other_workers(self):
+        other = self.open_backend(INITIAL)
+        version = other.set('he', 'שלום')
+
+        self.assertEqual(self.backend.version(), version)
+        self.assertEqual(self.backend.items()[1]['he'], 'שלום')
+
+    def test_reopen_keeps_greetings(self):
+        self.backend.set('en', 'hi')
+        version = self.backend.version()
+        reopened = self.open_backend({'en': 'hello', 'es': 'Hola'})
+
+        self.assertEqual(reopened.items()[0], version)
+        self.assertEqual(reopened.items()[1]['en'], 'hi')
+
+
+class SQLiteBackendTestCase(SharedBackendTests, unittest.TestCase):
+
+    def open_backend(self, initial=None):
+        return SQLiteBackend(os.path.join(self.directory.name, 'greetings.db'), initial)
+
+
+class MmapBackendTestCase(SharedBackendTests, unittest.TestCase):
+
+    def open_backend(self, initial=None):
+        return MmapBackend(os.path.join(self.directory.name, 'greetings.mmap'), initial)
+
+    def test_remaps_grown_file(self):
+        other = self.open_backend()
+        self.backend.items()
+        other.set('long', 'x' * 10000)
+
+        self.assertEqual(self.backend.items()[1]['long'], 'x' * 10000)
+
+    def test_failed_write_keeps_greetings(self):
+        self.backend.set('long', 'x' * 100)
+        expected = self.backend.items()
+        pwrite = os.pwrite
+        for failing in range(2):
+            calls = []
+
+            def crash(fd, data, offset):
+                calls.append(offset)
+                if len(calls) > failing:
+                    raise OSError('disk full')
+                return pwrite(fd, data, offset)
+
+            with mock.patch('greetings_store.os.pwrite', side_effect=crash):
+                with self.assertRaises(OSError):
+                    self.backend.set('en', 'hi')
+
+            self.assertEqual(self.open_backend().items(), expected)
+
+    def test_file_does_not_keep_growing(self):
+        for length in range(1, 200):
+            self.backend.set('grow', 'x' * length)
+
+        self.assertEqual(self.backend.items()[1]['grow'], 'x' * 199)
+        self.assertLess(os.path.getsize(self.backend.path), 4 * len(json.dumps(
+            self.backend.items()[1])))
+
+
+class GreetingStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'greetings.db')
+        self.store = GreetingStore(SQLiteBackend(self.path, INITIAL))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_body(self):
+        self.assertEqual(json.loads(self.store.body()), {'greetings': INITIAL})
+        self.assertEqual(self.store.get('fi'), 'Hei')
+        self.assertIsNone(self.store.get('ru'))
+
+    def test_cache_kept_until_version_changes(self):
+        body = self.store.body()
+        with mock.patch.object(self.store.backend, 'items',
+                               wraps=self.store.backend.items) as items:
+            self.assertIs(self.store.body(), body)
+            self.assertEqual(self.store.get('en'), 'hello')
+            self.assertEqual(items.call_count, 0)
+
+            self.assertEqual(self.store.add('ru', 'Привет'), {'ru': 'Привет'})
+            self.assertEqual(self.store.get('ru'), 'Привет')
+            self.assertEqual(json.loads(self.store.body())['greetings']['ru'], 'Привет')
+            self.assertEqual(items.call_count, 1)
+
+    def test_cache_invalidated_by_other_workers(self):
+        self.assertEqual(self.store.get('en'), 'hello')
+        other = GreetingStore(SQLiteBackend(self.path, INITIAL))
+        other.add('en', 'hi')
+
+        self.assertEqual(self.store.get('en'), 'hi')
+        self.assertEqual(json.loads(self.store.body())['greetings']['en'], 'hi')
+
+    def test_store_from_env(self):
+        path = os.path.join(self.directory.name, 'greetings.mmap')
+        with mock.patch.dict(os.environ, {BACKEND_ENV: 'mmap', PATH_ENV: path}):
+            store = store_from_env(INITIAL)
+        self.assertIsInstance(store.backend, MmapBackend)
+        self.assertEqual(store.get('fi'), 'Hei')
+
+        with mock.patch.dict(os.environ, {BACKEND_ENV: 'redis'}):
+            with self.assertRaises(ValueError):
+                store_from_env(INITIAL)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
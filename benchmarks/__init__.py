@@ -0,0 +1,4 @@
+"""
+  Load-testing harness and benchmark suite for the trivia,
+  coffee shop and flask recap apps, see README.md
+"""
@@ -0,0 +1,105 @@
+"""
+  Loads each app against a benchmark database, seeds it with
+  synthetic data and lists the scenarios that drive its endpoints
+"""
+
+import os
+import sys
+
+from .datagen import generate_categories, generate_questions, generate_drinks
+from .harness import Scenario
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIVIA_DIR = os.path.join(ROOT, 'projects', '02_trivia_api', 'starter', 'backend')
+COFFEE_DIR = os.path.join(ROOT, 'projects', '03_coffee_shop_full_stack', 'starter_code', 'backend')
+RECAP_DIR = os.path.join(ROOT, 'FlaskRecap')
+
+
+def import_from(directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+
+def trivia(database_path, scale):
+    """ Returns the trivia app, its engine and scenarios """
+    import_from(TRIVIA_DIR)
+    from flaskr import create_app, QUESTIONS_PER_PAGE
+    from models import DB, Question, Category
+
+    # the scenarios come from one address, rate limits would answer most of them with 429
+    app = create_app({'DATABASE_PATH': database_path, 'CREATE_SCHEMA': True,
+                      'ADMISSION_LIMITS': {}})
+    with app.app_context():
+        DB.session.execute(Question.__table__.delete())
+        DB.session.execute(Category.__table__.delete())
+        DB.session.execute(Category.__table__.insert(), generate_categories())
+        DB.session.execute(Question.__table__.insert(), generate_questions(scale))
+        DB.session.commit()
+        question_ids = iter([row[0] for row in DB.session.query(Question.id).order_by(Question.id)])
+        engine = DB.get_engine(app)
+
+    last_page = max(1, (scale + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE)
+    scenarios = [
+        Scenario('categories', 'GET', '/categories'),
+        Scenario('questions_first_page', 'GET', '/questions?page=1'),
+        Scenario('questions_last_page', 'GET', '/questions?page={}'.format(last_page)),
+        Scenario('questions_columnar', 'GET', '/questions?page=1&format=columnar'),
+        Scenario('category_questions', 'GET', '/categories/2/questions'),
+        Scenario('search', 'POST', '/questions/search', {'searchTerm': 'river'}),
+        Scenario('quiz', 'POST', '/quizzes', {'quiz_category': {'id': '2'},
+                                              'previous_questions': [],
+                                              'questions_per_play': 5}),
+        Scenario('create_question', 'POST', '/questions/new', {
+            'question': 'Benchmark question?', 'answer': 'yes',
+            'category': '1', 'difficulty': 1}),
+        Scenario('delete_question', 'DELETE',
+                 lambda number: '/questions/{}'.format(next(question_ids, 0)))
+    ]
+    return app, engine, scenarios
+
+
+def coffee(database_path, scale):
+    """
+      Returns the coffee shop app, its engine and scenarios,
+      endpoints behind requires_auth are not driven
+    """
+    import_from(COFFEE_DIR)
+    from src.api import app
+    from src.database.models import db, db_index_ingredients, Drink, DrinkIngredient
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_path
+    with app.app_context():
+        db.create_all()
+        db.session.execute(DrinkIngredient.__table__.delete())
+        db.session.execute(Drink.__table__.delete())
+        db.session.execute(Drink.__table__.insert(), generate_drinks(scale))
+        db.session.commit()
+        db_index_ingredients()
+        engine = db.get_engine(app)
+
+    scenarios = [
+        Scenario('drinks', 'GET', '/drinks'),
+        Scenario('drinks_by_ingredient', 'GET', '/drinks?ingredient=milk&ingredient=espresso'),
+        Scenario('drinks_by_any_color', 'GET', '/drinks?color=%23ffffff&color=%234b2e20&match=any')
+    ]
+    return app, engine, scenarios
+
+
+def recap(database_path, scale):
+    """ Returns the flask recap app and scenarios, it has no database """
+    import_from(RECAP_DIR)
+    from FlaskRecap import app
+
+    scenarios = [
+        Scenario('greetings', 'GET', '/greeting'),
+        Scenario('greeting', 'GET', '/greeting/es'),
+        Scenario('add_greeting', 'POST', '/greeting', {'lang': 'pt', 'greeting': 'Ola'})
+    ]
+    return app, None, scenarios
+
+
+APPS = {
+    'trivia': trivia,
+    'coffee': coffee,
+    'recap': recap
+}
@@ -0,0 +1,53 @@
+"""
+  Synthetic data generators for questions, categories and drinks
+"""
+
+import json
+import random
+
+CATEGORY_TYPES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = ['who', 'what', 'which', 'painted', 'river', 'planet', 'movie', 'team',
+         'capital', 'element', 'author', 'year', 'largest', 'first', 'famous',
+         'ocean', 'country', 'king', 'song', 'won']
+COLORS = ['#d7a27d', '#4b2e20', '#ffffff', '#f1e0c5', '#c59b76', '#7b4a2b']
+INGREDIENTS = ['espresso', 'milk', 'foam', 'water', 'chocolate', 'cream',
+               'caramel', 'vanilla', 'ice', 'cinnamon']
+
+
+def generate_categories():
+    """ Returns category rows, the trivia app expects the six default types """
+    return [{'id': index + 1, 'type': type} for index, type in enumerate(CATEGORY_TYPES)]
+
+
+def generate_questions(scale, seed=0):
+    """
+      Returns scale question rows spread over the default categories
+            Parameters:
+            <int> scale
+            <int> seed
+    """
+    rng = random.Random(seed)
+    return [{
+        'question': '{} {} number {}?'.format(
+            rng.choice(WORDS).capitalize(), ' '.join(rng.sample(WORDS, 4)), index),
+        'answer': ' '.join(rng.sample(WORDS, 2)),
+        'category': str(index % len(CATEGORY_TYPES) + 1),
+        'difficulty': rng.randint(1, 5)
+    } for index in range(scale)]
+
+
+def generate_drinks(scale, seed=0):
+    """
+      Returns scale drink rows with a json recipe short enough for String(180)
+            Parameters:
+            <int> scale
+            <int> seed
+    """
+    rng = random.Random(seed)
+    drinks = []
+    for index in range(scale):
+        recipe = [{'name': name, 'color': rng.choice(COLORS), 'parts': rng.randint(1, 3)}
+                  for name in rng.sample(INGREDIENTS, rng.randint(1, 3))]
+        drinks.append({'title': 'drink {}'.format(index),
+                       'recipe': json.dumps(recipe)})
+    return drinks
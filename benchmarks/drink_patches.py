@@ -0,0 +1,101 @@
+"""
+  Concurrent baristas incrementing a counter kept in a drink title,
+  through Drink.patch with and without the version check
+
+  Each writer reads the drink, then patches title = counter + 1.
+  With the version check every applied patch is counted exactly once and
+  conflicts are retried; without it concurrent patches overwrite each other.
+
+  Example:
+      python -m benchmarks.drink_patches --writers 8 --patches 200
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from .apps import COFFEE_DIR, import_from
+
+
+def writer(app, db, Drink, drink_id, patches, checked, counts):
+    """ Applies patches increments, retrying conflicts, and adds to counts """
+    applied = conflicts = 0
+    with app.app_context():
+        while applied < patches:
+            row = db.session.execute(Drink.__table__.select().where(
+                Drink.__table__.c.id == drink_id)).fetchone()
+            db.session.commit()
+            drink, status = Drink.patch(drink_id, {'title': str(int(row.title) + 1)},
+                                        row.version if checked else None)
+            if status == 409:
+                conflicts += 1
+            else:
+                applied += 1
+        db.session.remove()
+    with counts['lock']:
+        counts['applied'] += applied
+        counts['conflicts'] += conflicts
+
+
+def run(app, db, Drink, writers, patches, checked):
+    """ Returns the outcome of writers threads each applying patches increments """
+    with app.app_context():
+        drink = Drink(title='0', recipe='[]')
+        db.session.add(drink)
+        db.session.commit()
+        drink_id = drink.id
+
+    counts = {'applied': 0, 'conflicts': 0, 'lock': threading.Lock()}
+    threads = [threading.Thread(target=writer, args=(app, db, Drink, drink_id, patches, checked, counts))
+               for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        drink = Drink.query.get(drink_id)
+        counter = int(drink.title)
+    return {
+        'version_check': checked,
+        'applied': counts['applied'],
+        'conflicts': counts['conflicts'],
+        'counter': counter,
+        'lost_updates': counts['applied'] - counter,
+        'patches_per_second': round(counts['applied'] / elapsed, 1)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark concurrent drink patches')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--patches', type=int, default=200, help='patches applied by each writer')
+    parser.add_argument('--database', default=None,
+                        help='database path (default: a temporary SQLite file)')
+    args = parser.parse_args(argv)
+
+    import_from(COFFEE_DIR)
+    from flask import Flask
+    from src.database.models import db, Drink
+
+    directory = tempfile.mkdtemp(prefix='benchmarks-')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database or \
+        'sqlite:///' + os.path.join(directory, 'drinks.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    report = [run(app, db, Drink, args.writers, args.patches, checked) for checked in (True, False)]
+    print(json.dumps(report, indent=4))
+    return 0 if report[0]['lost_updates'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,146 @@
+"""
+  Load test of the trivia GET /events stream: thousands of subscribers
+  hold a stream open on a threaded WSGI server while questions are
+  created, and the time until every subscriber received each change
+  event is measured.
+
+  The subscribers are plain sockets served by one selector thread, so
+  the client side does not need a thread per subscriber.
+
+  Example:
+      python -m benchmarks.events --subscribers 2000 --events 20
+"""
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from wsgiref.simple_server import make_server
+
+from .apps import trivia
+from .harness import ThreadingWSGIServer, QuietHandler, percentile, peak_rss_kb
+
+EVENT_LINE = b'event: question\n'
+
+
+class EventsServer(ThreadingWSGIServer):
+    # every subscriber connects at once
+    request_queue_size = 4096
+
+
+class Subscribers:
+    """ Sockets reading /events, one selector thread records when each event arrived """
+
+    def __init__(self, port, count):
+        self.selector = selectors.DefaultSelector()
+        self.received = []
+        self.lock = threading.Lock()
+        request = b'GET /events HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n'
+        for number in range(count):
+            connection = socket.create_connection(('127.0.0.1', port))
+            connection.sendall(request)
+            connection.setblocking(False)
+            self.received.append([])
+            self.selector.register(connection, selectors.EVENT_READ, number)
+        self.running = True
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                data = key.fileobj.recv(65536)
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    continue
+                now = time.perf_counter()
+                with self.lock:
+                    self.received[key.data].extend([now] * data.count(EVENT_LINE))
+
+    def delivered(self, number):
+        """ Returns the arrival times of event number, one per subscriber that got it """
+        with self.lock:
+            return [times[number] for times in self.received if len(times) > number]
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the /events change feed')
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    # request logs go to stderr and only warnings, the subscribers would flood it
+    from fsnd_common import jsonlog
+    jsonlog.start_listener(sys.stderr, jsonlog.DEFAULT_QUEUE_SIZE, 'WARNING')
+    os.environ['EVENTS_MAX_SUBSCRIBERS'] = str(args.subscribers)
+    directory = tempfile.mkdtemp(prefix='benchmarks-')
+    app = trivia('sqlite:///' + os.path.join(directory, 'events.db'), 100)[0]
+
+    server = make_server('127.0.0.1', 0, app, server_class=EventsServer,
+                         handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threads = threading.active_count()
+    started = time.perf_counter()
+    subscribers = Subscribers(server.server_port, args.subscribers)
+    feeds = app.extensions['events']['feeds']
+    wait_for(lambda: None in feeds and feeds[None].subscribers == args.subscribers, args.timeout)
+    feed = feeds.get(None)
+    report = {
+        'subscribers': feed.subscribers if feed else 0,
+        'connect_s': round(time.perf_counter() - started, 3),
+        'server_threads': threading.active_count() - threads,
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+    fanout, delivery = [], []
+    url = 'http://127.0.0.1:{}/questions/new'.format(server.server_port)
+    for number in range(args.events):
+        body = json.dumps({'question': 'Event {}?'.format(number), 'answer': 'yes',
+                           'category': '1', 'difficulty': 1}).encode('utf-8')
+        request = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        sent = time.perf_counter()
+        urllib.request.urlopen(request).read()
+        wait_for(lambda: len(subscribers.delivered(number)) >= report['subscribers'],
+                 args.timeout)
+        arrivals = sorted((arrival - sent) * 1000.0 for arrival in subscribers.delivered(number))
+        delivery.extend(arrivals)
+        if arrivals:
+            fanout.append(arrivals[-1])
+    subscribers.close()
+    server.shutdown()
+
+    delivery.sort()
+    report.update({
+        'events': args.events,
+        'delivered': len(delivery),
+        'missed': report['subscribers'] * args.events - len(delivery),
+        'delivery_p50_ms': round(percentile(delivery, 0.5) or 0, 3),
+        'delivery_p99_ms': round(percentile(delivery, 0.99) or 0, 3),
+        'fanout_max_ms': round(max(fanout), 3) if fanout else None
+    })
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
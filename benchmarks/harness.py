@@ -0,0 +1,214 @@
+"""
+  Drives endpoints through the Flask test client or a real threaded
+  WSGI server and measures throughput, latency percentiles, SQL
+  statements per request and peak RSS
+"""
+
+import json
+import resource
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from sqlalchemy import event
+
+TEST_CLIENT = 'test_client'
+WSGI_SERVER = 'wsgi_server'
+
+
+class Scenario:
+    """
+      One endpoint to drive
+            Parameters:
+            <str> name
+            <str> method
+            <str|callable> path, a callable gets the request number
+            <dict> body, sent as json
+    """
+
+    def __init__(self, name, method, path, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+
+    def url(self, number):
+        return self.path(number) if callable(self.path) else self.path
+
+
+class SQLCounter:
+    """ Counts statements sent to an engine """
+
+    def __init__(self, engine=None):
+        self.count = 0
+        self.lock = threading.Lock()
+        if engine is not None:
+            event.listen(engine, 'before_cursor_execute', self.statement)
+
+    def statement(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(latencies, fraction):
+    """ Returns the nearest-rank percentile of sorted latencies """
+    if not latencies:
+        return None
+    index = min(len(latencies) - 1, max(0, int(round(fraction * len(latencies))) - 1))
+    return latencies[index]
+
+
+def peak_rss_kb():
+    """ Returns the peak resident set size of this process in KB (Linux units) """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def test_client_caller(app):
+    """ Returns a function issuing one request through a per-thread test client """
+    local = threading.local()
+
+    def call(scenario, number):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.open(scenario.url(number), method=scenario.method,
+                               json=scenario.body)
+        return response.status_code
+    return call
+
+
+def wsgi_server_caller(base_url):
+    """ Returns a function issuing one real HTTP request to base_url """
+
+    def call(scenario, number):
+        data = json.dumps(scenario.body).encode('utf-8') if scenario.body is not None else None
+        request = urllib.request.Request(base_url + scenario.url(number), data=data,
+                                         method=scenario.method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+    return call
+
+
+class WSGIServerThread:
+    """ Serves app on a free local port from a background thread """
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer,
+                                  handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_scenario(call, scenario, requests, concurrency, sql_counter=None):
+    """
+      Issues requests calls of scenario from concurrency threads
+      and returns the measured figures
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    statements_before = sql_counter.count if sql_counter else 0
+
+    def worker(number):
+        nonlocal errors
+        started = time.perf_counter()
+        status = call(scenario, number)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            # a 4xx would make latency and SQL per request figures meaningless
+            if not 200 <= status < 300:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def milliseconds(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(requests / elapsed, 1) if elapsed else None,
+        'p50_ms': milliseconds(percentile(latencies, 0.50)),
+        'p95_ms': milliseconds(percentile(latencies, 0.95)),
+        'p99_ms': milliseconds(percentile(latencies, 0.99)),
+        'sql_per_request': round((sql_counter.count - statements_before) / requests, 2)
+        if sql_counter else None
+    }
+
+
+def run_suite(app, scenarios, requests, concurrency, modes, engine=None):
+    """
+      Runs every scenario in every mode and returns the results
+      keyed by scenario name and mode
+    """
+    sql_counter = SQLCounter(engine)
+    results = {}
+    for mode in modes:
+        if mode == TEST_CLIENT:
+            call = test_client_caller(app)
+            for scenario in scenarios:
+                results.setdefault(scenario.name, {})[mode] = run_scenario(
+                    call, scenario, requests, concurrency, sql_counter)
+        elif mode == WSGI_SERVER:
+            with WSGIServerThread(app) as base_url:
+                call = wsgi_server_caller(base_url)
+                for scenario in scenarios:
+                    results.setdefault(scenario.name, {})[mode] = run_scenario(
+                        call, scenario, requests, concurrency, sql_counter)
+        else:
+            raise ValueError('Unknown mode: {}'.format(mode))
+    return results
+
+
+def check_regressions(baseline, report, threshold):
+    """
+      Compares two reports and returns the regressions, a scenario regresses
+      when its req/s drops or its p95/p99 grows by more than threshold (0.1 = 10%)
+    """
+    regressions = []
+    for app_name, scenarios in report['apps'].items():
+        for name, modes in scenarios.items():
+            for mode, result in modes.items():
+                try:
+                    before = baseline['apps'][app_name][name][mode]
+                except KeyError:
+                    continue
+                if before['rps'] and result['rps'] < before['rps'] * (1 - threshold):
+                    regressions.append('{} {} {}: rps {} -> {}'.format(
+                        app_name, name, mode, before['rps'], result['rps']))
+                for key in ('p95_ms', 'p99_ms'):
+                    if before[key] and result[key] > before[key] * (1 + threshold):
+                        regressions.append('{} {} {}: {} {} -> {}'.format(
+                            app_name, name, mode, key, before[key], result[key]))
+    return regressions
@@ -0,0 +1,89 @@
+"""
+  Compares the drink_ingredients index with loading every drink
+  and parsing its recipe, for the same ingredient filters
+
+  Example:
+      python -m benchmarks.ingredients --scale 10000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from .apps import COFFEE_DIR, import_from
+from .datagen import generate_drinks
+
+FILTERS = [
+    (['milk'], [], True),
+    (['milk', 'espresso'], [], True),
+    (['chocolate', 'cream'], [], False),
+    ([], ['#ffffff'], True)
+]
+
+
+def scan_and_parse(Drink, ingredients, colors, match_all):
+    """ Returns the ids of the matching drinks, json.loads on every recipe """
+    check = all if match_all else any
+    found = []
+    for drink in Drink.query.order_by(Drink.id).all():
+        recipe = json.loads(drink.recipe)
+        names = {entry['name'] for entry in recipe}
+        drink_colors = {entry['color'] for entry in recipe}
+        wanted = [name in names for name in ingredients] + [color in drink_colors for color in colors]
+        if check(wanted):
+            found.append(drink.id)
+    return found
+
+
+def timed(function, repeat):
+    """ Returns the result of function and its mean duration in ms """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, round((time.perf_counter() - started) * 1000.0 / repeat, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the drink ingredient index')
+    parser.add_argument('--scale', type=int, default=1000, help='number of synthetic drinks')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import_from(COFFEE_DIR)
+    from flask import Flask
+    from src.database.models import db, db_index_ingredients, Drink
+
+    directory = tempfile.mkdtemp(prefix='benchmarks-')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'drinks.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    report = {'scale': args.scale, 'filters': []}
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Drink.__table__.insert(), generate_drinks(args.scale))
+        db.session.commit()
+        db_index_ingredients()
+        for ingredients, colors, match_all in FILTERS:
+            scanned, scan_ms = timed(
+                lambda: scan_and_parse(Drink, ingredients, colors, match_all), args.repeat)
+            indexed, index_ms = timed(
+                lambda: [drink.id for drink in Drink.search(ingredients, colors, match_all)],
+                args.repeat)
+            assert scanned == indexed
+            report['filters'].append({
+                'ingredients': ingredients,
+                'colors': colors,
+                'match': 'all' if match_all else 'any',
+                'drinks': len(indexed),
+                'scan_ms': scan_ms,
+                'index_ms': index_ms
+            })
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
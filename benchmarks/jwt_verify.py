@@ -0,0 +1,90 @@
+"""
+  JWT verifications per second on one core, rebuilding the RSA key
+  from the JWK fields on every call as verify_decode_jwt used to,
+  and with the parsed keys cached per kid by the coffee shop KeyCache
+
+  Both sides get the JWKS from memory, the per request JWKS download
+  the old code also did is left out of the comparison.
+
+  Example:
+      python -m benchmarks.jwt_verify --seconds 3
+"""
+
+import argparse
+import base64
+import json
+import time
+
+from .apps import COFFEE_DIR, import_from
+
+KID = 'benchmark-key'
+
+
+def b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def signing_key():
+    """ Returns a fresh RSA private key in PEM and its public JWKS """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+    pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    jwks = {'keys': [{'kty': 'RSA', 'kid': KID, 'use': 'sig', 'alg': 'RS256',
+                      'n': b64_uint(numbers.n), 'e': b64_uint(numbers.e)}]}
+    return pem, jwks
+
+
+def rebuild_each_call(jwt, auth, jwks, token):
+    """ The previous verify_decode_jwt, minus the JWKS download """
+    unverified_header = jwt.get_unverified_header(token)
+    for key in jwks['keys']:
+        if key['kid'] == unverified_header['kid']:
+            rsa_key = {'kty': key['kty'], 'kid': key['kid'], 'use': key['use'],
+                       'n': key['n'], 'e': key['e']}
+    return jwt.decode(token, rsa_key, algorithms=auth.ALGORITHMS,
+                      audience=auth.API_AUDIENCE, issuer=auth.ISSUER)
+
+
+def per_second(function, seconds):
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        function()
+        calls += 1
+    return round(calls / (time.perf_counter() - started), 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark JWT verification')
+    parser.add_argument('--seconds', type=float, default=3.0, help='duration of each side')
+    args = parser.parse_args(argv)
+
+    import_from(COFFEE_DIR)
+    from jose import jwt
+    from src.auth import auth
+    from fsnd_common.jwks import RSAKey
+
+    pem, jwks = signing_key()
+    token = jwt.encode({'aud': auth.API_AUDIENCE, 'iss': auth.ISSUER, 'sub': 'barista',
+                        'exp': int(time.time()) + 3600, 'permissions': ['patch:drinks']},
+                       pem, algorithm='RS256', headers={'kid': KID})
+    auth.KEYS.load(jwks)
+    assert auth.verify_decode_jwt(token) == rebuild_each_call(jwt, auth, jwks, token)
+
+    print(json.dumps({
+        'backend': RSAKey.__name__,
+        'rebuild_each_call_per_second': per_second(
+            lambda: rebuild_each_call(jwt, auth, jwks, token), args.seconds),
+        'cached_keys_per_second': per_second(
+            lambda: auth.verify_decode_jwt(token), args.seconds)
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+  Request latency while stdout is a slow pipe, logging each request
+  with print() as the apps used to, and through jsonlog
+
+  A reader thread drains the pipe at --bytes-per-second, so once the
+  pipe buffer is full every print() waits for it while jsonlog drops
+  the records its queue can not hold.
+
+  Example:
+      python -m benchmarks.logging_latency --requests 3000 --bytes-per-second 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from flask import Flask, request
+
+from .harness import percentile
+
+CHUNK = 512
+QUEUE_SIZE = 100
+
+
+def throttled_stdout(bytes_per_second):
+    """ Returns a line buffered file whose reader drains it at bytes_per_second """
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        while True:
+            data = os.read(read_fd, CHUNK)
+            if not data:
+                return
+            time.sleep(len(data) / float(bytes_per_second))
+
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(write_fd, 'w', buffering=1)
+
+
+def print_app():
+    app = Flask('print_app')
+
+    @app.route('/drinks')
+    def drinks():
+        started = time.perf_counter()
+        # the same fields jsonlog writes for a request
+        print(json.dumps({'time': time.time(), 'level': 'INFO', 'logger': 'print_app.requests',
+                          'message': 'request', 'method': request.method, 'path': request.path,
+                          'status': 200, 'duration_ms': round(time.perf_counter() - started, 3),
+                          'request_id': uuid.uuid4().hex}))
+        return 'ok'
+
+    return app
+
+
+def jsonlog_app(stream):
+    from fsnd_common import jsonlog
+
+    app = Flask('jsonlog_app')
+    # a short queue, so the records left at exit drain quickly
+    app.config['LOG_QUEUE_SIZE'] = QUEUE_SIZE
+    jsonlog.setup_logging(app, stream)
+
+    @app.route('/drinks')
+    def drinks():
+        return 'ok'
+
+    return app
+
+
+def latencies(app, requests):
+    client = app.test_client()
+    measured = []
+    for number in range(requests):
+        started = time.perf_counter()
+        client.get('/drinks?page={}'.format(number))
+        measured.append((time.perf_counter() - started) * 1000.0)
+    measured.sort()
+    return {
+        'p50_ms': round(percentile(measured, 0.5), 3),
+        'p99_ms': round(percentile(measured, 0.99), 3),
+        'max_ms': round(measured[-1], 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark request logging with a slow stdout')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--bytes-per-second', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    report = {'requests': args.requests, 'bytes_per_second': args.bytes_per_second}
+    real_stdout = sys.stdout
+    sys.stdout = throttled_stdout(args.bytes_per_second)
+    try:
+        report['print'] = latencies(print_app(), args.requests)
+    finally:
+        sys.stdout = real_stdout
+    report['jsonlog'] = latencies(jsonlog_app(throttled_stdout(args.bytes_per_second)),
+                                  args.requests)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""
+  Modules shared by the apps of this repository: jsonlog (JSON line
+  request logging), eventfeed (Server-Sent Events change feed) and
+  jwks (Auth0 token checks, needs the auth extra).
+"""
@@ -0,0 +1,221 @@
+"""
+  In-memory change feed served as Server-Sent Events, of the trivia API
+  and the coffee shop backend.
+
+  Model hooks publish compact events into a ring buffer. A subscriber
+  only keeps a cursor, the id of the last event it was sent, so an event
+  costs one append whatever the number of listeners. A client that
+  reconnects with the Last-Event-ID header resumes after that event;
+  when the buffer no longer holds it, or the server restarted, the client
+  gets a `reset` event and should fetch the full list again.
+
+  The feed lives in the memory of one process and is not shared: a stream
+  only carries the changes made through the process serving it. Serve
+  /events, and every request that writes, from a single worker process
+  (e.g. `gunicorn -k gevent -w 1`); with several workers a subscriber
+  misses the changes of the others.
+
+  Listeners wait on one threading.Condition, which gevent monkey patching
+  turns into a greenlet wait, so under `gunicorn -k gevent` idle listeners
+  do not hold an OS thread each. Under a threaded server every open
+  stream holds a thread: EVENTS_MAX_SUBSCRIBERS bounds them and streams
+  end after EVENTS_STREAM_SECONDS, the browser reconnects and resumes.
+
+  Usage:
+      from fsnd_common import eventfeed
+      eventfeed.setup_events(app)
+      eventfeed.publish('drink', {'action': 'insert', 'id': 12})
+
+  Settings, from app.config or the environment:
+      EVENTS_BUFFER_SIZE        events kept for resuming clients, 1000 by default
+      EVENTS_MAX_SUBSCRIBERS    open streams per feed before new ones get a 503
+      EVENTS_HEARTBEAT_SECONDS  idle time before a keep-alive comment is sent
+      EVENTS_STREAM_SECONDS     lifetime of a stream, 0 keeps it open
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+
+from flask import Response, current_app, has_app_context, jsonify, request
+
+DEFAULT_BUFFER_SIZE = 1000
+DEFAULT_MAX_SUBSCRIBERS = 1000
+DEFAULT_HEARTBEAT_SECONDS = 15.0
+DEFAULT_STREAM_SECONDS = 300.0
+RETRY_SECONDS = 5
+RESET_EVENT = 'reset'
+
+
+class EventFeed:
+    """ Ring buffer of (id, name, json data) events, ids grow by one """
+
+    def __init__(self, capacity=DEFAULT_BUFFER_SIZE):
+        self.events = deque(maxlen=capacity)
+        self.last_id = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        # ids of another process or an earlier run of this one never match
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def publish(self, name, data):
+        """
+          Appends an event and wakes the waiting subscribers, returns its id
+                Parameters:
+                <str> name
+                <dict> data
+        """
+        with self.condition:
+            self.last_id += 1
+            self.events.append((self.last_id, name, json.dumps(data, separators=(',', ':'))))
+            self.condition.notify_all()
+            return self.last_id
+
+    def event_id(self, number):
+        return '{}-{}'.format(self.epoch, number)
+
+    def parse_id(self, event_id):
+        """ Returns the cursor of a Last-Event-ID value, None when it is not from this feed """
+        epoch, _, number = (event_id or '').partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def since(self, cursor):
+        """ Returns the events after cursor, None when some of them were dropped already """
+        with self.condition:
+            if cursor > self.last_id:
+                return None
+            if cursor == self.last_id:
+                return []
+            first = self.events[0][0]
+            if cursor < first - 1:
+                return None
+            return list(islice(self.events, cursor - first + 1, None))
+
+    def wait(self, cursor, timeout):
+        """ Returns the events after cursor once there are some, [] after timeout """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id != cursor, timeout)
+        return self.since(cursor)
+
+
+def setting(app, name, default):
+    return app.config.get(name, os.environ.get(name, default))
+
+
+def format_events(feed, events):
+    return ''.join('id: {}\nevent: {}\ndata: {}\n\n'.format(feed.event_id(number), name, data)
+                   for number, name, data in events)
+
+
+def stream(feed, cursor, heartbeat, lifetime):
+    """
+      Yields the server-sent events of feed after cursor, a reset
+      event first when cursor is None, until lifetime seconds passed
+            Parameters:
+            <object> EventFeed
+            <int> cursor
+            <float> heartbeat seconds
+            <float> lifetime seconds, 0 for no limit
+    """
+    yield 'retry: {}\n\n'.format(RETRY_SECONDS * 1000)
+    deadline = time.monotonic() + lifetime if lifetime else None
+    while True:
+        timeout = heartbeat
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+        events = feed.since(cursor) if cursor is not None else None
+        if events == []:
+            events = feed.wait(cursor, timeout)
+        if events is None:
+            cursor = feed.last_id
+            yield 'id: {}\nevent: {}\ndata: {{}}\n\n'.format(feed.event_id(cursor), RESET_EVENT)
+        elif events:
+            cursor = events[-1][0]
+            yield format_events(feed, events)
+        else:
+            # also finds out about clients that went away
+            yield ': keep-alive\n\n'
+
+
+def current_feed():
+    """ Returns the feed of the current app and feed key, None without setup_events """
+    if not has_app_context():
+        return None
+    feeds = current_app.extensions.get('events')
+    if feeds is None:
+        return None
+    key = feeds['key']()
+    feed = feeds['feeds'].get(key)
+    if feed is None:
+        with feeds['lock']:
+            feed = feeds['feeds'].setdefault(key, EventFeed(feeds['capacity']))
+    return feed
+
+
+def publish(name, data):
+    """
+      Publishes an event on the feed of the current app,
+      a no-op outside of an app context or without setup_events
+            Parameters:
+            <str> name
+            <dict> data
+    """
+    feed = current_feed()
+    return feed.publish(name, data) if feed is not None else None
+
+
+def setup_events(app, rule='/events', key=lambda: None):
+    """
+      Adds the GET rule Server-Sent Events stream of the changes published on app
+            Parameters:
+            <object> app
+            <str> rule
+            <function> key, returns the feed of a request, e.g. its tenant
+    """
+    app.extensions['events'] = {
+        'feeds': {},
+        'key': key,
+        'lock': threading.Lock(),
+        'capacity': int(setting(app, 'EVENTS_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+    }
+    max_subscribers = int(setting(app, 'EVENTS_MAX_SUBSCRIBERS', DEFAULT_MAX_SUBSCRIBERS))
+    heartbeat = float(setting(app, 'EVENTS_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS))
+    lifetime = float(setting(app, 'EVENTS_STREAM_SECONDS', DEFAULT_STREAM_SECONDS))
+
+    def events():
+        feed = current_feed()
+        with feed.condition:
+            if feed.subscribers >= max_subscribers:
+                response = jsonify({
+                    'success': False,
+                    'error': 503,
+                    'message': 'too many event subscribers'
+                })
+                response.status_code = 503
+                response.headers['Retry-After'] = str(RETRY_SECONDS)
+                return response
+            feed.subscribers += 1
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        # without an id the stream starts with the events published from now on
+        cursor = feed.last_id if last_event_id is None else feed.parse_id(last_event_id)
+        response = Response(stream(feed, cursor, heartbeat, lifetime),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        @response.call_on_close
+        def unsubscribe():
+            with feed.condition:
+                feed.subscribers -= 1
+
+        return response
+
+    app.add_url_rule(rule, 'events', events)
+    return app
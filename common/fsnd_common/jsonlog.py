@@ -0,0 +1,196 @@
+"""
+  Non-blocking JSON line logging of the trivia API, the coffee shop
+  backend, the flask recap server and the auth sample.
+
+  Request threads only put records on a bounded queue, a QueueListener
+  thread formats and writes them. When the writer falls behind (a slow
+  stdout pipe) records are dropped and counted instead of blocking requests.
+
+  Usage:
+      from fsnd_common import jsonlog
+      jsonlog.setup_logging(app)
+      logging.getLogger(__name__).info('something happened', extra={'question_id': 12})
+
+  Settings, from app.config or the environment:
+      LOG_LEVEL            INFO by default
+      LOG_SAMPLE_RATE      share of the successful requests logged, 1.0 by default,
+                           5xx responses are always logged
+      LOG_QUEUE_SIZE       records waiting for the writer before new ones are dropped
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import g, request, has_request_context
+
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_SAMPLE_RATE = 1.0
+DEFAULT_QUEUE_SIZE = 10000
+# at exit the writer gets this long to write the queued records
+FLUSH_SECONDS = 2.0
+REQUEST_ID_HEADER = 'X-Request-ID'
+# name of the queue handler on the root logger, shared by the copies of this module
+HANDLER_NAME = 'jsonlog'
+# LogRecord attributes, everything else on a record came from extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as one JSON object, extra fields included """
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """ Writes to sys.stdout as it is when a record is written, it may be replaced after setup """
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that drops records when the queue is full instead of blocking """
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.set_name(HANDLER_NAME)
+        self.setFormatter(JsonFormatter())
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+          Returns a copy of record with the arguments merged into the message and
+          the traceback formatted into exc_text, QueueHandler.prepare drops it
+        """
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self.formatter.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+        if self.dropped:
+            # reported by the next record that gets through
+            record.dropped_records = self.dropped
+            self.dropped = 0
+        return record
+
+
+def setting(app, name, default):
+    return app.config.get(name, os.environ.get(name, default))
+
+
+def flush(records, timeout=FLUSH_SECONDS):
+    """ Waits until the writer emptied records or timeout passed, its thread is a daemon """
+    deadline = time.monotonic() + timeout
+    while not records.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def start_listener(stream, queue_size, level):
+    """
+      Routes the root logger through a bounded queue to a JSON stream writer,
+      once per process, and returns the queue handler; handlers others added
+      to the root logger are left alone
+            Parameters:
+            <file> stream
+            <int> queue_size
+            <str> level
+    """
+    global _handler
+    with _lock:
+        root = logging.getLogger()
+        if _handler is None:
+            # another copy of this module may have started the writer already
+            _handler = next((handler for handler in root.handlers
+                             if handler.get_name() == HANDLER_NAME), None)
+        if _handler is None:
+            records = queue.Queue(maxsize=queue_size)
+            writer = logging.StreamHandler(stream) if stream else StdoutHandler()
+            writer.setFormatter(JsonFormatter())
+            listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+            listener.start()
+            atexit.register(flush, records)
+            _handler = DroppingQueueHandler(records)
+            _handler.listener = listener
+            root.addHandler(_handler)
+        root.setLevel(level)
+        return _handler
+
+
+def setup_logging(app, stream=None):
+    """
+      Logs every request of app as a JSON line with its request id and duration
+            Parameters:
+            <object> app
+            <file> stream, sys.stdout by default
+    """
+    start_listener(stream, int(setting(app, 'LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+                   str(setting(app, 'LOG_LEVEL', DEFAULT_LEVEL)).upper())
+    sample_rate = float(setting(app, 'LOG_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))
+    logger = logging.getLogger(app.import_name + '.requests')
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+    @app.after_request
+    def log_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        if response.status_code >= 500 or random.random() < sample_rate:
+            logger.info('request', extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - started) * 1000.0, 3)
+            })
+        return response
+
+    return app
+
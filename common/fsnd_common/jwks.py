@@ -0,0 +1,111 @@
+"""
+  Auth0 token checks of the coffee shop backend and the auth sample,
+  needs the auth extra (python-jose).
+
+  KeyCache keeps the Auth0 public keys parsed per kid and refetches the
+  JWKS when a token with a new kid shows up. check_claims rejects tokens
+  for another audience or issuer, or expired ones, before the RSA
+  signature is verified. Both raise AuthError.
+"""
+
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+from jose.exceptions import JWKError
+
+# prefer the cryptography backend, jose falls back to pycryptodome or pure python rsa
+try:
+    from jose.backends.cryptography_backend import CryptographyRSAKey as RSAKey
+except ImportError:
+    from jose.jwk import RSAKey
+
+# an unknown kid refetches the JWKS at most this often
+JWKS_REFRESH_SECONDS = 300
+JWKS_TIMEOUT_SECONDS = 10
+
+
+class AuthError(Exception):
+    """ A standardized way to communicate auth failure modes """
+
+    def __init__(self, error, status_code):
+        self.error = error
+        self.status_code = status_code
+
+
+class KeyCache:
+    """
+      The public keys of a JWKS url per kid, parsed into key objects once
+      instead of on every verification
+            Parameters:
+            <str> url
+            <str> algorithm of the keys
+            <float> refresh_seconds, least time between two fetches
+    """
+
+    def __init__(self, url, algorithm='RS256', refresh_seconds=JWKS_REFRESH_SECONDS):
+        self.url = url
+        self.algorithm = algorithm
+        self.refresh_seconds = refresh_seconds
+        self.keys = {}
+        self.fetched_at = None
+        self.lock = threading.Lock()
+
+    def load(self, jwks):
+        """ Replaces the keys with the RSA keys of a parsed JWKS document """
+        self.keys = {
+            key['kid']: RSAKey({
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }, self.algorithm)
+            for key in jwks['keys'] if key.get('kty') == 'RSA'
+        }
+        self.fetched_at = time.monotonic()
+
+    def fetch(self):
+        """ Loads the keys from url, raises a 503 AuthError when they can not be fetched """
+        try:
+            self.load(json.loads(urlopen(self.url, timeout=JWKS_TIMEOUT_SECONDS).read()))
+        except (OSError, ValueError, KeyError, TypeError, JWKError):
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+
+    def get(self, kid):
+        """ Returns the key of kid, None when the JWKS has no such key """
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        with self.lock:
+            if kid not in self.keys and (self.fetched_at is None or
+                                         time.monotonic() - self.fetched_at >= self.refresh_seconds):
+                self.fetch()
+            return self.keys.get(kid)
+
+
+def check_claims(claims, audience, issuer):
+    """
+      Raises a 401 AuthError when the unverified claims are for another
+      audience or issuer, or expired
+            Parameters:
+            <dict> claims
+            <str> audience
+            <str> issuer
+    """
+    audiences = claims.get('aud')
+    audiences = audiences if isinstance(audiences, list) else [audiences]
+    if audience not in audiences or claims.get('iss') != issuer:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims. Please, check the audience and issuer.'
+        }, 401)
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] < time.time():
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
@@ -0,0 +1,11 @@
+from setuptools import setup
+
+setup(
+    name='fsnd-common',
+    version='0.1.0',
+    description='Logging, change feed and Auth0 token checks shared by the apps of this repository',
+    packages=['fsnd_common'],
+    python_requires='>=3.6',
+    install_requires=['Flask>=1.0'],
+    extras_require={'auth': ['python-jose[cryptography]>=3.3']}
+)
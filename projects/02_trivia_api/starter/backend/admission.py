@@ -0,0 +1,119 @@
+"""
+  Admission control for the expensive endpoints: a token bucket per
+  client and endpoint class limits the request rate, and a concurrency
+  limit per endpoint class sheds requests beyond it at once, so one
+  client can not hold every database connection.
+
+  Buckets live in a MemoryBackend by default, counted per process.
+  Any object with the MemoryBackend.take signature can replace it to
+  share the buckets between processes, e.g. one backed by Redis.
+"""
+
+import math
+import threading
+import time
+
+# endpoint -> endpoint class
+ENDPOINT_CLASSES = {
+    'search_question': 'search',
+    'play_quiz': 'quiz'
+}
+# per endpoint class: requests per second and burst per client, concurrent requests;
+# the suggested ADMISSION_LIMITS config, the app does not limit requests without it
+ADMISSION_LIMITS = {
+    'search': {'rate': 5.0, 'burst': 20, 'concurrency': 8},
+    'quiz': {'rate': 5.0, 'burst': 20, 'concurrency': 8}
+}
+MAX_BUCKETS = 10000
+SHED_RETRY_SECONDS = 1
+RATE_LIMITED = 429
+OVERLOADED = 503
+
+
+class MemoryBackend:
+    """ Token buckets of this process, full buckets are dropped beyond max_buckets """
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        # key -> (tokens, updated, full_at)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """
+          Takes cost tokens from the bucket of key, refilled at rate per second
+          up to burst; returns 0 when they were taken, else the seconds to wait
+                Parameters:
+                <str> key
+                <float> rate
+                <int> burst
+                <int> cost
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            if key not in self.buckets and len(self.buckets) >= self.max_buckets:
+                self.sweep(now)
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+    def sweep(self, now):
+        """ Drops the buckets that refilled, a new bucket starts full anyway """
+        for key in [key for key, bucket in self.buckets.items() if bucket[2] <= now]:
+            del self.buckets[key]
+
+
+class AdmissionControl:
+    """
+      Admits or rejects requests of the limited endpoint classes
+            Parameters:
+            <dict> limits, endpoint class -> {rate, burst, concurrency}
+            <object> backend, MemoryBackend by default
+    """
+
+    def __init__(self, limits=None, backend=None):
+        self.limits = ADMISSION_LIMITS if limits is None else limits
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.active = {name: 0 for name in self.limits}
+        self.rejected = {name: {RATE_LIMITED: 0, OVERLOADED: 0} for name in self.limits}
+        self.lock = threading.Lock()
+
+    def admit(self, endpoint_class, client):
+        """
+          Returns (None, 0) and takes a concurrency slot when the request
+          may run, else (429 or 503, seconds the client should wait)
+                Parameters:
+                <str> endpoint_class
+                <str> client
+        """
+        limits = self.limits[endpoint_class]
+        wait = self.backend.take('{}|{}'.format(endpoint_class, client),
+                                 limits['rate'], limits['burst'])
+        with self.lock:
+            if wait:
+                self.rejected[endpoint_class][RATE_LIMITED] += 1
+                return RATE_LIMITED, max(1, int(math.ceil(wait)))
+            if self.active[endpoint_class] >= limits['concurrency']:
+                self.rejected[endpoint_class][OVERLOADED] += 1
+                return OVERLOADED, SHED_RETRY_SECONDS
+            self.active[endpoint_class] += 1
+        return None, 0
+
+    def release(self, endpoint_class):
+        """ Gives back the concurrency slot of an admitted request """
+        with self.lock:
+            self.active[endpoint_class] -= 1
+
+    def metrics(self):
+        """ Returns the running and rejected requests per endpoint class """
+        with self.lock:
+            return {name: {'active': self.active[name],
+                           'rate_limited': self.rejected[name][RATE_LIMITED],
+                           'overloaded': self.rejected[name][OVERLOADED]}
+                    for name in self.limits}
@@ -0,0 +1,199 @@
+"""
+  Precomputed normalized answers and fuzzy matching,
+  used to check quiz answers on the server.
+"""
+
+import re
+import threading
+
+from suggestions import normalize
+
+MIN_SIMILARITY = 0.8
+ARTICLES = ('the ', 'a ', 'an ')
+ALTERNATIVES = re.compile(r'\s*(?:/|\bor\b)\s*')
+PARENTHESES = re.compile(r'\([^)]*\)')
+NUMBERS = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight',
+           'nine', 'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen',
+           'sixteen', 'seventeen', 'eighteen', 'nineteen', 'twenty']
+NUMBER_WORDS = {str(number): word for number, word in enumerate(NUMBERS)}
+NUMBER_WORDS.update({word: str(number) for number, word in enumerate(NUMBERS)})
+
+
+def aliases(answer):
+    """
+      Returns the normalized forms an answer is accepted in:
+      alternatives split on "/" or "or", without parentheses,
+      without a leading article and with numbers as digits or words
+            Parameters:
+            <str> answer
+    """
+    accepted = set()
+    for text in [answer or ''] + ALTERNATIVES.split(answer or ''):
+        for variant in (text, PARENTHESES.sub(' ', text)):
+            normalized = normalize(variant)
+            if not normalized:
+                continue
+            accepted.add(normalized)
+            for article in ARTICLES:
+                if normalized.startswith(article):
+                    accepted.add(normalized[len(article):])
+            words = normalized.split()
+            if any(word in NUMBER_WORDS for word in words):
+                accepted.add(' '.join(NUMBER_WORDS.get(word, word) for word in words))
+    return accepted
+
+
+def trigrams(text):
+    """ Returns the character trigrams of text padded with spaces """
+    padded = '  {} '.format(text)
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def words(text):
+    """ Returns the words of normalized text, number words as digits """
+    return tuple(word if word.isdigit() else NUMBER_WORDS.get(word, word)
+                 for word in text.split())
+
+
+def typo_limit(word):
+    """ Returns the edits accepted in a word, none below four characters, one per five after """
+    return 0 if len(word) < 4 else max(1, len(word) // 5)
+
+
+def bounded_edit_distance(first, second, limit):
+    """
+      Returns the Levenshtein distance of two strings,
+      or limit + 1 as soon as it is known to exceed limit
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def word_distance(guess, alias):
+    """
+      Returns the edits between the words of a guess and of an accepted
+      answer, None when a word is missing or added, a number differs or
+      a word has more typos than typo_limit accepts
+            Parameters:
+            <tuple> guess words
+            <tuple> alias words
+    """
+    if len(guess) != len(alias):
+        return None
+    total = 0
+    for guessed, expected in zip(guess, alias):
+        limit = 0 if expected.isdigit() else typo_limit(expected)
+        distance = bounded_edit_distance(guessed, expected, limit)
+        if distance > limit:
+            return None
+        total += distance
+    return total
+
+
+class AnswerIndex:
+    """
+      Normalized answer aliases with their words and trigram sets per
+      question id, computed once so a check only normalizes the submitted answer
+    """
+
+    def __init__(self):
+        self.answers = {}
+        self.accepted = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+          Returns an index of (id, answer) rows
+                Parameters:
+                <iterable> rows
+        """
+        index = cls()
+        for question_id, answer in rows:
+            index.add(question_id, answer)
+        return index
+
+    def add(self, question_id, answer):
+        """ Adds or replaces the answer of a question """
+        accepted = {alias: (words(alias), trigrams(alias)) for alias in aliases(answer)}
+        with self.lock:
+            self.answers[question_id] = answer
+            self.accepted[question_id] = accepted
+
+    def remove(self, question_id):
+        """ Removes a question, unknown ids are ignored """
+        with self.lock:
+            self.answers.pop(question_id, None)
+            self.accepted.pop(question_id, None)
+
+    def apply(self, action, question):
+        """ Applies a question insert, update or delete to the index """
+        if action == 'delete':
+            self.remove(question['id'])
+        else:
+            self.add(question['id'], question['answer'])
+
+    def check(self, question_id, submitted, min_similarity=MIN_SIMILARITY, reveal=True):
+        """
+          Returns the check result of one submitted answer,
+          None when the question is unknown
+                Parameters:
+                <int> question_id
+                <str> submitted
+                <float> min_similarity
+                <bool> reveal, False leaves the expected answer out of wrong results
+        """
+        with self.lock:
+            accepted = self.accepted.get(question_id)
+            answer = self.answers.get(question_id)
+        if accepted is None:
+            return None
+        guess = normalize(submitted)
+        correct = guess in accepted
+        similarity = 1.0 if correct else 0.0
+        if guess and not correct:
+            guess_words = words(guess)
+            guess_trigrams = trigrams(guess)
+            for alias, (alias_words, alias_trigrams) in accepted.items():
+                shared = len(guess_trigrams & alias_trigrams)
+                score = 2.0 * shared / (len(guess_trigrams) + len(alias_trigrams))
+                # every word and number must be there, words with a few typos at most
+                distance = word_distance(guess_words, alias_words)
+                if distance is not None:
+                    # short answers have few trigrams, one typo costs too many of them
+                    score = max(score, 1.0 - distance / float(max(len(alias), len(guess))))
+                    correct = correct or score >= min_similarity
+                similarity = max(similarity, score)
+        result = {
+            'question_id': question_id,
+            'correct': correct,
+            'similarity': round(similarity, 3)
+        }
+        if correct or reveal:
+            result['answer'] = answer
+        return result
+
+    def check_many(self, submissions, min_similarity=MIN_SIMILARITY, reveal=True):
+        """
+          Returns the check results of (question_id, answer) pairs,
+          unknown questions are reported as not found
+        """
+        results = []
+        for question_id, submitted in submissions:
+            result = self.check(question_id, submitted, min_similarity, reveal)
+            results.append(result if result is not None else {
+                'question_id': question_id,
+                'correct': False,
+                'found': False
+            })
+        return results
@@ -0,0 +1,444 @@
+""" This file contains micro benchmarks for trivia app """
+
+import json
+import os
+import random
+import tempfile
+import time
+import threading
+import timeit
+import unittest
+import urllib.request
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+from flaskr import create_app, columnar_questions, filter_query
+from suggestions import SuggestIndex
+from answers import AnswerIndex
+from duplicates import DuplicateIndex, shingles
+from leaderboard import Leaderboard, GLOBAL_BOARD
+from snapshot import QuestionSnapshot, write_snapshot
+from query_engine import QuestionEngine, numpy
+from admission import ADMISSION_LIMITS
+import models
+
+NUMBER_OF_QUESTIONS = 10000
+REPEAT = 20
+
+
+class BenchQuestion:
+    """ Plain stand in for a Question row, mirrors Question.format() """
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self):
+        """ Serialize the question the same way Question.format() does """
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+
+def generate_rows(number_of_questions):
+    """ Returns synthetic question row tuples """
+    return [(i, 'What is question number {}?'.format(i), 'Answer {}'.format(i),
+             str(i % 6 + 1), i % 5 + 1) for i in range(number_of_questions)]
+
+
+def bench_question_formats(number_of_questions=NUMBER_OF_QUESTIONS):
+    """
+      Compares the default format() path with the columnar path
+            Parameters:
+            <int> number_of_questions
+    """
+    rows = generate_rows(number_of_questions)
+    objects = [BenchQuestion(*row) for row in rows]
+
+    def default_format():
+        return json.dumps([question.format() for question in objects])
+
+    def columnar_format():
+        return json.dumps(columnar_questions(rows))
+
+    results = {}
+    for name, encode in (('format', default_format), ('columnar', columnar_format)):
+        seconds = min(timeit.repeat(encode, number=1, repeat=REPEAT))
+        results[name] = {'bytes': len(encode()), 'ms': round(seconds * 1000, 3)}
+    return results
+
+
+def bench_suggest(number_of_questions=NUMBER_OF_QUESTIONS * 10, lookups=1000):
+    """
+      Builds the prefix index of synthetic questions and
+      returns the build time and the mean time per top-10 lookup
+            Parameters:
+            <int> number_of_questions
+            <int> lookups
+    """
+    rows = [(row[0], row[1]) for row in generate_rows(number_of_questions)]
+    started = time.perf_counter()
+    index = SuggestIndex.build(rows)
+    build_seconds = time.perf_counter() - started
+    prefixes = ['w', 'wha', 'what is question', 'question number 9', 'numb', 'zz']
+    seconds = min(timeit.repeat(
+        lambda: [index.suggest(prefix) for prefix in prefixes],
+        number=lookups // len(prefixes), repeat=5))
+    return {'questions': number_of_questions,
+            'build_s': round(build_seconds, 3),
+            'lookup_ms': round(seconds * 1000 / (lookups // len(prefixes) * len(prefixes)), 4)}
+
+
+def bench_answer_checks(number_of_questions=NUMBER_OF_QUESTIONS, checks=10000):
+    """
+      Returns answer checks per second against the answer index,
+      a third exact, a third misspelled and a third wrong
+            Parameters:
+            <int> number_of_questions
+            <int> checks
+    """
+    rows = generate_rows(number_of_questions)
+    index = AnswerIndex.build((row[0], row[2]) for row in rows)
+    submissions = []
+    for number in range(checks):
+        question_id, answer = rows[number % number_of_questions][0], rows[number % number_of_questions][2]
+        submissions.append((question_id, [answer, answer.replace('Answer', 'Anwser'),
+                                          'something else'][number % 3]))
+    seconds = min(timeit.repeat(lambda: index.check_many(submissions), number=1, repeat=5))
+    return {'checks': checks, 'checks_per_second': round(checks / seconds)}
+
+
+def bench_duplicates(number_of_questions=5000, near_duplicates=500):
+    """
+      Returns the recall and lookup latency of the LSH duplicate index
+      for near duplicates (one word dropped, one typo) of indexed questions,
+      next to the latency of comparing against every question
+            Parameters:
+            <int> number_of_questions
+            <int> near_duplicates
+    """
+    generator = random.Random(7)
+    words = ['river', 'planet', 'painted', 'capital', 'element', 'author', 'largest',
+             'famous', 'ocean', 'country', 'king', 'song', 'won', 'first', 'team',
+             'movie', 'year', 'invented', 'discovered', 'city', 'mountain', 'language']
+    texts = ['{} {}?'.format(generator.choice(['What', 'Which', 'Who']),
+                             ' '.join(generator.choice(words) for i in range(10)))
+             for i in range(number_of_questions)]
+    started = time.perf_counter()
+    index = DuplicateIndex.build((i, text, None) for i, text in enumerate(texts))
+    build_seconds = time.perf_counter() - started
+
+    queries = []
+    for question_id in generator.sample(range(number_of_questions), near_duplicates):
+        tokens = texts[question_id].split()
+        del tokens[generator.randrange(1, len(tokens))]
+        tokens[0] = tokens[0][:-1]
+        queries.append((question_id, ' '.join(tokens)))
+
+    started = time.perf_counter()
+    found = sum(any(duplicate['id'] == question_id for duplicate in index.find(text))
+                for question_id, text in queries)
+    lookup_seconds = time.perf_counter() - started
+
+    question_shingles = [shingles(text) for text in texts]
+    started = time.perf_counter()
+    for question_id, text in queries[:20]:
+        query = shingles(text)
+        [len(query & other) / float(len(query | other)) for other in question_shingles]
+    pairwise_seconds = (time.perf_counter() - started) / 20
+
+    return {'questions': number_of_questions,
+            'build_s': round(build_seconds, 3),
+            'recall': round(found / float(near_duplicates), 3),
+            'lookup_ms': round(lookup_seconds * 1000 / near_duplicates, 3),
+            'pairwise_lookup_ms': round(pairwise_seconds * 1000, 3)}
+
+
+def bench_leaderboard(players=100000, lookups=1000):
+    """
+      Compares rank and top-10 lookups on the in-memory leaderboard
+      with the ORDER BY and COUNT queries on a SQLite scores table
+            Parameters:
+            <int> players
+            <int> lookups
+    """
+    generator = random.Random(3)
+    rows = [('player {}'.format(i), GLOBAL_BOARD, generator.randrange(1000))
+            for i in range(players)]
+    started = time.perf_counter()
+    board = Leaderboard.build(rows)
+    build_seconds = time.perf_counter() - started
+    names = [rows[generator.randrange(players)][0] for i in range(lookups)]
+
+    directory = tempfile.mkdtemp(prefix='bench_flaskr')
+    app = create_app({'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'scores.db'),
+                      'CREATE_SCHEMA': True})
+    with app.app_context():
+        table = models.Score.__table__
+        models.DB.session.execute(table.insert(), [
+            {'player': player, 'category': category, 'score': score, 'updated_at': 0}
+            for player, category, score in rows])
+        models.DB.session.commit()
+
+        def sql_lookups():
+            for name in names:
+                score = models.DB.session.query(table.c.score).filter(
+                    table.c.player == name, table.c.category == GLOBAL_BOARD).scalar()
+                models.DB.session.query(models.DB.func.count()).select_from(table).filter(
+                    table.c.category == GLOBAL_BOARD, table.c.score > score).scalar()
+            models.DB.session.query(table).filter(table.c.category == GLOBAL_BOARD).order_by(
+                table.c.score.desc(), table.c.player).limit(10).all()
+
+        sql_seconds = min(timeit.repeat(sql_lookups, number=1, repeat=3))
+
+    def memory_lookups():
+        for name in names:
+            board.player(name)
+        board.top(GLOBAL_BOARD, 10)
+
+    memory_seconds = min(timeit.repeat(memory_lookups, number=1, repeat=5))
+    return {'players': players,
+            'build_s': round(build_seconds, 3),
+            'memory_rank_us': round(memory_seconds * 1e6 / lookups, 3),
+            'sql_rank_us': round(sql_seconds * 1e6 / lookups, 3)}
+
+
+def bench_snapshot(number_of_questions=NUMBER_OF_QUESTIONS, requests=200):
+    """
+      Compares GET /questions and /categories/<id>/questions served
+      from the memory-mapped question snapshot with the database queries
+            Parameters:
+            <int> number_of_questions
+            <int> requests
+    """
+    directory = tempfile.mkdtemp(prefix='bench_flaskr')
+    config = {'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'snapshot.db'),
+              'CREATE_SCHEMA': True, 'SNAPSHOT_DIR': directory}
+    app = create_app(config)
+    with app.app_context():
+        models.DB.session.execute(models.Category.__table__.insert(), [
+            {'type': 'Category {}'.format(i)} for i in range(1, 7)])
+        models.DB.session.execute(models.Question.__table__.insert(), [
+            dict(zip(('question', 'answer', 'category', 'difficulty'), row[1:]))
+            for row in generate_rows(number_of_questions)])
+        models.DB.session.commit()
+    generator = random.Random(5)
+    paths = ['/questions?page={}'.format(generator.randrange(1, 100)) if i % 2 else
+             '/categories/{}/questions'.format(generator.randrange(1, 7))
+             for i in range(requests)]
+    client = app.test_client()
+    database_client = create_app(dict(config, QUESTION_SNAPSHOT=False)).test_client()
+
+    started = time.perf_counter()
+    client.get('/questions')
+    write_seconds = time.perf_counter() - started
+    results = {'questions': number_of_questions,
+               'snapshot_write_ms': round(write_seconds * 1000, 3)}
+    for name, bench_client in (('snapshot', client), ('database', database_client)):
+        seconds = min(timeit.repeat(lambda: [bench_client.get(path) for path in paths],
+                                    number=1, repeat=3))
+        results[name + '_request_ms'] = round(seconds * 1000 / requests, 3)
+    return results
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_batch(number_of_questions=1000, repeat=REPEAT):
+    """
+      Compares the first load of the frontend, GET /categories,
+      /questions?page=1 and /categories/1/questions, as three
+      sequential HTTP calls and as one POST /batch
+            Parameters:
+            <int> number_of_questions
+            <int> repeat
+    """
+    directory = tempfile.mkdtemp(prefix='bench_flaskr')
+    app = create_app({'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'batch.db'),
+                      'CREATE_SCHEMA': True, 'QUESTION_SNAPSHOT': False})
+    with app.app_context():
+        models.DB.session.execute(models.Category.__table__.insert(), [
+            {'type': 'Category {}'.format(i)} for i in range(1, 7)])
+        models.DB.session.execute(models.Question.__table__.insert(), [
+            dict(zip(('question', 'answer', 'category', 'difficulty'), row[1:]))
+            for row in generate_rows(number_of_questions)])
+        models.DB.session.commit()
+    server = make_server('127.0.0.1', 0, app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    paths = ['/categories', '/questions?page=1', '/categories/1/questions']
+
+    def sequential():
+        for path in paths:
+            urllib.request.urlopen(base_url + path).read()
+
+    def batch():
+        body = json.dumps({'requests': [{'path': path} for path in paths]}).encode('utf-8')
+        urllib.request.urlopen(urllib.request.Request(
+            base_url + '/batch', data=body, headers={'Content-Type': 'application/json'})).read()
+
+    results = {name: {'ms': round(min(timeit.repeat(call, number=1, repeat=repeat)) * 1000, 3)}
+               for name, call in (('sequential', sequential), ('batch', batch))}
+    server.shutdown()
+    return results
+
+
+def bench_admission(number_of_questions=NUMBER_OF_QUESTIONS, abusers=4, requests=40):
+    """
+      Compares the search latency of a client within its rate limit
+      alone, and while abusers threads flood POST /questions/search
+      without and with admission control
+            Parameters:
+            <int> number_of_questions
+            <int> abusers
+            <int> requests
+    """
+    directory = tempfile.mkdtemp(prefix='bench_flaskr')
+    database_path = 'sqlite:///' + os.path.join(directory, 'admission.db')
+    setup = create_app({'DATABASE_PATH': database_path, 'CREATE_SCHEMA': True})
+    with setup.app_context():
+        models.DB.session.execute(models.Question.__table__.insert(), [
+            dict(zip(('question', 'answer', 'category', 'difficulty'), row[1:]))
+            for row in generate_rows(number_of_questions)])
+        models.DB.session.commit()
+
+    def run(config, abusers=abusers):
+        app = create_app(dict(config, DATABASE_PATH=database_path, SNAPSHOT_DIR=directory))
+
+        def search(address):
+            return app.test_client().post('/questions/search', json={'searchTerm': 'number 1'},
+                                          environ_base={'REMOTE_ADDR': address}).status_code
+
+        stop = threading.Event()
+
+        def abuse():
+            while not stop.is_set():
+                search('10.0.0.66')
+
+        threads = [threading.Thread(target=abuse) for _ in range(abusers)]
+        for thread in threads:
+            thread.start()
+        latencies = []
+        try:
+            for _ in range(requests):
+                started = time.perf_counter()
+                search('10.0.0.1')
+                latencies.append((time.perf_counter() - started) * 1000)
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        latencies.sort()
+        return {'p50_ms': round(latencies[len(latencies) // 2], 3),
+                'p99_ms': round(latencies[int(0.99 * len(latencies))], 3)}
+
+    return {'no_abuse': run({}, abusers=0),
+            'without_limits': run({'ADMISSION_LIMITS': {}}),
+            'with_limits': run({'ADMISSION_LIMITS': ADMISSION_LIMITS})}
+
+
+def bench_query_engine(sizes=(100000, 1000000), repeat=5):
+    """
+      Compares "categories 2 or 5, difficulty at least 3, minus 100 ids"
+      evaluated by the NumPy engine on a snapshot, a list comprehension
+      over question objects and a SQLite query
+            Parameters:
+            <tuple> sizes, numbers of questions
+            <int> repeat
+    """
+    if numpy is None:
+        return {'skipped': 'NumPy is not installed'}
+    results = {}
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='bench_flaskr')
+        rows = generate_rows(size)
+        excluded = random.Random(7).sample(range(size), 100)
+        filters = {'categories': ['2', '5'], 'min_difficulty': 3, 'exclude_ids': excluded}
+
+        write_snapshot(os.path.join(directory, 'questions.snap'), 1, rows)
+        engine = QuestionEngine.from_snapshot(
+            QuestionSnapshot(os.path.join(directory, 'questions.snap')))
+        objects = [BenchQuestion(*row) for row in rows]
+        excluded_set = set(excluded)
+
+        def python_filter():
+            return [question.id for question in objects
+                    if question.category in ('2', '5') and question.difficulty >= 3
+                    and question.id not in excluded_set]
+
+        app = create_app({'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'engine.db'),
+                          'CREATE_SCHEMA': True})
+        with app.app_context():
+            models.DB.session.execute(models.Question.__table__.insert(), [
+                dict(zip(('id', 'question', 'answer', 'category', 'difficulty'), row))
+                for row in rows])
+            models.DB.session.commit()
+            query = filter_query(models.Question.query.with_entities(models.Question.id),
+                                 **filters)
+            sql_ids = [row[0] for row in query.order_by(models.Question.id)]
+            sql_seconds = min(timeit.repeat(query.all, number=1, repeat=3))
+
+        assert engine.ids[engine.select(**filters)].tolist() == python_filter() == sql_ids
+        results[size] = {
+            'matches': len(sql_ids),
+            'numpy_ms': round(min(timeit.repeat(lambda: engine.select(**filters), number=1,
+                                                repeat=repeat)) * 1000, 3),
+            'python_ms': round(min(timeit.repeat(python_filter, number=1, repeat=repeat)) * 1000, 3),
+            'sql_ms': round(sql_seconds * 1000, 3)
+        }
+    return results
+
+
+def bench_cold_start(repeat=REPEAT):
+    """
+      Compares create_app() checking the schema on every construction,
+      the old setup_db behaviour, with the default lazy schema creation
+    """
+    directory = tempfile.mkdtemp(prefix='bench_flaskr')
+    config = {'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'trivia.db')}
+
+    def schema_every_time():
+        models.SCHEMA_CREATED.clear()
+        create_app(dict(config, CREATE_SCHEMA=True))
+
+    def lazy_schema():
+        create_app(config)
+
+    return {name: {'ms': round(min(timeit.repeat(start, number=1, repeat=repeat)) * 1000, 3)}
+            for name, start in (('schema_every_time', schema_every_time),
+                                ('lazy_schema', lazy_schema))}
+
+
+def bench_test_suite():
+    """ Runs the TriviaTestCase suite once and returns its wall time """
+    import test_flaskr
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(test_flaskr.TriviaTestCase)
+    started = time.perf_counter()
+    result = unittest.TextTestRunner(stream=open(os.devnull, 'w')).run(suite)
+    return {'tests': result.testsRun, 'failures': len(result.failures) + len(result.errors),
+            'seconds': round(time.perf_counter() - started, 3)}
+
+
+if __name__ == "__main__":
+    print(json.dumps({
+        'question_formats': bench_question_formats(),
+        'suggest': bench_suggest(),
+        'answer_checks': bench_answer_checks(),
+        'duplicates': bench_duplicates(),
+        'leaderboard': bench_leaderboard(),
+        'snapshot': bench_snapshot(),
+        'batch': bench_batch(),
+        'admission': bench_admission(),
+        'query_engine': bench_query_engine(),
+        'cold_start': bench_cold_start(),
+        'test_suite': bench_test_suite()
+    }, indent=4))
@@ -0,0 +1,184 @@
+"""
+  MinHash signatures and an LSH bucket index over question texts,
+  used to find near-duplicate questions without comparing every pair.
+"""
+
+import random
+import threading
+import zlib
+
+from suggestions import normalize
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+MIN_SIMILARITY = 0.7
+PRIME = 4294967311
+SEED = 1987
+
+
+def permutations(seed):
+    """ Returns the (a, b) pairs of the universal hash functions h(x) = (a * x + b) % PRIME """
+    generator = random.Random(seed)
+    return [(generator.randrange(1, PRIME), generator.randrange(0, PRIME))
+            for i in range(NUM_PERMUTATIONS)]
+
+
+PERMUTATIONS = permutations(SEED)
+
+
+def shingles(text):
+    """
+      Returns the hashed character shingles of the normalized text
+            Parameters:
+            <str> text
+    """
+    normalized = normalize(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        return {zlib.crc32(normalized.encode('utf-8'))} if normalized else set()
+    return {zlib.crc32(normalized[i:i + SHINGLE_SIZE].encode('utf-8'))
+            for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    """ Returns the MinHash signature of text, a tuple of NUM_PERMUTATIONS ints """
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    return tuple(min((a * value + b) % PRIME for value in hashes) for a, b in PERMUTATIONS)
+
+
+def encode_signature(signature):
+    return ','.join(str(value) for value in signature)
+
+
+def decode_signature(encoded):
+    return tuple(int(value) for value in encoded.split(','))
+
+
+def similarity(first, second):
+    """ Returns the Jaccard similarity estimated from two signatures """
+    return sum(a == b for a, b in zip(first, second)) / float(NUM_PERMUTATIONS)
+
+
+def bands(signature):
+    """ Returns the LSH bucket keys of a signature, one per band """
+    return [(band, hash(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+            for band in range(BANDS)]
+
+
+class DuplicateIndex:
+    """
+      Signatures per question id and LSH buckets of question ids,
+      questions sharing a bucket are the only ones compared
+    """
+
+    def __init__(self):
+        self.signatures = {}
+        self.buckets = {}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+          Returns an index of (id, question, encoded signature or None) rows,
+          missing signatures are computed
+                Parameters:
+                <iterable> rows
+        """
+        index = cls()
+        for question_id, text, encoded in rows:
+            signature = decode_signature(encoded) if encoded else minhash(text)
+            index.add_signature(question_id, signature)
+        return index
+
+    def add_signature(self, question_id, signature):
+        """ Adds a precomputed signature, None signatures are not indexed """
+        with self.lock:
+            self.remove(question_id)
+            if signature is None:
+                return
+            self.signatures[question_id] = signature
+            for key in bands(signature):
+                self.buckets.setdefault(key, set()).add(question_id)
+
+    def add(self, question_id, text):
+        self.add_signature(question_id, minhash(text))
+
+    def remove(self, question_id):
+        """ Removes a question, unknown ids are ignored """
+        with self.lock:
+            signature = self.signatures.pop(question_id, None)
+            if signature is None:
+                return
+            for key in bands(signature):
+                bucket = self.buckets[key]
+                bucket.discard(question_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def apply(self, action, question):
+        """ Applies a question insert, update or delete to the index """
+        if action == 'delete':
+            self.remove(question['id'])
+        else:
+            self.add(question['id'], question['question'])
+
+    def candidates(self, signature):
+        """ Returns the ids sharing at least one bucket with signature """
+        found = set()
+        with self.lock:
+            for key in bands(signature):
+                found.update(self.buckets.get(key, ()))
+        return found
+
+    def find(self, text, min_similarity=MIN_SIMILARITY, exclude=None):
+        """
+          Returns [{id, similarity}] of indexed questions similar to text,
+          most similar first
+                Parameters:
+                <str> text
+                <float> min_similarity
+                <int> exclude, question id left out of the result
+        """
+        signature = minhash(text)
+        if signature is None:
+            return []
+        return self.similar(signature, min_similarity, exclude)
+
+    def similar(self, signature, min_similarity=MIN_SIMILARITY, exclude=None):
+        found = []
+        for question_id in self.candidates(signature):
+            if question_id == exclude:
+                continue
+            other = self.signatures.get(question_id)
+            if other is None:
+                continue
+            score = similarity(signature, other)
+            if score >= min_similarity:
+                found.append({'id': question_id, 'similarity': round(score, 3)})
+        return sorted(found, key=lambda duplicate: (-duplicate['similarity'], duplicate['id']))
+
+    def clusters(self, min_similarity=MIN_SIMILARITY):
+        """
+          Returns lists of question ids, each a group of near duplicates,
+          linked through LSH candidate pairs above min_similarity
+        """
+        parents = {}
+
+        def root(question_id):
+            while parents.get(question_id, question_id) != question_id:
+                question_id = parents[question_id]
+            return question_id
+
+        for question_id, signature in list(self.signatures.items()):
+            for duplicate in self.similar(signature, min_similarity, question_id):
+                first, second = root(question_id), root(duplicate['id'])
+                if first != second:
+                    parents[max(first, second)] = min(first, second)
+
+        groups = {}
+        for question_id in parents:
+            groups.setdefault(root(question_id), {root(question_id)}).add(question_id)
+        return sorted(sorted(group) for group in groups.values())
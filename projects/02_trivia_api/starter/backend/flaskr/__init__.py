@@ -1,13 +1,77 @@
 """ Trivia API end points """
 
+import atexit
+import hashlib
+import hmac
+import json
+import os
 import random
-from flask import Flask, request, abort, jsonify
+import threading
+import time
+from functools import wraps
+import click
+from flask import Flask, request, abort, jsonify, g, current_app, has_app_context, \
+    make_response
 from flask_cors import CORS
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.test import EnvironBuilder
 
-from models import setup_db, Question, Category
+from models import DB, DATABASE_PATH, setup_db, create_schema, Question, Category, \
+    TenantEngines, resolve_tenant, bind_session, MAX_TENANT_ENGINES, MAX_TENANT_STATS, \
+    ROUND_ROBIN, \
+    on_question_change, QuestionSignature, save_question_signature, table_version, Job, \
+    Score, add_scores, claim_scored_answers, \
+    IN_MEMORY_PATHS
+from suggestions import SuggestIndex, DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS
+from answers import AnswerIndex, MIN_SIMILARITY
+from jobs import JobExecutor, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_HEARTBEAT_SECONDS, \
+    JOB_STALE_SECONDS
+from snapshot import SnapshotStore
+from query_engine import QuestionEngine, NUMPY_ENGINE, numpy
+from admission import AdmissionControl, ENDPOINT_CLASSES, RATE_LIMITED
+from leaderboard import Leaderboard, GLOBAL_BOARD, DEFAULT_TOP, MAX_TOP, SCORE_BATCH_SIZE, \
+    SCORE_FLUSH_SECONDS
+from duplicates import DuplicateIndex, MIN_SIMILARITY as MIN_DUPLICATE_SIMILARITY, \
+    encode_signature, minhash
+from fsnd_common import jsonlog, eventfeed
 
 QUESTIONS_PER_PAGE = 10
 CATEGORIES_PER_PAGE = 5
+COLUMNAR_FORMAT = 'columnar'
+COLUMNAR_KEYS = ('ids', 'questions', 'answers', 'categories', 'difficulties')
+READ_ONLY_ENDPOINTS = ('get_categories', 'get_questions', 'questions_by_categories',
+                       'search_question', 'suggest_questions', 'play_quiz',
+                       'check_answers', 'get_leaderboard', 'get_player_score')
+PRIMARY_COOKIE = 'trivia_primary'
+REPLICA_PIN_SECONDS = 10
+MAX_ANSWERS_PER_CHECK = 100
+DUPLICATE_POLICIES = ('flag', 'reject')
+MAX_PLAYER_LENGTH = 80
+MAX_BATCH_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'DELETE')
+# endpoints a batch can not run, a stream never ends
+BATCH_EXCLUDED_ENDPOINTS = ('batch', 'events')
+BATCH_RESPONSE_HEADERS = ('ETag', 'Retry-After')
+# set in the WSGI environ of the sub-requests of a batch
+BATCH_ENVIRON_KEY = 'trivia.batch'
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+QUESTION_KEYS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def request_page(request):
+    """
+      Returns the requested page number, aborts with 404 below page 1
+      so no path reads a negative offset or slices from the end
+            Parameters:
+            <object> request_object
+    """
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+    return page
 
 
 def questions_per_page(request, selection):
@@ -17,7 +81,7 @@ def questions_per_page(request, selection):
             <object> request_object
             <object> list
     """
-    page = request.args.get('page', 1, type=int)
+    page = request_page(request)
     start = (page - 1) * QUESTIONS_PER_PAGE
     end = QUESTIONS_PER_PAGE * page
     questions = [question.format() for question in selection]
@@ -32,7 +96,7 @@ def categories_per_page(request, selection):
             <object> request_object
             <object> list
     """
-    page = request.args.get('page', 1, type=int)
+    page = request_page(request)
     start = (page - 1) * CATEGORIES_PER_PAGE
     end = CATEGORIES_PER_PAGE * page
     categories = [category.format() for category in selection]
@@ -40,27 +104,992 @@ def categories_per_page(request, selection):
     return current_categories
 
 
+def snapshot_page(page, snapshot):
+    """ Returns the snapshot positions of page, counted from 1 """
+    return range(len(snapshot))[(page - 1) * QUESTIONS_PER_PAGE:QUESTIONS_PER_PAGE * page]
+
+
+def format_rows(rows):
+    """ Returns question row tuples formatted like Question.format() """
+    return [dict(zip(QUESTION_KEYS, row)) for row in rows]
+
+
+def question_filters(request):
+    """
+      Returns the {categories, min_difficulty, max_difficulty} filters
+      of the request arguments, None when it has none
+            Parameters:
+            <object> request_object
+    """
+    categories = [category.strip() for category in request.args.get('categories', '').split(',')
+                  if category.strip()]
+    filters = {'categories': categories or None,
+               'min_difficulty': request.args.get('min_difficulty', type=int),
+               'max_difficulty': request.args.get('max_difficulty', type=int)}
+    return filters if any(value is not None for value in filters.values()) else None
+
+
+def filter_query(query, categories=None, min_difficulty=None, max_difficulty=None,
+                 exclude_ids=None):
+    """ Returns query with the question filters applied in SQL """
+    if categories is not None:
+        query = query.filter(Question.category.in_([str(category) for category in categories]))
+    if min_difficulty is not None:
+        query = query.filter(Question.difficulty >= min_difficulty)
+    if max_difficulty is not None:
+        query = query.filter(Question.difficulty <= max_difficulty)
+    if exclude_ids:
+        query = query.filter(~Question.id.in_(exclude_ids))
+    return query
+
+
+def filtered_rows(filters, page=None):
+    """
+      Returns the total and the (id, question, answer, category, difficulty)
+      rows of the questions matching filters, evaluated by the query engine
+      when it is on, else in SQL
+            Parameters:
+            <dict> filters, filter_query keyword arguments
+            <int> page, from 1, every matching row when None
+    """
+    start = (page - 1) * QUESTIONS_PER_PAGE if page is not None else 0
+    end = start + QUESTIONS_PER_PAGE if page is not None else None
+    engine = question_engine()
+    if engine is not None:
+        positions = engine.select(**filters)
+        return len(positions), engine.snapshot.rows(positions[start:end])
+    query = filter_query(columnar_query(), **filters).order_by(Question.id)
+    if page is None:
+        rows = query.all()
+        return len(rows), rows
+    return query.order_by(None).count(), query.offset(start).limit(QUESTIONS_PER_PAGE).all()
+
+
 def retrieve_questions(request):
     """
-      Returns json formatted total and per page questions
+      Returns the total questions and json formatted questions per page,
+      read from the question snapshot when there is one
             Parameters:
             <object> request_object
     """
+    page = request_page(request)
+    filters = question_filters(request)
+    if filters is not None:
+        total_questions, rows = filtered_rows(filters, page)
+        return total_questions, format_rows(rows)
+    snapshot = question_snapshot()
+    if snapshot is not None:
+        return len(snapshot), format_rows(snapshot.rows(snapshot_page(page, snapshot)))
     questions = Question.query.order_by(Question.id).all()
     current_questions = questions_per_page(request, questions)
-    return questions, current_questions
+    return len(questions), current_questions
+
+
+def is_columnar(request):
+    """
+      Returns True when the client asked for the compact columnar format
+            Parameters:
+            <object> request_object
+    """
+    return request.args.get('format') == COLUMNAR_FORMAT
+
+
+def columnar_query():
+    """ Returns a Question query yielding plain row tuples, no model objects """
+    return Question.query.with_entities(*QUESTION_COLUMNS)
+
+
+def columnar_questions(rows):
+    """
+      Returns questions as parallel arrays, one per column,
+      built straight from the row tuples without a dict per row
+            Parameters:
+            <object> list of row tuples
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNAR_KEYS)
+    return {key: list(column) for key, column in zip(COLUMNAR_KEYS, columns)}
+
+
+def retrieve_columnar_questions(request):
+    """
+      Returns total questions and the requested page in columnar format
+            Parameters:
+            <object> request_object
+    """
+    page = request_page(request)
+    filters = question_filters(request)
+    if filters is not None:
+        return filtered_rows(filters, page)
+    snapshot = question_snapshot()
+    if snapshot is not None:
+        return len(snapshot), snapshot.rows(snapshot_page(page, snapshot))
+    total_questions = Question.query.count()
+    rows = columnar_query().order_by(Question.id).offset(
+        (page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE).all()
+    return total_questions, rows
+
+
+def total_questions_count():
+    """ Returns the number of questions, from the question snapshot when there is one """
+    snapshot = question_snapshot()
+    return len(snapshot) if snapshot is not None else Question.query.count()
+
+
+def category_question_rows(category):
+    """
+      Returns the (id, question, answer, category, difficulty) rows
+      of a category, from the question snapshot when there is one
+            Parameters:
+            <str> category
+    """
+    snapshot = question_snapshot()
+    if snapshot is not None:
+        return snapshot.rows(snapshot.category_positions(category))
+    return columnar_query().filter(Question.category == str(category)).order_by(Question.id).all()
+
+
+def near_duplicate_questions(text):
+    """
+      Returns [{id, similarity}] of questions near duplicate to text
+            Parameters:
+            <str> text
+    """
+    return question_index('duplicate_indexes').find(
+        text, current_app.config.get('MIN_DUPLICATE_SIMILARITY', MIN_DUPLICATE_SIMILARITY))
+
+
+def conditional_on(table):
+    """
+      Decorates a GET view with a weak ETag built from the change version
+      of table and the request; a matching If-None-Match gets a 304
+      after one version lookup, without running the view
+            Parameters:
+            <str> table name
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = table_version(table)
+            except SQLAlchemyError:
+                # table_versions missing, run flask init-db
+                DB.session.rollback()
+                return view(*args, **kwargs)
+            key = '{}|{}|{}|{}'.format(table, version, g.get('tenant'), request.full_path)
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def import_questions(entries, on_duplicate='reject', job=None):
+    """
+      Inserts questions, rejecting or flagging near duplicates of the bank
+      and of earlier entries, returns the imported, flagged and rejected ones
+            Parameters:
+            <list> entries, dicts of question, answer, category, difficulty
+            <str> on_duplicate, flag or reject
+            <object> job context reporting progress, optional
+    """
+    imported, flagged, rejected = [], [], []
+    for number, entry in enumerate(entries):
+        if job is not None:
+            job.progress(number, len(entries))
+        near_duplicates = near_duplicate_questions(entry.get('question'))
+        if near_duplicates and on_duplicate == 'reject':
+            rejected.append({'question': entry.get('question'),
+                             'near_duplicates': near_duplicates})
+            continue
+        question = Question(question=entry.get('question'), answer=entry.get('answer'),
+                            category=entry.get('category'),
+                            difficulty=entry.get('difficulty'))
+        question.insert()
+        imported.append(question.id)
+        if near_duplicates:
+            flagged.append({'id': question.id, 'near_duplicates': near_duplicates})
+    return {'imported': imported, 'flagged': flagged, 'rejected': rejected}
+
+
+def dedup_report(min_similarity=MIN_DUPLICATE_SIMILARITY):
+    """
+      Returns the groups of near duplicate questions in the bank
+            Parameters:
+            <float> min_similarity
+    """
+    clusters = question_index('duplicate_indexes').clusters(min_similarity)
+    texts = dict(Question.query.with_entities(Question.id, Question.question).filter(
+        Question.id.in_([question_id for cluster in clusters for question_id in cluster])))
+    return {
+        'total_clusters': len(clusters),
+        'clusters': [[{'id': question_id, 'question': texts.get(question_id)}
+                      for question_id in cluster] for cluster in clusters]
+    }
+
+
+def import_questions_job(params, job):
+    """ Job importing params['questions'], see import_questions """
+    on_duplicate = params.get('on_duplicate', 'reject')
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise ValueError('on_duplicate must be one of {}'.format(DUPLICATE_POLICIES))
+    return import_questions(params.get('questions', []), on_duplicate, job)
+
+
+def reindex_job(params, job):
+    """ Job rebuilding the in-memory question indexes of this worker process """
+    indexes = list(QUESTION_INDEXES)
+    for number, name in enumerate(indexes):
+        job.progress(number, len(indexes))
+        # build aside and swap, requests keep using the old index meanwhile
+        with question_index_lock(name, g.get('tenant')):
+            build_question_index(name, questions_version())
+    return {'rebuilt': indexes}
+
+
+def dedup_scan_job(params, job):
+    """ Job grouping the near duplicate questions of the bank, see dedup_report """
+    return dedup_report(params.get('min_similarity', MIN_DUPLICATE_SIMILARITY))
+
+
+JOB_TYPES = {
+    'import_questions': import_questions_job,
+    'reindex': reindex_job,
+    'dedup_scan': dedup_scan_job
+}
+
+
+def quiz_question(question):
+    """
+      Returns the quiz question, without its answer when
+      HIDE_QUIZ_ANSWERS is set and answers are checked by POST /quizzes/answer
+            Parameters:
+            <dict> formatted question
+    """
+    if current_app.config.get('HIDE_QUIZ_ANSWERS'):
+        return {key: value for key, value in question.items() if key != 'answer'}
+    return question
+
+
+def batch_cached(key, load):
+    """
+      Returns load(), computed once per POST /batch and shared by its
+      sub-requests; outside of a batch it is computed on every call
+            Parameters:
+            <str> key
+            <function> load
+    """
+    cache = g.get('batch_cache')
+    if cache is None:
+        return load()
+    if key not in cache:
+        cache[key] = load()
+    return cache[key]
 
 
 def list_categories():
-    categories = Category.query.order_by(Category.id.asc()).all()
-    current_categories = [category.type for category in categories]
-    return current_categories
+    def load():
+        categories = Category.query.order_by(Category.id.asc()).all()
+        return [category.type for category in categories]
+
+    return batch_cached('categories', load)
+
+
+def valid_subrequest(entry):
+    """ Returns whether entry is a {method, path, body, headers} POST /batch sub-request """
+    return isinstance(entry, dict) \
+        and str(entry.get('method', 'GET')).upper() in BATCH_METHODS \
+        and isinstance(entry.get('path'), str) and entry['path'].startswith('/') \
+        and isinstance(entry.get('headers', {}), dict)
+
+
+def subrequest_endpoint(entry):
+    """ Returns the endpoint of a valid POST /batch sub-request, None when no rule matches """
+    path = entry['path'].partition('?')[0]
+    try:
+        return current_app.create_url_adapter(request).match(
+            path, str(entry.get('method', 'GET')).upper())[0]
+    except HTTPException:
+        return None
+
+
+def read_only_batch(body):
+    """ Returns whether every sub-request of a POST /batch body is read-only """
+    entries = body.get('requests') if isinstance(body, dict) else None
+    return isinstance(entries, list) and bool(entries) and \
+        all(valid_subrequest(entry) and subrequest_endpoint(entry) in READ_ONLY_ENDPOINTS
+            for entry in entries)
+
+
+def dispatch_subrequest(entry):
+    """
+      Runs a POST /batch sub-request through its view function, in the
+      app context of the batch; the before and after request hooks
+      already ran for the batch and are not run again
+            Parameters:
+            <dict> {method, path, body, headers}
+      Returns {status, headers, body}
+    """
+    app = current_app._get_current_object()
+    builder = EnvironBuilder(
+        path=entry['path'], method=str(entry.get('method', 'GET')).upper(),
+        headers={str(key): str(value) for key, value in entry.get('headers', {}).items()},
+        json=entry.get('body'),
+        environ_base={'REMOTE_ADDR': request.remote_addr, BATCH_ENVIRON_KEY: True})
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    with app.request_context(environ):
+        replica = g.get('replica')
+        if replica is not None:
+            # every sub-request of a read-only batch reads from the replica of the batch
+            bind_session(replica[1])
+        try:
+            if request.endpoint in BATCH_EXCLUDED_ENDPOINTS:
+                abort(422)
+            # limited like a direct call, the slot is released on teardown
+            response = admit_request() or app.make_response(app.dispatch_request())
+        except HTTPException as error:
+            response = app.make_response(app.handle_user_exception(error))
+        except Exception:
+            DB.session.rollback()
+            current_app.logger.exception('batch sub-request failed',
+                                         extra={'path': entry['path']})
+            response = jsonify({
+                "success": False,
+                "error": 500,
+                "message": "Internal Server Error"
+            })
+            response.status_code = 500
+        if is_write(response):
+            # the batch pins the client to the primary, see setup_replicas
+            g.batch_wrote = True
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True) or None
+        return {
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in BATCH_RESPONSE_HEADERS
+                        if name in response.headers},
+            'body': body
+        }
+
+
+def question_rows(column):
+    """ Returns (id, column) rows of every question, fetched in batches """
+    return Question.query.with_entities(Question.id, column).yield_per(10000)
+
+
+def build_duplicate_index():
+    """
+      Returns the duplicate index built from the stored signatures,
+      signatures missing from question_signatures are computed and stored
+    """
+    stored = True
+    try:
+        rows = Question.query.outerjoin(
+            QuestionSignature, QuestionSignature.question_id == Question.id).with_entities(
+            Question.id, Question.question, QuestionSignature.signature).all()
+    except SQLAlchemyError:
+        # question_signatures missing, run flask init-db
+        DB.session.rollback()
+        stored = False
+        rows = [(question_id, text, None)
+                for question_id, text in question_rows(Question.question)]
+    index = DuplicateIndex.build(rows)
+    missing = [{'question_id': question_id,
+                'signature': encode_signature(index.signatures[question_id])}
+               for question_id, text, signature in rows
+               if signature is None and question_id in index.signatures]
+    if missing and stored:
+        try:
+            DB.session.execute(QuestionSignature.__table__.insert(), missing)
+            DB.session.commit()
+        except SQLAlchemyError:
+            # a read replica can not store them, they are computed again next time
+            DB.session.rollback()
+    return index
+
+
+QUESTION_INDEXES = {
+    'suggest_indexes': lambda: SuggestIndex.build(question_rows(Question.question)),
+    'answer_indexes': lambda: AnswerIndex.build(question_rows(Question.answer)),
+    'duplicate_indexes': build_duplicate_index
+}
+
+
+def questions_version():
+    """ Returns the questions table version, None without table_versions """
+    try:
+        return table_version(Question.__tablename__)
+    except SQLAlchemyError:
+        # table_versions missing, run flask init-db
+        DB.session.rollback()
+        return None
+
+
+def build_question_index(name, generation):
+    """
+      Builds the question index name of the current app (and tenant)
+      from the questions table, read at version generation
+    """
+    tenant = g.get('tenant')
+    index = current_app.extensions.setdefault(name, {})[tenant] = QUESTION_INDEXES[name]()
+    current_app.extensions.setdefault('question_index_generations', {})[name, tenant] = generation
+    return index
+
+
+def question_index_lock(name, tenant):
+    """ Returns the lock held while the question index name of tenant is built """
+    locks = current_app.extensions.setdefault('question_index_locks', {})
+    return locks.setdefault((name, tenant), threading.Lock())
+
+
+def rebuild_question_index(app, name, tenant, lock):
+    """
+      Builds the question index name of tenant on a thread of its own,
+      then releases lock
+            Parameters:
+            <object> flask_app
+            <str> name, a QUESTION_INDEXES key
+            <str> tenant, None without tenants
+            <object> lock, acquired by the caller
+    """
+    try:
+        with app.app_context():
+            tenant_engines = app.extensions.get('tenant_engines')
+            if tenant_engines is not None:
+                engine = tenant_engines.engine(tenant)
+                if engine is None:
+                    return
+                g.tenant = tenant
+                bind_session(engine)
+            build_question_index(name, questions_version())
+    except Exception:
+        app.logger.exception('question index not rebuilt', extra={'index': name})
+    finally:
+        lock.release()
+
+
+def question_index(name):
+    """
+      Returns the in-memory question index name of the current
+      app (and tenant), built from the questions table on first use
+      and rebuilt when the questions table version shows a write of
+      another worker or from outside the app. One build runs at a time;
+      a rebuild runs in the background while requests use the old index,
+      unless QUESTION_INDEX_BACKGROUND is off or the database is in memory
+            Parameters:
+            <str> name, a QUESTION_INDEXES key
+    """
+    tenant = g.get('tenant')
+    indexes = current_app.extensions.setdefault(name, {})
+    generations = current_app.extensions.setdefault('question_index_generations', {})
+    index = indexes.get(tenant)
+    generation = questions_version()
+    if index is not None and (generation is None or generation == generations.get((name, tenant))):
+        return index
+    lock = question_index_lock(name, tenant)
+    if index is not None and current_app.config.get('QUESTION_INDEX_BACKGROUND', True) \
+            and database_path(tenant) not in IN_MEMORY_PATHS:
+        if lock.acquire(blocking=False):
+            threading.Thread(target=rebuild_question_index, name='question-index', daemon=True,
+                             args=(current_app._get_current_object(), name, tenant, lock)).start()
+        return index
+    with lock:
+        # a build that ran while this request waited may already be current
+        index = indexes.get(tenant)
+        if index is None or (generation is not None and generation != generations.get(
+                (name, tenant))):
+            index = build_question_index(name, generation)
+    return index
+
+
+def leaderboard():
+    """
+      Returns the leaderboards of the current app (and tenant),
+      built from the scores table on first use and rebuilt when
+      the scores table version shows a write of another worker
+    """
+    leaderboards = current_app.extensions.setdefault('leaderboards', {})
+    tenant = g.get('tenant')
+    board = leaderboards.get(tenant)
+    try:
+        generation = table_version(Score.__tablename__)
+    except SQLAlchemyError:
+        # table_versions missing, run flask init-db
+        DB.session.rollback()
+        generation = None
+    if board is None:
+        board = leaderboards[tenant] = Leaderboard.build(
+            Score.query.with_entities(Score.player, Score.category, Score.score), generation)
+        start_score_flusher(current_app._get_current_object())
+    elif generation is not None and generation != board.generation:
+        board.refresh(Score.query.with_entities(Score.player, Score.category, Score.score),
+                      generation)
+    return board
+
+
+def database_path(tenant):
+    """ Returns the database url of tenant, of the app without tenants """
+    if tenant is not None:
+        return current_app.extensions['tenant_engines'].database_path(tenant)
+    return current_app.config['SQLALCHEMY_DATABASE_URI']
+
+
+def snapshot_store():
+    """
+      Returns the question snapshot store of the current app (and tenant),
+      None when QUESTION_SNAPSHOT is off or the database is in memory
+    """
+    config = current_app.config
+    tenant = g.get('tenant')
+    path = database_path(tenant)
+    if not config.get('QUESTION_SNAPSHOT', True) or path in IN_MEMORY_PATHS:
+        return None
+    stores = current_app.extensions.setdefault('question_snapshots', {})
+    store = stores.get(tenant)
+    if store is None:
+        name = 'trivia-questions-{}.snap'.format(
+            hashlib.sha1(path.encode('utf-8')).hexdigest()[:16])
+        store = stores[tenant] = SnapshotStore(os.path.join(snapshot_directory(), name))
+    return store
+
+
+def snapshot_directory():
+    """
+      Returns SNAPSHOT_DIR, by default the snapshots directory of the app
+      instance folder, only accessible to the user running the app
+    """
+    directory = current_app.config.get('SNAPSHOT_DIR') or \
+        os.path.join(current_app.instance_path, 'snapshots')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+def question_snapshot():
+    """
+      Returns the memory-mapped snapshot of the questions table, written
+      from the primary database when missing or older than the questions
+      table version; None when snapshots are off or the snapshot does not
+      match the version of a replica
+    """
+    if 'question_snapshot' in g:
+        return g.question_snapshot
+    store = snapshot_store()
+    if store is None:
+        return None
+    try:
+        generation = table_version(Question.__tablename__)
+    except SQLAlchemyError:
+        # table_versions missing, run flask init-db
+        DB.session.rollback()
+        return None
+    snapshot = store.current()
+    if snapshot is None or snapshot.generation != generation:
+        snapshot = None
+        if 'replica' not in g:
+            # the version triggers also count writes from outside the app
+            store.write(generation, columnar_query().order_by(Question.id))
+            if table_version(Question.__tablename__) == generation:
+                snapshot = store.current()
+            else:
+                # a question changed while the snapshot was written
+                store.invalidate()
+    g.question_snapshot = snapshot
+    return snapshot
+
+
+def question_engine():
+    """
+      Returns the NumPy query engine on the question snapshot; None
+      unless QUERY_ENGINE is 'numpy', NumPy is installed and there is
+      a snapshot
+    """
+    if current_app.config.get('QUERY_ENGINE') != NUMPY_ENGINE or numpy is None:
+        return None
+    snapshot = question_snapshot()
+    if snapshot is None:
+        return None
+    engines = current_app.extensions.setdefault('question_engines', {})
+    tenant = g.get('tenant')
+    engine = engines.get(tenant)
+    if engine is None or engine.snapshot is not snapshot:
+        engine = engines[tenant] = QuestionEngine.from_snapshot(snapshot)
+    return engine
+
+
+def flush_scores(board, force=False):
+    """
+      Writes the pending points of board to the scores table once
+      SCORE_BATCH_SIZE entries or SCORE_FLUSH_SECONDS are reached
+            Parameters:
+            <object> leaderboard
+            <bool> force, writes whatever is pending
+    """
+    config = current_app.config
+    if not force and not board.due(config.get('SCORE_BATCH_SIZE', SCORE_BATCH_SIZE),
+                                   config.get('SCORE_FLUSH_SECONDS', SCORE_FLUSH_SECONDS)):
+        return
+    pending = board.take_pending()
+    if not pending:
+        return
+    try:
+        add_scores(pending)
+    except SQLAlchemyError:
+        DB.session.rollback()
+        board.restore_pending(pending)
+        current_app.logger.exception('scores not written, retrying with the next batch')
+        return
+    try:
+        board.written(table_version(Score.__tablename__))
+    except SQLAlchemyError:
+        DB.session.rollback()
+
+
+def flush_all_scores(app, force=False):
+    """
+      Writes the due pending points of every leaderboard of app,
+      each in the session of its tenant
+            Parameters:
+            <object> flask_app
+            <bool> force, writes whatever is pending
+    """
+    with app.app_context():
+        tenant_engines = app.extensions.get('tenant_engines')
+        for tenant, board in list(app.extensions.get('leaderboards', {}).items()):
+            if tenant_engines is not None:
+                engine = tenant_engines.engine(tenant)
+                if engine is None:
+                    continue
+                g.tenant = tenant
+                bind_session(engine)
+            flush_scores(board, force)
+
+
+def start_score_flusher(app):
+    """
+      Starts the thread writing the pending points of app every
+      SCORE_FLUSH_SECONDS, so the last batch does not wait for the
+      next submission, and writes what is left when the process exits
+            Parameters:
+            <object> flask_app
+    """
+    if not app.config.get('SCORE_FLUSH_BACKGROUND', True):
+        return
+    stop = threading.Event()
+    if app.extensions.setdefault('score_flusher', stop) is not stop:
+        return
+    interval = app.config.get('SCORE_FLUSH_SECONDS', SCORE_FLUSH_SECONDS)
+
+    def flush_loop():
+        while not stop.wait(interval):
+            try:
+                flush_all_scores(app)
+            except Exception:
+                app.logger.exception('score flush failed')
+
+    threading.Thread(target=flush_loop, name='score-flusher', daemon=True).start()
+    atexit.register(stop_score_flusher, app)
+
+
+def stop_score_flusher(app):
+    """ Stops the score flusher thread of app and writes every pending point """
+    stop = app.extensions.get('score_flusher')
+    if stop is None or stop.is_set():
+        return
+    stop.set()
+    flush_all_scores(app, force=True)
+
+
+@on_question_change
+def update_question_indexes(action, question):
+    """ Keeps already built question indexes in step with question changes """
+    if not has_app_context():
+        return
+    tenant = g.get('tenant')
+    generations = current_app.extensions.get('question_index_generations', {})
+    version = None
+    for name in QUESTION_INDEXES:
+        index = current_app.extensions.get(name, {}).get(tenant)
+        if index is None:
+            continue
+        index.apply(action, question)
+        if version is None:
+            version = questions_version()
+        generation = generations.get((name, tenant))
+        # one version later than the index: no other worker wrote in between
+        if version is not None and generation is not None and version == generation + 1:
+            generations[name, tenant] = version
+
+
+@on_question_change
+def store_question_signature(action, question):
+    """ Keeps the stored MinHash signature of a question in step with its text """
+    if not has_app_context():
+        return
+    signature = minhash(question['question'] or '') if action != 'delete' else None
+    try:
+        save_question_signature(question['id'],
+                                encode_signature(signature) if signature else None)
+        DB.session.commit()
+    except SQLAlchemyError:
+        # question_signatures missing, run flask init-db
+        DB.session.rollback()
+
+
+@on_question_change
+def publish_question_change(action, question):
+    """ Publishes a compact question event on the /events feed """
+    category = question['category']
+    # the column is a string, a new question still holds what the client sent
+    eventfeed.publish('question', {'action': action, 'id': question['id'],
+                                   'category': str(category) if category is not None else None})
+
+
+@on_question_change
+def invalidate_question_snapshot(action, question):
+    """ Removes the question snapshot, the next read writes the new generation """
+    if not has_app_context():
+        return
+    g.pop('question_snapshot', None)
+    store = snapshot_store()
+    if store is not None:
+        store.invalidate()
+
+
+def setup_tenants(app):
+    """
+      Routes every request to the database of its tenant
+      when TENANT_DATABASES is configured, tenants are picked by
+      the X-Tenant header or a subdomain of TENANT_DOMAIN
+            Parameters:
+            <object> flask_app
+    """
+    databases = app.config.get('TENANT_DATABASES')
+    if not databases:
+        return
+    tenant_engines = TenantEngines(
+        databases, app.config.get('MAX_TENANT_ENGINES', MAX_TENANT_ENGINES),
+        app.config.get('MAX_TENANT_STATS', MAX_TENANT_STATS))
+    app.extensions['tenant_engines'] = tenant_engines
+
+    @app.cli.command('create-tenant')
+    @click.argument('tenant')
+    def create_tenant_command(tenant):
+        """ Creates the trivia tables in the database of a tenant """
+        if not tenant_engines.provision(tenant.lower()):
+            raise click.BadParameter('no database path for this tenant', param_hint='TENANT')
+        click.echo('tenant {} created'.format(tenant.lower()))
+
+    @app.before_request
+    def route_tenant():
+        if request.method == 'OPTIONS' or request.endpoint == 'tenant_metrics':
+            return
+        tenant = resolve_tenant(request, app.config.get('TENANT_DOMAIN'))
+        engine = tenant_engines.engine(tenant)
+        if engine is None:
+            abort(404)
+        g.tenant = tenant
+        g.tenant_started = time.perf_counter()
+        bind_session(engine)
+
+    @app.teardown_request
+    def record_tenant(error):
+        # the sub-requests of a batch are counted with the batch
+        if 'tenant' in g and not request.environ.get(BATCH_ENVIRON_KEY):
+            tenant_engines.record(g.tenant, time.perf_counter() - g.tenant_started)
+
+    @app.route('/tenants/metrics')
+    def tenant_metrics():
+        """
+          Returns json formatted per tenant metrics,
+          to requests with the TENANT_METRICS_TOKEN bearer token
+        """
+        token = app.config.get('TENANT_METRICS_TOKEN')
+        sent = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(sent.encode('utf-8'),
+                                                'Bearer {}'.format(token).encode('utf-8')):
+            abort(401)
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'tenants': tenant_engines.metrics()
+        })
+
+
+def client_key():
+    """
+      Returns the client a request is rate limited as: RATE_LIMIT_KEY(request),
+      e.g. the subject of a verified token, or the client address
+    """
+    key = current_app.config.get('RATE_LIMIT_KEY')
+    return '{}|{}'.format(g.get('tenant'), key(request) if key else request.remote_addr)
+
+
+def admit_request():
+    """
+      Applies admission control to the endpoint of the request, returns
+      a 429 or 503 response with Retry-After when the request is rejected
+    """
+    admission = current_app.extensions.get('admission')
+    endpoint_class = ENDPOINT_CLASSES.get(request.endpoint)
+    if admission is None or endpoint_class not in admission.limits:
+        return None
+    status, retry_after = admission.admit(endpoint_class, client_key())
+    if status is None:
+        g.admitted = endpoint_class
+        return None
+    response = jsonify({
+        "success": False,
+        "error": status,
+        "message": "Too many requests" if status == RATE_LIMITED else "Server busy"
+    })
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def setup_admission(app):
+    """
+      Rate limits each client of the expensive endpoints and sheds their
+      requests beyond a concurrency limit, configured by ADMISSION_LIMITS
+      (off unless set, see admission.ADMISSION_LIMITS), ADMISSION_BACKEND
+      (shared token buckets) and RATE_LIMIT_KEY. Behind TRUSTED_PROXIES
+      reverse proxies the client address is read from X-Forwarded-For
+            Parameters:
+            <object> flask_app
+    """
+    limits = app.config.get('ADMISSION_LIMITS')
+    if not limits:
+        return
+    trusted_proxies = app.config.get('TRUSTED_PROXIES', 0)
+    if trusted_proxies:
+        # otherwise every client of a proxy shares the bucket of its address
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+    admission = AdmissionControl(limits, app.config.get('ADMISSION_BACKEND'))
+    app.extensions['admission'] = admission
+    app.before_request(admit_request)
+
+    @app.teardown_request
+    def release_admission(error):
+        endpoint_class = g.pop('admitted', None)
+        if endpoint_class is not None:
+            admission.release(endpoint_class)
+
+
+def is_write(response):
+    """ Returns whether the request of response changed data """
+    return request.method not in ('GET', 'HEAD', 'OPTIONS') \
+        and request.endpoint not in READ_ONLY_ENDPOINTS + ('batch',) \
+        and response.status_code < 400
+
+
+def setup_replicas(app):
+    """
+      Serves read-only endpoints from a replica picked by the
+      ReplicaRouter; after a write the client is pinned to the primary
+      for REPLICA_PIN_SECONDS so it reads its own writes
+            Parameters:
+            <object> flask_app
+    """
+    router = app.extensions.get('replica_router')
+    if router is None:
+        return
+    pin_seconds = app.config.get('REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS)
+
+    @app.before_request
+    def route_replica():
+        if 'tenant' in g or request.cookies.get(PRIMARY_COOKIE):
+            return
+        if request.endpoint == 'batch':
+            if not read_only_batch(request.get_json(silent=True)):
+                return
+        elif request.endpoint not in READ_ONLY_ENDPOINTS:
+            return
+        replica = router.acquire()
+        if replica is not None:
+            g.replica = replica
+            bind_session(replica[1])
+
+    @app.after_request
+    def pin_primary(response):
+        # a batch pins the client when one of its sub-requests wrote
+        wrote = g.get('batch_wrote') if request.endpoint == 'batch' else is_write(response)
+        if wrote:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=pin_seconds)
+        return response
+
+    @app.teardown_request
+    def release_replica(error):
+        # the sub-requests of a batch share its app context, the batch releases the replica
+        if request.environ.get(BATCH_ENVIRON_KEY):
+            return
+        replica = g.pop('replica', None)
+        if replica is not None:
+            DB.session.remove()
+            router.release(replica)
 
 
 def create_app(test_config=None):
     """ create and configure the app """
     app = Flask(__name__)
-    setup_db(app)
+    if test_config:
+        app.config.update(test_config)
+    jsonlog.setup_logging(app)
+    setup_db(app, app.config.get('DATABASE_PATH', DATABASE_PATH),
+             replica_paths=app.config.get('DATABASE_REPLICAS'),
+             replica_strategy=app.config.get('REPLICA_STRATEGY', ROUND_ROBIN),
+             create_tables=app.config.get('CREATE_SCHEMA', False))
+    setup_tenants(app)
+    setup_admission(app)
+    setup_replicas(app)
+    eventfeed.setup_events(app, key=lambda: g.get('tenant'))
+
+    # stale jobs are recovered on the first submission or by recover-jobs, not here
+    jobs = app.extensions['jobs'] = JobExecutor(
+        app, JOB_TYPES, app.config.get('JOB_WORKERS', JOB_WORKERS),
+        app.config.get('JOB_QUEUE_SIZE', JOB_QUEUE_SIZE),
+        app.config.get('JOB_HEARTBEAT_SECONDS', JOB_HEARTBEAT_SECONDS),
+        app.config.get('JOB_STALE_SECONDS', JOB_STALE_SECONDS))
+
+    @app.cli.command('init-db')
+    def init_db():
+        """ Creates the trivia tables missing in the database """
+        create_schema(app)
+
+    @app.cli.command('recover-jobs')
+    @click.option('--stale-seconds', type=float, default=None,
+                  help='heartbeat age of a stopped job, JOB_STALE_SECONDS by default')
+    def recover_jobs_command(stale_seconds):
+        """ Fails the queued and running jobs of stopped processes """
+        recovered = jobs.recover(stale_seconds)
+        if recovered is None:
+            raise click.ClickException('no jobs table, run flask init-db')
+        click.echo('{} stale jobs recovered'.format(recovered))
+
+    @app.cli.command('import-questions')
+    @click.argument('questions_file', type=click.File())
+    @click.option('--on-duplicate', type=click.Choice(DUPLICATE_POLICIES), default='reject',
+                  help='flag imports near duplicate questions, reject skips them')
+    def import_questions_command(questions_file, on_duplicate):
+        """ Imports a json list of questions, checking each for near duplicates """
+        click.echo(json.dumps(import_questions(json.load(questions_file), on_duplicate),
+                              indent=4))
+
+    @app.cli.command('dedup-report')
+    @click.option('--min-similarity', type=float, default=MIN_DUPLICATE_SIMILARITY)
+    def dedup_report_command(min_similarity):
+        """ Prints the groups of near duplicate questions in the bank """
+        click.echo(json.dumps(dedup_report(min_similarity), indent=4))
     # @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     CORS(app)
 
@@ -87,6 +1116,15 @@ def create_app(test_config=None):
             "message": "Resource Not found"
         }), 404
 
+    @app.errorhandler(401)
+    def unauthorized(error):
+        """ Returns 401 Unauthorized Error """
+        return jsonify({
+            "success": False,
+            "error": 401,
+            "message": "Unauthorized"
+        }), 401
+
     @app.errorhandler(400)
     def bad_request(error):
         """ Returns 400 Bad Request Error """
@@ -96,6 +1134,15 @@ def create_app(test_config=None):
             "message": "Bad Request"
         }), 400
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        """ Returns 503 Service Unavailable Error """
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "Service Unavailable"
+        }), 503
+
     @app.errorhandler(422)
     def unprocessable_entity(error):
         """ Returns 422 Unprocessable Request Error """
@@ -135,15 +1182,19 @@ def create_app(test_config=None):
     # number of total questions, current category, categories.
 
     @app.route('/questions')
+    @conditional_on(Question.__tablename__)
     def get_questions():
         """
           Returns json formatted total questions,questions per page
           Current Category and json formatted categories
         """
         try:
-            questions, current_questions = retrieve_questions(request)
-            selection = Category.query.order_by(Category.id).all()
-            categories = [category.type for category in selection]
+            if is_columnar(request):
+                total_questions, rows = retrieve_columnar_questions(request)
+                current_questions = columnar_questions(rows) if rows else None
+            else:
+                total_questions, current_questions = retrieve_questions(request)
+            categories = list_categories()
             # print(current_questions)
             # print(categories)
 
@@ -155,7 +1206,7 @@ def create_app(test_config=None):
                     'status_code': 200,
                     'status_code_message': 'OK',
                     'questions': current_questions,
-                    'total_questions': len(questions),
+                    'total_questions': total_questions,
                     'current_category': len(categories),
                     'categories': categories
                 })
@@ -178,6 +1229,7 @@ def create_app(test_config=None):
           returns json formatted response with deleted question ID,
           total questions and current questions per page
         """
+        request_page(request)
         try:
             question = Question.query.filter(
                 Question.id == question_id).one_or_none()
@@ -186,7 +1238,7 @@ def create_app(test_config=None):
                 abort(404)
             else:
                 question.delete()
-                questions, current_questions = retrieve_questions(request)
+                total_questions, current_questions = retrieve_questions(request)
 
             return jsonify({
                 'success': True,
@@ -194,7 +1246,7 @@ def create_app(test_config=None):
                 'status_code_message': 'OK',
                 'deleted': question_id,
                 'questions': current_questions,
-                'total_questions': len(questions)
+                'total_questions': total_questions
             })
         except ImportError:
             abort(404)
@@ -215,28 +1267,43 @@ def create_app(test_config=None):
           created question ID, total questions and current questions per page
         """
         body = request.get_json()
+        request_page(request)
 
         if body:
             new_question = body.get('question')
             new_answer = body.get('answer')
             new_category = body.get('category')
             new_difficulty = body.get('difficulty')
+            on_duplicate = body.get('on_duplicate',
+                                    app.config.get('DUPLICATE_POLICY', 'flag'))
+            if on_duplicate not in DUPLICATE_POLICIES:
+                abort(422)
 
             try:
+                near_duplicates = near_duplicate_questions(new_question)
+                if near_duplicates and on_duplicate == 'reject':
+                    return jsonify({
+                        'success': False,
+                        'error': 409,
+                        'message': 'Near duplicate question',
+                        'near_duplicates': near_duplicates
+                    }), 409
+
                 question = Question(question=new_question, answer=new_answer,
                                     category=new_category, difficulty=new_difficulty)
 
                 question.insert()
 
-                questions, current_questions = retrieve_questions(request)
+                total_questions, current_questions = retrieve_questions(request)
 
                 return jsonify({
                     'success': True,
                     'status_code': 201,
                     'status_code_message': 'Created',
                     'created_question': question.id,
+                    'near_duplicates': near_duplicates,
                     'questions': current_questions,
-                    'total_questions': len(questions)
+                    'total_questions': total_questions
                 })
             except ImportError:
                 abort(422)
@@ -263,12 +1330,17 @@ def create_app(test_config=None):
         search_term = '%{}%'.format(body.get('searchTerm'))
         # print(search_term)
         try:
-            filtered_questions = Question.query.filter(
-                Question.question.ilike(search_term)).all()
-            found_questions = [question.format()
-                               for question in filtered_questions]
+            if is_columnar(request):
+                found_questions = columnar_questions(columnar_query().filter(
+                    Question.question.ilike(search_term)).all())
+                total_questions = Question.query.count()
+            else:
+                filtered_questions = Question.query.filter(
+                    Question.question.ilike(search_term)).all()
+                found_questions = [question.format()
+                                   for question in filtered_questions]
 
-            questions, current_questions = retrieve_questions(request)
+                total_questions, current_questions = retrieve_questions(request)
 
             # print(current_questions)
 
@@ -278,12 +1350,31 @@ def create_app(test_config=None):
                 'status_code_message': 'Ok',
                 'current_category': 2,
                 'questions': found_questions,
-                'total_questions': len(questions)
+                'total_questions': total_questions
             })
 
         except ImportError:
             abort(400)
 
+    @app.route('/questions/suggest')
+    def suggest_questions():
+        """
+          Returns up to limit questions with a word or title
+          starting with the q argument, for type-ahead search
+        """
+        prefix = request.args.get('q', '')
+        limit = request.args.get('limit', DEFAULT_SUGGESTIONS, type=int)
+        if not prefix.strip() or not 0 < limit <= MAX_SUGGESTIONS:
+            abort(400)
+        suggestions = question_index('suggest_indexes').suggest(prefix, limit)
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'suggestions': suggestions,
+            'total_suggestions': len(suggestions)
+        })
+
     # TEST: Search by any phrase. The questions list will update to include
     # only question that include that string within their question.
     # Try using the word "title" to start.
@@ -292,23 +1383,29 @@ def create_app(test_config=None):
     # Create a GET endpoint to get questions based on category.
 
     @app.route('/categories/<int:category_id>/questions')
+    @conditional_on(Question.__tablename__)
     def questions_by_categories(category_id):
         """
           returns json formatted questions by provided category,
         """
         # print(category_id)
         try:
-            category_questions = Question.query.filter(
-                Question.category == str(category_id)).all()
             categories = list_categories()
             # print(categories)
-            filtered_questions = [question.format()
-                                  for question in category_questions]
+            filters = question_filters(request)
+            if filters is not None:
+                filters['categories'] = [category_id]
+                rows = filtered_rows(filters)[1]
+            else:
+                rows = category_question_rows(category_id)
+            if is_columnar(request):
+                filtered_questions = columnar_questions(rows) if rows else None
+            else:
+                filtered_questions = format_rows(rows)
             if not filtered_questions:
                 abort(404)
             else:
-                questions, current_questions = retrieve_questions(request)
-                # print(current_questions)
+                total_questions = total_questions_count()
 
                 return jsonify({
                     'success': True,
@@ -316,7 +1413,7 @@ def create_app(test_config=None):
                     'status_code_message': 'OK',
                     'current_category': categories[category_id - 1],
                     'questions': filtered_questions,
-                    'total_questions': len(questions)
+                    'total_questions': total_questions
                 })
 
         except ImportError:
@@ -345,15 +1442,33 @@ def create_app(test_config=None):
             # print(type(category))
             quiz_num_questions = body.get('questions_per_play')
             prev_question = body.get('previous_questions')
-            categories = [category.format().get('id') for category in
-                          Category.query.all()]
+            categories = list_categories()
             # print(categories)
+            engine = question_engine()
+            if engine is not None:
+                # one vectorized pass instead of drawing until a new question comes up
+                positions = engine.select(
+                    categories=None if category == 0 else [category],
+                    exclude_ids=[question_id for question_id in prev_question
+                                 if isinstance(question_id, int)])
+                if not len(positions):
+                    return jsonify({
+                        'success': False,
+                        'status_code': 200,
+                        'status_code_message': 'Ok',
+                        'question': False
+                    })
+                current_question = format_rows([engine.snapshot.row(random.choice(positions))])[0]
+                return jsonify({
+                    'success': True,
+                    'status_code': 200,
+                    'status_code_message': 'OK',
+                    'question': quiz_question(current_question)
+                })
             for i in range(quiz_num_questions):
                 if category == 0:
                     category = int(random.random() * len(categories))
-                    category_questions = Question.query.filter(
-                        Question.category == category).all()
-                    questions = [question.format() for question in category_questions]
+                    questions = format_rows(category_question_rows(category))
                     random_number = int(random.random() * len(questions))
                     current_question = questions[random_number]
                     if current_question.get('id') not in prev_question:
@@ -361,14 +1476,12 @@ def create_app(test_config=None):
                             'success': True,
                             'status_code': 200,
                             'status_code_message': 'OK',
-                            'question': current_question
+                            'question': quiz_question(current_question)
                         })
 
                 else:
                     # print(prev_question)
-                    category_questions = Question.query.filter(
-                        Question.category == category).all()
-                    questions = [question.format() for question in category_questions]
+                    questions = format_rows(category_question_rows(category))
                     # Picks a random question based on the questions list length.
                     random_number = int(random.random() * len(questions))
                     current_question = questions[random_number]
@@ -380,7 +1493,7 @@ def create_app(test_config=None):
                             'success': True,
                             'status_code': 200,
                             'status_code_message': 'OK',
-                            'question': current_question
+                            'question': quiz_question(current_question)
                         })
                     else:
                         if i + 1 > len(questions):
@@ -395,6 +1508,203 @@ def create_app(test_config=None):
         except ImportError:
             abort(422)
 
+    @app.route('/quizzes/answer', methods=['POST'])
+    def check_answers():
+        """
+          Checks quiz answers against the normalized answers,
+          a single {question_id, answer} or a whole quiz as
+          {answers: [{question_id, answer}, ...]}
+        """
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)
+        submissions = body.get('answers', [body])
+        if not isinstance(submissions, list) or \
+                not 0 < len(submissions) <= MAX_ANSWERS_PER_CHECK:
+            abort(400)
+        try:
+            pairs = [(int(submission['question_id']), str(submission['answer']))
+                     for submission in submissions]
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        # hidden answers are only shown to the players who got them right
+        results = question_index('answer_indexes').check_many(
+            pairs, app.config.get('MIN_ANSWER_SIMILARITY', MIN_SIMILARITY),
+            reveal=not app.config.get('HIDE_QUIZ_ANSWERS'))
+        if 'answers' not in body:
+            if results[0].get('found') is False:
+                abort(404)
+            return jsonify(dict(results[0], success=True, status_code=200,
+                                status_code_message='OK'))
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'results': results,
+            'total_correct': sum(result['correct'] for result in results)
+        })
+
+    @app.route('/leaderboard/scores', methods=['POST'])
+    def submit_scores():
+        """
+          Checks the answers of a player's quiz and adds a point per correct
+          answer to the global and the question category leaderboards,
+          a question the player already scored does not score again
+        """
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)
+        player = body.get('player')
+        submissions = body.get('answers')
+        if not isinstance(player, str) or not player.strip() \
+                or len(player) > MAX_PLAYER_LENGTH or not isinstance(submissions, list) \
+                or not 0 < len(submissions) <= MAX_ANSWERS_PER_CHECK:
+            abort(400)
+        try:
+            pairs = [(int(submission['question_id']), str(submission['answer']))
+                     for submission in submissions]
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        # hidden answers are only shown to the players who got them right
+        results = question_index('answer_indexes').check_many(
+            pairs, app.config.get('MIN_ANSWER_SIMILARITY', MIN_SIMILARITY),
+            reveal=not app.config.get('HIDE_QUIZ_ANSWERS'))
+        correct = [result['question_id'] for result in results if result['correct']]
+        categories = dict(Question.query.with_entities(Question.id, Question.category).filter(
+            Question.id.in_(correct))) if correct else {}
+        board = leaderboard()
+        player = player.strip()
+        try:
+            # one point per question and player, across requests and workers
+            scored = claim_scored_answers(player, [question_id for question_id in correct
+                                                   if question_id in categories])
+        except SQLAlchemyError:
+            # scored_answers missing, run flask init-db
+            DB.session.rollback()
+            current_app.logger.exception('scored answers not recorded, no points added')
+            abort(503)
+        for question_id in scored:
+            board.add(player, str(categories[question_id]), 1)
+        flush_scores(board)
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'results': results,
+            'total_correct': len(correct),
+            'total_scored': len(scored),
+            'player': board.player(player) or {'player': player, 'score': 0, 'rank': None}
+        })
+
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        """ Returns the best players, globally or of ?category=<id> """
+        category = request.args.get('category', GLOBAL_BOARD)
+        limit = min(max(request.args.get('limit', DEFAULT_TOP, type=int), 1), MAX_TOP)
+        board = leaderboard()
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'category': category,
+            'leaderboard': board.top(category, limit),
+            'total_players': board.total_players(category)
+        })
+
+    @app.route('/leaderboard/players/<player>')
+    def get_player_score(player):
+        """ Returns the score and rank of a player, globally or in ?category=<id> """
+        entry = leaderboard().player(player, request.args.get('category', GLOBAL_BOARD))
+        if entry is None:
+            abort(404)
+        return jsonify(dict(entry, success=True, status_code=200, status_code_message='OK'))
+
+    @app.route('/jobs', methods=['POST'])
+    def submit_job():
+        """
+          Queues a maintenance job and returns it with 202 Accepted,
+          503 with Retry-After when too many jobs are waiting
+        """
+        body = request.get_json()
+        if not isinstance(body, dict) or body.get('type') not in JOB_TYPES \
+                or not isinstance(body.get('params', {}), dict):
+            abort(422)
+        job = jobs.submit(body['type'], body.get('params', {}))
+        if job is None:
+            response = jsonify({
+                "success": False,
+                "error": 503,
+                "message": "Too many jobs, try again later"
+            })
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        return jsonify({
+            'success': True,
+            'status_code': 202,
+            'status_code_message': 'Accepted',
+            'job': job.format()
+        }), 202
+
+    @app.route('/jobs/<int:job_id>')
+    def get_job(job_id):
+        """ Returns the status, progress and result of a job """
+        job = Job.query.get(job_id)
+        if job is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'job': job.format()
+        })
+
+    @app.route('/jobs/<int:job_id>', methods=['DELETE'])
+    def cancel_job(job_id):
+        """ Cancels a queued or running job, 409 when it already finished """
+        job = Job.query.get(job_id)
+        if job is None:
+            abort(404)
+        if not jobs.cancel(job):
+            return jsonify({
+                "success": False,
+                "error": 409,
+                "message": "Job already finished",
+                "job": job.format()
+            }), 409
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'job': job.format()
+        })
+
+    @app.route('/batch', methods=['POST'])
+    def batch():
+        """
+          Runs up to MAX_BATCH_REQUESTS sub-requests in order and returns
+          their responses in one, work like the category list is shared
+        """
+        body = request.get_json()
+        entries = body.get('requests') if isinstance(body, dict) else None
+        if not isinstance(entries, list) or not entries \
+                or len(entries) > app.config.get('MAX_BATCH_REQUESTS', MAX_BATCH_REQUESTS) \
+                or not all(valid_subrequest(entry) for entry in entries):
+            abort(422)
+        g.batch_cache = {}
+        g.batch_wrote = False
+        try:
+            responses = [dispatch_subrequest(entry) for entry in entries]
+        finally:
+            g.pop('batch_cache', None)
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'status_code_message': 'OK',
+            'responses': responses
+        })
+
     # TEST: In the "Play" tab, after a user selects "All" or a category,
     # one question at a time is displayed, the user is allowed to answer
     # and shown whether they were correct or not.
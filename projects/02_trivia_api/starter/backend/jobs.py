@@ -0,0 +1,262 @@
+"""
+  In-process background jobs for long running maintenance tasks.
+  Jobs are stored in the jobs table and run on a small bounded
+  thread pool, so they never take more than JOB_WORKERS threads
+  (and database connections) away from requests.
+
+  Every status change is one UPDATE ... WHERE status IN (...), so a
+  cancel, a worker and a starting process never overwrite each other.
+
+  A process keeps the updated_at of its unfinished jobs fresh every
+  JOB_HEARTBEAT_SECONDS. Jobs without a heartbeat for JOB_STALE_SECONDS
+  belong to a stopped process; they are failed by `flask recover-jobs`
+  and on the first job a process submits, never while an app starts.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+from sqlalchemy import case
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import DB, Job, bind_session, JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING, \
+    JOB_CANCELLED, JOB_SUCCEEDED, JOB_FAILED
+
+JOB_WORKERS = 2
+JOB_QUEUE_SIZE = 20
+PROGRESS_INTERVAL = 0.5
+# the process running or queueing a job refreshes its updated_at this often
+JOB_HEARTBEAT_SECONDS = 60
+# queued or running jobs not updated for this long belong to a stopped process
+JOB_STALE_SECONDS = 600
+JOB_UNFINISHED = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING)
+LOGGER = logging.getLogger(__name__)
+
+
+def set_job_status(job_id, statuses, status, **values):
+    """
+      Moves a job in one of statuses to status with a single conditional
+      UPDATE, returns False when the job is in another status
+            Parameters:
+            <int> job_id
+            <tuple> statuses
+            <str|object> status, or a SQL expression of the current status
+            <dict> values, other columns to set
+    """
+    table = Job.__table__
+    result = DB.session.execute(table.update().where(table.c.id == job_id).where(
+        table.c.status.in_(statuses)).values(status=status, updated_at=time.time(), **values))
+    DB.session.commit()
+    return result.rowcount == 1
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job once its cancellation was requested """
+
+
+class JobContext:
+    """
+      Passed to a running job, saves its progress at most every
+      PROGRESS_INTERVAL seconds and raises JobCancelled once
+      the job was cancelled, by this or another worker process
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.reported = 0.0
+
+    def progress(self, done, total):
+        """
+          Records done out of total steps
+                Parameters:
+                <int> done
+                <int> total
+        """
+        now = time.monotonic()
+        if now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.reported = now
+        progress = float(done) / total if total else 0.0
+        # not running any more: cancelled, or failed by a process that found it stale
+        if not set_job_status(self.job.id, (JOB_RUNNING,), JOB_RUNNING, progress=progress):
+            raise JobCancelled()
+
+
+class JobExecutor:
+    """
+      Runs registered job functions, function(params, context) -> result,
+      with at most workers jobs running and queue_size waiting
+            Parameters:
+            <object> flask_app
+            <dict> job_types, name: function
+            <int> workers
+            <int> queue_size
+            <float> heartbeat_seconds
+            <float> stale_seconds, see recover
+    """
+
+    def __init__(self, app, job_types, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE,
+                 heartbeat_seconds=JOB_HEARTBEAT_SECONDS, stale_seconds=JOB_STALE_SECONDS):
+        self.app = app
+        self.job_types = job_types
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        # tenant -> ids of the queued and running jobs of this process
+        self.unfinished = {}
+        # tenants whose stale jobs this process failed
+        self.recovered = set()
+        self.lock = threading.Lock()
+        self.heartbeat = None
+        self.stopped = threading.Event()
+
+    def submit(self, job_type, params=None):
+        """
+          Stores and queues a job, returns it or None when the queue is full
+                Parameters:
+                <str> job_type, a job_types key
+                <dict> params
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+        tenant = g.get('tenant')
+        try:
+            self.recover_once(tenant)
+            job = Job(job_type, params)
+            job.insert()
+        except Exception:
+            self.slots.release()
+            raise
+        if self.app.config.get('JOB_EAGER'):
+            # tests run jobs in the calling thread and session
+            try:
+                self.execute(job.id)
+            finally:
+                self.slots.release()
+        else:
+            with self.lock:
+                self.unfinished.setdefault(tenant, set()).add(job.id)
+            self.start_heartbeat()
+            self.pool.submit(self.run, job.id, tenant)
+        return job
+
+    def bind(self, tenant):
+        """ Binds the session of the current app context to the database of tenant """
+        tenant_engines = self.app.extensions.get('tenant_engines')
+        if tenant_engines is not None:
+            g.tenant = tenant
+            bind_session(tenant_engines.engine(tenant))
+
+    def run(self, job_id, tenant):
+        """ Runs a job on a pool thread in its own app context and session """
+        try:
+            with self.app.app_context():
+                self.bind(tenant)
+                self.execute(job_id)
+        finally:
+            with self.lock:
+                self.unfinished[tenant].discard(job_id)
+            self.slots.release()
+
+    def start_heartbeat(self):
+        """ Starts the heartbeat thread of this process, on its first queued job """
+        with self.lock:
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self.beat, name='job-heartbeat',
+                                                  daemon=True)
+                self.heartbeat.start()
+
+    def beat(self):
+        """ Refreshes updated_at of the unfinished jobs of this process until stopped """
+        table = Job.__table__
+        while not self.stopped.wait(self.heartbeat_seconds):
+            with self.lock:
+                unfinished = {tenant: list(job_ids)
+                              for tenant, job_ids in self.unfinished.items() if job_ids}
+            for tenant, job_ids in unfinished.items():
+                with self.app.app_context():
+                    try:
+                        self.bind(tenant)
+                        DB.session.execute(table.update().where(table.c.id.in_(job_ids)).where(
+                            table.c.status.in_(JOB_UNFINISHED)).values(updated_at=time.time()))
+                        DB.session.commit()
+                    except SQLAlchemyError:
+                        DB.session.rollback()
+                        LOGGER.exception('job heartbeat not written', extra={'tenant': tenant})
+
+    def stop(self):
+        """ Stops the heartbeat and waits for the running jobs """
+        self.stopped.set()
+        self.pool.shutdown()
+
+    def execute(self, job_id):
+        """ Runs a queued job, unless another worker took it or it was cancelled """
+        job = Job.query.get(job_id)
+        if job is None or not set_job_status(job_id, (JOB_QUEUED,), JOB_RUNNING):
+            if job is not None and job.status == JOB_FAILED:
+                LOGGER.warning('job failed as stale before it ran', extra={'job_id': job_id})
+            return
+        try:
+            result = self.job_types[job.type](json.loads(job.params), JobContext(job))
+        except JobCancelled:
+            DB.session.rollback()
+            set_job_status(job_id, (JOB_CANCELLING,), JOB_CANCELLED)
+        except Exception as error:
+            DB.session.rollback()
+            LOGGER.exception('job failed', extra={'job_id': job.id, 'job_type': job.type})
+            set_job_status(job_id, (JOB_RUNNING, JOB_CANCELLING), JOB_FAILED,
+                           error='{}: {}'.format(type(error).__name__, error))
+        else:
+            # the work is committed, a cancel that came too late does not undo it
+            set_job_status(job_id, (JOB_RUNNING, JOB_CANCELLING), JOB_SUCCEEDED,
+                           progress=1.0, result=json.dumps(result))
+
+    def cancel(self, job):
+        """
+          Cancels a queued job at once, a running one at its next progress
+          report, returns False when the job already finished
+        """
+        table = Job.__table__
+        cancelled = set_job_status(
+            job.id, (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING),
+            case([(table.c.status == JOB_QUEUED, JOB_CANCELLED)], else_=JOB_CANCELLING))
+        DB.session.refresh(job)
+        return cancelled
+
+    def recover_once(self, tenant):
+        """ Recovers the stale jobs of tenant, the first time this process submits a job """
+        with self.lock:
+            if tenant in self.recovered:
+                return
+            self.recovered.add(tenant)
+        self.recover(self.stale_seconds)
+
+    def recover(self, stale_seconds=None):
+        """
+          Fails the queued and running jobs of the database of the current
+          session without a heartbeat for stale_seconds, their process stopped
+          before finishing them; returns how many, None without a jobs table
+        """
+        table = Job.__table__
+        stale = time.time() - (self.stale_seconds if stale_seconds is None else stale_seconds)
+        try:
+            result = DB.session.execute(table.update().where(
+                table.c.status.in_(JOB_UNFINISHED)).where(table.c.updated_at < stale).values(
+                status=case([(table.c.status == JOB_CANCELLING, JOB_CANCELLED)],
+                            else_=JOB_FAILED),
+                error=case([(table.c.status == JOB_CANCELLING, None)],
+                           else_='worker stopped before the job finished'),
+                updated_at=time.time()))
+            DB.session.commit()
+        except SQLAlchemyError:
+            # jobs missing, run flask init-db
+            DB.session.rollback()
+            return None
+        if result.rowcount:
+            LOGGER.warning('stale jobs failed', extra={'jobs': result.rowcount})
+        return result.rowcount
@@ -0,0 +1,152 @@
+"""
+  In-memory quiz leaderboards, players sorted by score in bisect-maintained
+  lists for O(log n) rank lookups. Points are written through to the
+  scores table in batches and the boards are rebuilt from it on startup,
+  and again whenever another worker wrote to it.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+GLOBAL_BOARD = 'all'
+DEFAULT_TOP = 10
+MAX_TOP = 100
+SCORE_BATCH_SIZE = 100
+SCORE_FLUSH_SECONDS = 1.0
+
+
+class Board:
+    """
+      Scores of one leaderboard, keys holds (-score, player) sorted
+      so the best players come first and ties are ordered by name
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.scores = {}
+
+    def set(self, player, score):
+        """ Sets the score of a player, moving it to its new position """
+        previous = self.scores.get(player)
+        if previous is not None:
+            del self.keys[bisect_left(self.keys, (-previous, player))]
+        self.scores[player] = score
+        insort(self.keys, (-score, player))
+
+    def rank(self, score):
+        """ Returns 1 + the number of players with a higher score """
+        return bisect_left(self.keys, (-score,)) + 1
+
+    def top(self, limit):
+        return [{'rank': self.rank(-negative), 'player': player, 'score': -negative}
+                for negative, player in self.keys[:limit]]
+
+
+class Leaderboard:
+    """
+      The global board and one board per category, plus the points
+      not yet written to the scores table. generation is the version
+      of the scores table the boards match, None when it is unknown
+    """
+
+    def __init__(self, generation=None):
+        self.boards = {}
+        self.pending = {}
+        self.generation = generation
+        self.flushed_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows, generation=None):
+        """
+          Returns the leaderboards of (player, category, score) rows
+                Parameters:
+                <iterable> rows
+                <int> generation, scores table version the rows were read at
+        """
+        leaderboard = cls(generation)
+        for player, category, score in rows:
+            leaderboard.boards.setdefault(category, Board()).scores[player] = score
+        # sorted once, not inserted one by one
+        for board in leaderboard.boards.values():
+            board.keys = sorted((-score, player) for player, score in board.scores.items())
+        return leaderboard
+
+    def refresh(self, rows, generation):
+        """
+          Replaces the boards with those of rows read from the scores table,
+          plus the points not written yet
+                Parameters:
+                <iterable> rows
+                <int> generation
+        """
+        fresh = Leaderboard.build(rows, generation)
+        with self.lock:
+            for (player, board), points in self.pending.items():
+                scores = fresh.boards.setdefault(board, Board())
+                scores.set(player, scores.scores.get(player, 0) + points)
+            self.boards = fresh.boards
+            self.generation = generation
+
+    def written(self, generation):
+        """
+          Records the scores table version after this process wrote its
+          batch; one version later than the boards means no other worker
+          wrote in between, so the boards still match the table
+        """
+        with self.lock:
+            if self.generation is not None and generation == self.generation + 1:
+                self.generation = generation
+
+    def add(self, player, category, points):
+        """
+          Adds points to a player on the global and the category board
+                Parameters:
+                <str> player
+                <str> category
+                <int> points
+        """
+        with self.lock:
+            for board in (GLOBAL_BOARD, category):
+                scores = self.boards.setdefault(board, Board())
+                scores.set(player, scores.scores.get(player, 0) + points)
+                self.pending[(player, board)] = self.pending.get((player, board), 0) + points
+
+    def top(self, category=GLOBAL_BOARD, limit=DEFAULT_TOP):
+        """ Returns [{rank, player, score}] of the best limit players """
+        with self.lock:
+            board = self.boards.get(category)
+            return board.top(limit) if board is not None else []
+
+    def player(self, player, category=GLOBAL_BOARD):
+        """ Returns {player, score, rank, total_players}, None for unknown players """
+        with self.lock:
+            board = self.boards.get(category)
+            score = board.scores.get(player) if board is not None else None
+            if score is None:
+                return None
+            return {'player': player, 'score': score, 'rank': board.rank(score),
+                    'total_players': len(board.scores)}
+
+    def total_players(self, category=GLOBAL_BOARD):
+        board = self.boards.get(category)
+        return len(board.scores) if board is not None else 0
+
+    def due(self, batch_size=SCORE_BATCH_SIZE, interval=SCORE_FLUSH_SECONDS):
+        """ Returns whether enough points are pending, or for long enough, to be written """
+        return len(self.pending) >= batch_size or \
+            (bool(self.pending) and time.monotonic() - self.flushed_at >= interval)
+
+    def take_pending(self):
+        """ Returns the pending {(player, category): points} and starts a new batch """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+            return pending
+
+    def restore_pending(self, pending):
+        """ Puts back points whose write failed, they go with the next batch """
+        with self.lock:
+            for key, points in pending.items():
+                self.pending[key] = self.pending.get(key, 0) + points
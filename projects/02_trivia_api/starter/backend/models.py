@@ -3,7 +3,18 @@
   and all the CRUD for category and question tables.
 """
 
-from sqlalchemy import Column, String, Integer
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, String, Integer, Float, Text, ForeignKey, create_engine, \
+    and_, bindparam, text, tuple_
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask_sqlalchemy import SQLAlchemy
 
 DATABASE_NAME = "trivia"
@@ -12,19 +23,438 @@ DATABASE_PATH = "postgres://{}:{}@{}/{}".format(
     'postgres', 'postgres', 'localhost:5432', DATABASE_NAME)
 DB = SQLAlchemy()
 
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+REPLICA_RETRY_SECONDS = 5
+IN_MEMORY_PATHS = ('sqlite://', 'sqlite:///:memory:')
+SCHEMA_CREATED = set()
+LOGGER = logging.getLogger(__name__)
+
 
-def setup_db(app, database_path=DATABASE_PATH):
-    """ Database setup """
-    print(database_path)
+def setup_db(app, database_path=DATABASE_PATH, replica_paths=None,
+             replica_strategy=ROUND_ROBIN, create_tables=False):
+    """
+      Database setup, read-only requests may be served by
+      replica_paths, see ReplicaRouter.
+      Tables are only created when create_tables is set,
+      see create_schema
+    """
+    # the url repr hides the password
+    LOGGER.info('database configured', extra={'database': repr(make_url(database_path))})
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     DB.app = app
     DB.init_app(app)
-    DB.create_all()
+    if create_tables:
+        create_schema(app)
+    if replica_paths:
+        app.extensions['replica_router'] = ReplicaRouter(replica_paths,
+                                                         replica_strategy)
+
+
+def create_schema(app):
+    """
+      Creates the missing tables, once per database path and process,
+      in-memory databases are new for every app so they are always created
+    """
+    database_path = app.config["SQLALCHEMY_DATABASE_URI"]
+    if database_path in SCHEMA_CREATED:
+        return
+    with app.app_context():
+        create_tables(DB.get_engine(app))
+    if database_path not in IN_MEMORY_PATHS:
+        SCHEMA_CREATED.add(database_path)
+
+
+def create_tables(bind):
+    """ Creates the missing tables and the table version triggers on bind """
+    DB.Model.metadata.create_all(bind)
+    create_version_triggers(bind)
+
+
+# Tenants
+
+TENANT_HEADER = 'X-Tenant'
+MAX_TENANT_ENGINES = 8
+MAX_TENANT_STATS = 1000
+TENANT_NAME = re.compile(r'^[a-z0-9_]{1,63}$')
+
+
+def checked_out(engine):
+    """ Returns the connections in use, pools such as NullPool do not count them """
+    checkedout = getattr(engine.pool, 'checkedout', None)
+    return checkedout() if checkedout else 0
+
+
+class TenantEngines:
+    """
+      Lazily created engine (and connection pool) per provisioned tenant,
+      the least recently used idle engines are disposed
+      once more than max_engines are open.
+            Parameters:
+            <dict|str> databases, tenant: database path
+                       or a path template containing {tenant}
+            <int> max_engines
+            <int> max_stats, tenants kept in the metrics
+    """
+
+    def __init__(self, databases, max_engines=MAX_TENANT_ENGINES, max_stats=MAX_TENANT_STATS):
+        self.databases = databases
+        self.max_engines = max_engines
+        self.max_stats = max_stats
+        self.engines = OrderedDict()
+        self.stats = OrderedDict()
+        # tenant -> lock held while its engine is opened
+        self.opening = {}
+        self.lock = threading.Lock()
+
+    def database_path(self, tenant):
+        """ Returns the database path of a tenant or None if it is unknown """
+        if isinstance(self.databases, dict):
+            return self.databases.get(tenant)
+        if tenant and TENANT_NAME.match(tenant):
+            return self.databases.format(tenant=tenant)
+        return None
+
+    def tenant_stats(self, tenant):
+        """
+          Returns the metrics dict of a tenant, lock must be held;
+          beyond max_stats tenants, those of the oldest closed engines are dropped
+        """
+        stats = self.stats.get(tenant)
+        if stats is None:
+            for closed in [name for name in self.stats if name not in self.engines]:
+                if len(self.stats) < self.max_stats:
+                    break
+                del self.stats[closed]
+            stats = self.stats[tenant] = {
+                'requests': 0,
+                'request_seconds': 0.0,
+                'engines_created': 0,
+                'engines_evicted': 0
+            }
+        return stats
+
+    def provision(self, tenant):
+        """
+          Creates the tables of a tenant in its database, an SQLite file is
+          created, other databases must exist; returns False for a tenant
+          without a database path
+        """
+        database_path = self.database_path(tenant)
+        if database_path is None:
+            return False
+        engine = create_engine(database_path)
+        try:
+            create_tables(engine)
+        finally:
+            engine.dispose()
+        return True
+
+    def open(self, database_path):
+        """
+          Returns a new engine on an existing database, None when the
+          SQLite file is missing or the database does not accept connections
+        """
+        url = make_url(database_path)
+        if url.get_backend_name() == 'sqlite' and not (url.database and
+                                                       os.path.exists(url.database)):
+            # connecting would create an empty file
+            return None
+        engine = create_engine(database_path)
+        try:
+            engine.connect().close()
+        except SQLAlchemyError:
+            engine.dispose()
+            return None
+        return engine
+
+    def engine(self, tenant):
+        """
+          Returns the tenant engine, None when the tenant is unknown or its
+          database was not provisioned; engines are opened outside the
+          lock, one at a time per tenant
+        """
+        with self.lock:
+            engine = self.engines.get(tenant)
+            if engine is not None:
+                self.engines.move_to_end(tenant)
+                return engine
+            database_path = self.database_path(tenant)
+            if database_path is None:
+                return None
+            opening = self.opening.setdefault(tenant, threading.Lock())
+        with opening:
+            with self.lock:
+                engine = self.engines.get(tenant)
+                if engine is not None:
+                    return engine
+            engine = self.open(database_path)
+            with self.lock:
+                if self.opening.get(tenant) is opening:
+                    del self.opening[tenant]
+                if engine is None:
+                    return None
+                self.engines[tenant] = engine
+                self.evict()
+                self.tenant_stats(tenant)['engines_created'] += 1
+                return engine
+
+    def evict(self):
+        """ Disposes least recently used engines without checked out connections """
+        for tenant in list(self.engines):
+            if len(self.engines) <= self.max_engines:
+                break
+            engine = self.engines[tenant]
+            if checked_out(engine):
+                continue
+            del self.engines[tenant]
+            engine.dispose()
+            self.tenant_stats(tenant)['engines_evicted'] += 1
+
+    def record(self, tenant, seconds):
+        """ Adds a served request to the tenant metrics """
+        with self.lock:
+            stats = self.tenant_stats(tenant)
+            stats['requests'] += 1
+            stats['request_seconds'] += seconds
+
+    def metrics(self):
+        """ Returns per tenant metrics, including the pool usage of open engines """
+        with self.lock:
+            metrics = {}
+            for tenant, stats in self.stats.items():
+                engine = self.engines.get(tenant)
+                metrics[tenant] = dict(stats,
+                                       engine_open=engine is not None,
+                                       connections_checked_out=checked_out(engine)
+                                       if engine is not None else 0)
+            return metrics
+
+
+def resolve_tenant(request, tenant_domain=None):
+    """
+      Returns the tenant named by the X-Tenant header or,
+      when tenant_domain is set, by the request subdomain
+            Parameters:
+            <object> request_object
+            <str> tenant_domain
+    """
+    tenant = request.headers.get(TENANT_HEADER)
+    if tenant:
+        return tenant.lower()
+    host = request.host.split(':')[0].lower()
+    if tenant_domain and host.endswith('.' + tenant_domain):
+        return host[:-len(tenant_domain) - 1]
+    return None
+
+
+def bind_session(bind):
+    """ Starts the request session on bind (engine or connection) instead of DATABASE_PATH """
+    DB.session.remove()
+    DB.session(bind=bind, binds={})
+
+
+# Replicas
+
+
+class ReplicaRouter:
+    """
+      Picks a read replica per request, round robin or the one
+      with the least requests in flight. A replica that fails to
+      connect is skipped for retry_seconds.
+            Parameters:
+            <list> replica_paths
+            <str> strategy, ROUND_ROBIN or LEAST_CONNECTIONS
+            <int> retry_seconds
+    """
+
+    def __init__(self, replica_paths, strategy=ROUND_ROBIN,
+                 retry_seconds=REPLICA_RETRY_SECONDS):
+        if strategy not in (ROUND_ROBIN, LEAST_CONNECTIONS):
+            raise ValueError('Unknown replica strategy: {}'.format(strategy))
+        self.engines = [create_engine(path) for path in replica_paths]
+        self.strategy = strategy
+        self.retry_seconds = retry_seconds
+        self.in_flight = [0] * len(self.engines)
+        self.served = [0] * len(self.engines)
+        self.down_until = [0.0] * len(self.engines)
+        self.next_replica = 0
+        self.lock = threading.Lock()
+
+    def candidates(self):
+        """ Returns the replica indexes worth trying, best first """
+        now = time.monotonic()
+        with self.lock:
+            indexes = [index for index in range(len(self.engines))
+                       if self.down_until[index] <= now]
+            if self.strategy == LEAST_CONNECTIONS:
+                return sorted(indexes, key=lambda index: self.in_flight[index])
+            start = self.next_replica
+            self.next_replica = (start + 1) % len(self.engines)
+            return sorted(indexes, key=lambda index: (index - start) % len(self.engines))
+
+    def acquire(self):
+        """
+          Returns (index, connection) of a healthy replica,
+          or None when every replica is down and the primary has to serve
+        """
+        for index in self.candidates():
+            try:
+                connection = self.engines[index].connect()
+            except SQLAlchemyError:
+                with self.lock:
+                    self.down_until[index] = time.monotonic() + self.retry_seconds
+                continue
+            with self.lock:
+                self.in_flight[index] += 1
+                self.served[index] += 1
+            return index, connection
+        return None
+
+    def release(self, replica):
+        """ Returns the replica connection to its pool """
+        index, connection = replica
+        connection.close()
+        with self.lock:
+            self.in_flight[index] -= 1
+
+
+# Table versions
+
+
+class TableVersion(DB.Model):
+    """ Change counter per table, bumped in the transaction of every write """
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+
+TABLE_VERSION_UPSERT = text("""
+    INSERT INTO table_versions (name, version) VALUES (:name, 1)
+    ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1
+""")
+
+
+def bump_table_version(name):
+    """
+      Increments the version of table name within the current transaction,
+      a single upsert so concurrent first writes do not collide. Tables
+      whose version trigger exists are left to it, so every write bumps the
+      version once. A database without table_versions (restored from
+      trivia.psql, no flask init-db) keeps the write, only the version is skipped
+    """
+    if name in VERSIONED_TABLES and version_triggers(DB.session.connection()):
+        return
+    try:
+        with DB.session.begin_nested():
+            DB.session.execute(TABLE_VERSION_UPSERT, {'name': name})
+    except SQLAlchemyError:
+        LOGGER.warning('table version not bumped, run flask init-db', extra={'table': name})
+
+
+# tables whose writes bump table_versions in the database, whoever writes
+VERSIONED_TABLES = ('questions',)
+SQLITE_VERSION_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS {table}_version_{event} AFTER {event} ON {table}
+    BEGIN
+        INSERT INTO table_versions (name, version) VALUES ('{table}', 1)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    END
+"""
+POSTGRES_VERSION_FUNCTION = """
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_versions (name, version) VALUES (TG_TABLE_NAME, 1)
+        ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+POSTGRES_VERSION_TRIGGER = """
+    CREATE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+"""
+
+
+# database url -> whether the version triggers exist, looked up once per database
+VERSION_TRIGGERS = {}
+SQLITE_TRIGGER_QUERY = "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+POSTGRES_TRIGGER_QUERY = "SELECT count(*) FROM pg_trigger WHERE tgname = :name"
+
+
+def version_triggers(bind):
+    """
+      Returns whether the version triggers of the VERSIONED_TABLES exist
+      on bind (engine or connection), in-memory databases are looked up every time
+    """
+    url = str(bind.engine.url)
+    if url in VERSION_TRIGGERS:
+        return VERSION_TRIGGERS[url]
+    dialect = bind.dialect.name
+    if dialect == 'sqlite':
+        query, trigger = SQLITE_TRIGGER_QUERY, '{}_version_INSERT'
+    elif dialect == 'postgresql':
+        query, trigger = POSTGRES_TRIGGER_QUERY, '{}_version'
+    else:
+        return False
+    found = all(bind.execute(text(query), name=trigger.format(table)).scalar()
+                for table in VERSIONED_TABLES)
+    if url not in IN_MEMORY_PATHS:
+        VERSION_TRIGGERS[url] = found
+    return found
+
+
+def create_version_triggers(bind):
+    """
+      Creates the triggers bumping the version of the VERSIONED_TABLES,
+      so writes from psql, a restored dump or another host change it too;
+      other databases only see the writes of the app
+    """
+    with bind.begin() as connection:
+        dialect = connection.dialect.name
+        for table in VERSIONED_TABLES:
+            if dialect == 'sqlite':
+                for event in ('INSERT', 'UPDATE', 'DELETE'):
+                    connection.execute(text(SQLITE_VERSION_TRIGGER.format(
+                        table=table, event=event)))
+            elif dialect == 'postgresql':
+                connection.execute(text(POSTGRES_VERSION_FUNCTION))
+                connection.execute(text('DROP TRIGGER IF EXISTS {0}_version ON {0}'.format(table)))
+                connection.execute(text(POSTGRES_VERSION_TRIGGER.format(table=table)))
+    VERSION_TRIGGERS.pop(str(bind.engine.url), None)
+
+
+def table_version(name):
+    """ Returns the version of table name, 0 before its first write """
+    return DB.session.query(TableVersion.version).filter(
+        TableVersion.name == name).scalar() or 0
 
 
 # Question
 
+QUESTION_LISTENERS = []
+
+
+def on_question_change(listener):
+    """
+      Registers listener(action, question), called after a Question
+      insert, update or delete is committed with the formatted question
+    """
+    QUESTION_LISTENERS.append(listener)
+    return listener
+
+
+def notify_question_change(action, question):
+    """ Calls every registered question listener """
+    for listener in QUESTION_LISTENERS:
+        listener(action, question)
+
 
 class Question(DB.Model):
     """ Question table definition """
@@ -45,16 +475,26 @@ class Question(DB.Model):
     def insert(self):
         """ Insert data into Question table """
         DB.session.add(self)
+        DB.session.flush()
+        question = self.format()
+        bump_table_version(self.__tablename__)
         DB.session.commit()
+        notify_question_change('insert', question)
 
     def update(self):
         """ Update data on Question table"""
+        question = self.format()
+        bump_table_version(self.__tablename__)
         DB.session.commit()
+        notify_question_change('update', question)
 
     def delete(self):
         """ Delete data on Question table"""
+        question = self.format()
         DB.session.delete(self)
+        bump_table_version(self.__tablename__)
         DB.session.commit()
+        notify_question_change('delete', question)
 
     def format(self):
         """ Serialize Question table data for json object """
@@ -67,6 +507,181 @@ class Question(DB.Model):
         }
 
 
+class QuestionSignature(DB.Model):
+    """ Stored MinHash signature of a question, see duplicates.py """
+    __tablename__ = 'question_signatures'
+
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'),
+                         primary_key=True)
+    signature = Column(String, nullable=False)
+
+    def __init__(self, question_id, signature):
+        self.question_id = question_id
+        self.signature = signature
+
+
+QUESTION_SIGNATURE_UPSERT = text("""
+    INSERT INTO question_signatures (question_id, signature) VALUES (:question_id, :signature)
+    ON CONFLICT (question_id) DO UPDATE SET signature = excluded.signature
+""")
+
+
+def save_question_signature(question_id, signature):
+    """
+      Stores the encoded signature of a question within the current
+      transaction, None removes it
+            Parameters:
+            <int> question_id
+            <str> signature
+    """
+    if signature is None:
+        DB.session.query(QuestionSignature).filter(
+            QuestionSignature.question_id == question_id).delete(synchronize_session=False)
+    else:
+        DB.session.execute(QUESTION_SIGNATURE_UPSERT,
+                           {'question_id': question_id, 'signature': signature})
+
+
+# Jobs
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_CANCELLING = 'cancelling'
+JOB_CANCELLED = 'cancelled'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_FINISHED = (JOB_CANCELLED, JOB_SUCCEEDED, JOB_FAILED)
+
+
+class Job(DB.Model):
+    """ Background maintenance job table definition, see jobs.py """
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    type = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    progress = Column(Float, nullable=False)
+    params = Column(Text)
+    result = Column(Text)
+    error = Column(String)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+    def __init__(self, type, params=None):
+        self.type = type
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.params = json.dumps(params or {})
+        self.created_at = self.updated_at = time.time()
+
+    def insert(self):
+        """ Insert data into Job table """
+        DB.session.add(self)
+        DB.session.commit()
+
+    def update(self):
+        """ Update data on Job table"""
+        self.updated_at = time.time()
+        DB.session.commit()
+
+    def format(self):
+        """ Serialize Job table data for json object """
+        return {
+            'id': self.id,
+            'type': self.type,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+# Scores
+
+
+class Score(DB.Model):
+    """ Quiz points per player and category, see leaderboard.py """
+    __tablename__ = 'scores'
+
+    player = Column(String, primary_key=True)
+    category = Column(String, primary_key=True)
+    score = Column(Integer, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+class ScoredAnswer(DB.Model):
+    """ Questions a player already scored a point for, each scores once """
+    __tablename__ = 'scored_answers'
+
+    player = Column(String, primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'),
+                         primary_key=True)
+    scored_at = Column(Float, nullable=False)
+
+
+SCORED_ANSWER_INSERT = text("""
+    INSERT INTO scored_answers (player, question_id, scored_at)
+    VALUES (:player, :question_id, :scored_at)
+    ON CONFLICT (player, question_id) DO NOTHING
+""")
+
+
+def claim_scored_answers(player, question_ids):
+    """
+      Records that player scored question_ids and commits, returns the
+      ones the player had not scored before; concurrent claims of one
+      question by several workers leave it to exactly one of them
+            Parameters:
+            <str> player
+            <list> question_ids
+    """
+    now = time.time()
+    claimed = [question_id for question_id in sorted(set(question_ids))
+               if DB.session.execute(SCORED_ANSWER_INSERT, {
+                   'player': player, 'question_id': question_id, 'scored_at': now}).rowcount == 1]
+    DB.session.commit()
+    return claimed
+
+
+def add_scores(points):
+    """
+      Adds points to the stored scores in one transaction,
+      rows missing from the scores table are inserted
+            Parameters:
+            <dict> points, {(player, category): points}
+    """
+    table = Score.__table__
+    for attempt in range(2):
+        now = time.time()
+        existing = set(DB.session.query(table.c.player, table.c.category).filter(
+            tuple_(table.c.player, table.c.category).in_(list(points))))
+        updates = [{'b_player': player, 'b_category': category, 'b_points': value, 'b_now': now}
+                   for (player, category), value in points.items() if (player, category) in existing]
+        inserts = [{'player': player, 'category': category, 'score': value, 'updated_at': now}
+                   for (player, category), value in points.items()
+                   if (player, category) not in existing]
+        try:
+            if updates:
+                DB.session.execute(table.update().where(and_(
+                    table.c.player == bindparam('b_player'),
+                    table.c.category == bindparam('b_category'))).values(
+                    score=table.c.score + bindparam('b_points'),
+                    updated_at=bindparam('b_now')), updates)
+            if inserts:
+                DB.session.execute(table.insert(), inserts)
+            # tells the other workers to reload their leaderboards
+            bump_table_version(table.name)
+            DB.session.commit()
+            return
+        except IntegrityError:
+            # another worker inserted one of the rows first, they are updated on retry
+            DB.session.rollback()
+            if attempt:
+                raise
+
+
 # Category
 
 
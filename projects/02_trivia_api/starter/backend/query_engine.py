@@ -0,0 +1,88 @@
+"""
+  Optional in-memory query engine over the question snapshot. The id,
+  category and difficulty columns are NumPy arrays on the snapshot
+  mapping, no copy, and filters and exclusions are evaluated as
+  vectorized boolean masks instead of SQL queries or Python loops.
+
+  NumPy is not a requirement of the app, without it the engine is off
+  and every query goes to the snapshot indexes or the database.
+"""
+
+from snapshot import NULL_DIFFICULTY
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUMPY_ENGINE = 'numpy'
+
+
+class QuestionEngine:
+    """
+      Question columns as int64 arrays, positions are row numbers
+      ordered by question id
+            Parameters:
+            <array> ids
+            <array> codes, index of the category in categories
+            <array> levels, difficulty, NULL_DIFFICULTY for None
+            <list> categories, the distinct category values
+            <object> snapshot the columns are read from, None for from_rows
+    """
+
+    def __init__(self, ids, codes, levels, categories, snapshot=None):
+        self.ids = ids
+        self.codes = codes
+        self.levels = levels
+        self.category_codes = {str(category): code for code, category in enumerate(categories)}
+        self.snapshot = snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """ Returns the engine on the columns of a QuestionSnapshot, without copying them """
+        return cls(numpy.frombuffer(snapshot.ids, dtype=numpy.int64),
+                   numpy.frombuffer(snapshot.codes, dtype=numpy.int64),
+                   numpy.frombuffer(snapshot.levels, dtype=numpy.int64),
+                   snapshot.categories, snapshot)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Returns the engine of (id, category, difficulty) rows ordered by id """
+        categories, category_codes = [], {}
+        ids, codes, levels = [], [], []
+        for question_id, category, difficulty in rows:
+            if category not in category_codes:
+                category_codes[category] = len(categories)
+                categories.append(category)
+            ids.append(question_id)
+            codes.append(category_codes[category])
+            levels.append(NULL_DIFFICULTY if difficulty is None else difficulty)
+        return cls(numpy.array(ids, dtype=numpy.int64), numpy.array(codes, dtype=numpy.int64),
+                   numpy.array(levels, dtype=numpy.int64), categories)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, categories=None, min_difficulty=None, max_difficulty=None,
+               exclude_ids=None):
+        """
+          Returns the positions of the questions matching every given filter
+                Parameters:
+                <list> categories, any of them
+                <int> min_difficulty
+                <int> max_difficulty
+                <list> exclude_ids, question ids left out
+        """
+        mask = numpy.ones(len(self.ids), dtype=bool)
+        if categories is not None:
+            codes = [self.category_codes[str(category)] for category in categories
+                     if str(category) in self.category_codes]
+            mask &= numpy.isin(self.codes, codes)
+        if min_difficulty is not None:
+            # NULL_DIFFICULTY is the smallest int64, never at least min_difficulty
+            mask &= self.levels >= min_difficulty
+        if max_difficulty is not None:
+            mask &= (self.levels <= max_difficulty) & (self.levels != NULL_DIFFICULTY)
+        if exclude_ids:
+            mask &= ~numpy.isin(self.ids, numpy.fromiter(exclude_ids, dtype=numpy.int64))
+        return numpy.flatnonzero(mask)
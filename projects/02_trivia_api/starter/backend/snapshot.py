@@ -0,0 +1,181 @@
+"""
+  Immutable question bank snapshot in a memory-mapped file, attached
+  zero-copy by every worker process of the same database.
+
+  Layout, all integers native 8 byte:
+      header    magic, generation, question count, meta length
+      meta      json {categories: distinct category values, category_starts}
+      ids       int64[count], ordered by id
+      codes     int64[count], index of the category in meta categories
+      levels    int64[count], difficulty, NULL_DIFFICULTY for None
+      order     int64[count], positions sorted by (category code, id)
+      question and answer offsets  uint64[count + 1] each, into the text blob
+      text      utf-8 questions then answers
+
+  A new generation is written to a temporary file and renamed over the
+  old one, workers still reading the old generation keep their mapping.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+
+MAGIC = b'TRIVQS01'
+HEADER = struct.Struct('=8sQQQ')
+NULL_DIFFICULTY = -2 ** 63
+ALIGNMENT = 8
+
+
+def padding(size):
+    return -size % ALIGNMENT
+
+
+def write_snapshot(path, generation, rows):
+    """
+      Writes the snapshot of question rows and atomically replaces path with it
+            Parameters:
+            <str> path
+            <int> generation, the questions table version the rows were read at
+            <iterable> rows, (id, question, answer, category, difficulty) ordered by id
+    """
+    ids, codes, levels = array('q'), array('q'), array('q')
+    question_offsets, answer_offsets = array('Q', [0]), array('Q', [0])
+    questions, answers = bytearray(), bytearray()
+    categories, category_codes = [], {}
+    for question_id, question, answer, category, difficulty in rows:
+        if category not in category_codes:
+            category_codes[category] = len(categories)
+            categories.append(category)
+        ids.append(question_id)
+        codes.append(category_codes[category])
+        levels.append(NULL_DIFFICULTY if difficulty is None else difficulty)
+        questions += (question or '').encode('utf-8')
+        answers += (answer or '').encode('utf-8')
+        question_offsets.append(len(questions))
+        answer_offsets.append(len(answers))
+    # answers follow the questions in the blob
+    answer_offsets = array('Q', (offset + len(questions) for offset in answer_offsets))
+
+    order = array('q', sorted(range(len(ids)), key=lambda position: (codes[position], ids[position])))
+    category_starts = [0] * (len(categories) + 1)
+    for code in codes:
+        category_starts[code + 1] += 1
+    for code in range(len(categories)):
+        category_starts[code + 1] += category_starts[code]
+    meta = json.dumps({'categories': categories, 'category_starts': category_starts}).encode('utf-8')
+
+    directory = os.path.dirname(path) or '.'
+    descriptor, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(MAGIC, generation, len(ids), len(meta)))
+            snapshot_file.write(meta + b'\0' * padding(HEADER.size + len(meta)))
+            for column in (ids, codes, levels, order, question_offsets, answer_offsets):
+                snapshot_file.write(column.tobytes())
+            snapshot_file.write(questions)
+            snapshot_file.write(answers)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class QuestionSnapshot:
+    """ Read-only view on a snapshot file, columns are memoryviews on the mapping """
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.stat = os.fstat(snapshot_file.fileno())
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, count, meta_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a question snapshot'.format(path))
+        start = HEADER.size
+        meta = json.loads(self.map[start:start + meta_length].decode('utf-8'))
+        self.categories = meta['categories']
+        self.category_starts = meta['category_starts']
+        self.category_codes = {str(category): code for code, category in enumerate(self.categories)}
+        start += meta_length + padding(start + meta_length)
+
+        view = memoryview(self.map)
+        columns = []
+        for length, kind in ((count, 'q'), (count, 'q'), (count, 'q'), (count, 'q'),
+                             (count + 1, 'Q'), (count + 1, 'Q')):
+            end = start + length * ALIGNMENT
+            columns.append(view[start:end].cast(kind))
+            start = end
+        self.ids, self.codes, self.levels, self.order, self.question_offsets, \
+            self.answer_offsets = columns
+        self.text = view[start:]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text_at(self, offsets, position):
+        return str(self.text[offsets[position]:offsets[position + 1]], 'utf-8')
+
+    def row(self, position):
+        """ Returns the (id, question, answer, category, difficulty) tuple at position """
+        level = self.levels[position]
+        return (self.ids[position],
+                self.text_at(self.question_offsets, position),
+                self.text_at(self.answer_offsets, position),
+                self.categories[self.codes[position]],
+                None if level == NULL_DIFFICULTY else level)
+
+    def rows(self, positions):
+        return [self.row(position) for position in positions]
+
+    def category_positions(self, category):
+        """ Returns the positions of the questions of category, ordered by id """
+        code = self.category_codes.get(str(category))
+        if code is None:
+            return self.order[0:0]
+        return self.order[self.category_starts[code]:self.category_starts[code + 1]]
+
+
+class SnapshotStore:
+    """
+      The snapshot file of one database, reattached when another
+      process swapped in a new generation or removed it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        """ Returns the attached snapshot, None when there is no snapshot file """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.snapshot = None
+            return None
+        snapshot = self.snapshot
+        if snapshot is not None and (stat.st_ino, stat.st_mtime_ns) == \
+                (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns):
+            return snapshot
+        with self.lock:
+            try:
+                # the old mapping is unmapped once no request reads it any more
+                self.snapshot = QuestionSnapshot(self.path)
+            except (FileNotFoundError, ValueError):
+                self.snapshot = None
+            return self.snapshot
+
+    def write(self, generation, rows):
+        with self.lock:
+            write_snapshot(self.path, generation, rows)
+
+    def invalidate(self):
+        """ Removes the snapshot file, every process rebuilds it on next use """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.snapshot = None
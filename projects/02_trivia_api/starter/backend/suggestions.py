@@ -0,0 +1,123 @@
+"""
+  In-memory prefix index over question tokens and titles,
+  used for the type-ahead suggestions of the search box.
+"""
+
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+      Returns text case folded, without accents and with single spaces
+            Parameters:
+            <str> text
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(TOKEN.findall(stripped.casefold()))
+
+
+def index_keys(text):
+    """ Returns the keys a question is found by, its normalized title and tokens """
+    title = normalize(text)
+    return {title} | set(title.split()) if title else set()
+
+
+class SuggestIndex:
+    """
+      Sorted vocabulary of keys searched with bisect,
+      each key holds the sorted ids of the questions it appears in
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.postings = {}
+        self.questions = {}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+          Returns an index of (id, question) rows
+                Parameters:
+                <iterable> rows
+        """
+        index = cls()
+        for question_id, text in rows:
+            index.questions[question_id] = text
+            for key in index_keys(text):
+                index.postings.setdefault(key, []).append(question_id)
+        for ids in index.postings.values():
+            ids.sort()
+        index.keys = sorted(index.postings)
+        return index
+
+    def add(self, question_id, text):
+        """ Adds a question, replacing the text of an already indexed id """
+        with self.lock:
+            self.remove(question_id)
+            self.questions[question_id] = text
+            for key in index_keys(text):
+                ids = self.postings.get(key)
+                if ids is None:
+                    self.postings[key] = [question_id]
+                    insort(self.keys, key)
+                elif ids[-1] < question_id:
+                    ids.append(question_id)
+                else:
+                    insort(ids, question_id)
+
+    def remove(self, question_id):
+        """ Removes a question, unknown ids are ignored """
+        with self.lock:
+            text = self.questions.pop(question_id, None)
+            if text is None:
+                return
+            for key in index_keys(text):
+                ids = self.postings[key]
+                del ids[bisect_left(ids, question_id)]
+                if not ids:
+                    del self.postings[key]
+                    del self.keys[bisect_left(self.keys, key)]
+
+    def apply(self, action, question):
+        """ Applies a question insert, update or delete to the index """
+        if action == 'delete':
+            self.remove(question['id'])
+        else:
+            self.add(question['id'], question['question'])
+
+    def suggest(self, prefix, limit=DEFAULT_SUGGESTIONS):
+        """
+          Returns up to limit questions with a token or title starting with prefix
+                Parameters:
+                <str> prefix
+                <int> limit
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        with self.lock:
+            position = bisect_left(self.keys, prefix)
+            while position < len(self.keys) and len(found) < limit:
+                key = self.keys[position]
+                if not key.startswith(prefix):
+                    break
+                for question_id in self.postings[key]:
+                    if question_id not in seen:
+                        seen.add(question_id)
+                        found.append({'id': question_id,
+                                      'question': self.questions[question_id]})
+                        if len(found) == limit:
+                            break
+                position += 1
+        return found
@@ -1,34 +1,103 @@
 """ This file contains unittests for trivia app """
 
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 import json
-from flask_sqlalchemy import SQLAlchemy
-from flaskr import create_app
-from models import setup_db, Question
+from fsnd_common import jsonlog
+from flaskr import create_app, QUESTION_INDEXES, flush_scores, leaderboard, snapshot_store, \
+    stop_score_flusher, question_index, question_rows
+from suggestions import SuggestIndex
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from query_engine import QuestionEngine, numpy
+from duplicates import encode_signature, minhash
+from models import DB, IN_MEMORY_PATHS, create_schema, bind_session, bump_table_version, \
+    table_version, add_scores, TenantEngines, Question, QuestionSignature, Category, Score, Job
+
+# Set TRIVIA_TEST_DATABASE=sqlite:// to run against an in-memory copy of trivia.psql
+TEST_DATABASE_PATH = os.environ.get(
+    'TRIVIA_TEST_DATABASE',
+    "postgresql://{}:{}@{}/{}".format('postgres', 'postgres', 'localhost:5432', 'trivia_test'))
+TRIVIA_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+SHARED_APP = None
+
+
+def load_trivia_dump():
+    """Copies the rows of the trivia.psql COPY blocks into the test database."""
+    tables = {'categories': Category.__table__, 'questions': Question.__table__}
+    with open(TRIVIA_DUMP) as dump:
+        lines = iter(dump.read().splitlines())
+    for line in lines:
+        if not line.startswith('COPY public.'):
+            continue
+        table, columns = line[len('COPY public.'):].split(' ', 1)
+        columns = columns[columns.index('(') + 1:columns.index(')')].split(', ')
+        rows = []
+        for row in lines:
+            if row == '\\.':
+                break
+            rows.append(dict(zip(columns, row.split('\t'))))
+        DB.session.execute(tables[table].insert(), rows)
+    DB.session.commit()
+
+
+def use_sqlite_savepoints(engine):
+    """pysqlite issues its own BEGIN/COMMIT, hand transactions to SQLAlchemy."""
+
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN')
+
+
+def shared_app():
+    """Returns the one app every TriviaTestCase test shares, schema created once."""
+    global SHARED_APP
+    if SHARED_APP is None:
+        SHARED_APP = create_app({'DATABASE_PATH': TEST_DATABASE_PATH, 'JOB_EAGER': True,
+                                 'EVENTS_HEARTBEAT_SECONDS': 0.05,
+                                 'SCORE_FLUSH_BACKGROUND': False,
+                                 'QUESTION_INDEX_BACKGROUND': False})
+        with SHARED_APP.app_context():
+            if TEST_DATABASE_PATH.startswith('sqlite'):
+                use_sqlite_savepoints(DB.engine)
+            create_schema(SHARED_APP)
+            if TEST_DATABASE_PATH in IN_MEMORY_PATHS:
+                load_trivia_dump()
+    return SHARED_APP
+
+
+def restart_savepoint(session, transaction):
+    """Opens a new SAVEPOINT whenever the app commits the current one."""
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Define test variables and start a transaction rolled back after the test."""
+        self.app = shared_app()
         self.client = self.app.test_client
-        # defining test database
-        self.database_name = "trivia_test"
-        # self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        self.database_path = "postgresql://{}:{}@{}/{}".format('postgres',
-                                                               'postgres',
-                                                               'localhost:5432',
-                                                               self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+
+        self.context = self.app.app_context()
+        self.context.push()
+        self.connection = DB.engine.connect()
+        self.transaction = self.connection.begin()
+        bind_session(self.connection)
+        DB.session.begin_nested()
+        event.listen(DB.session(), 'after_transaction_end', restart_savepoint)
 
         self.new_question = {
             'new_question': 'Who is the current president of U.S.A',
@@ -39,10 +108,129 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after reach test"""
+        # in-memory indexes and the snapshot may hold rows of the rolled back transaction
+        store = snapshot_store()
+        if store is not None:
+            store.invalidate()
+        for name in list(QUESTION_INDEXES) + ['leaderboards', 'question_snapshots']:
+            self.app.extensions.pop(name, None)
+        DB.session.remove()
+        self.transaction.rollback()
+        self.connection.close()
+        self.context.pop()
 
     # @TODO
     # Write at least one test for each test for successful operation and for expected errors.
 
+    def test_bump_table_version(self):
+        """
+            Test case for the table version upsert, the first bump inserts
+            the row and later bumps increment it
+        """
+        bump_table_version('upserted')
+        self.assertEqual(table_version('upserted'), 1)
+        bump_table_version('upserted')
+        self.assertEqual(table_version('upserted'), 2)
+
+    def test_request_id(self):
+        """
+            Test case for the X-Request-ID header, a client request id is echoed
+            and one is generated for requests without it
+        """
+        response = self.client().get('/categories', headers={'X-Request-ID': 'abc123'})
+        self.assertEqual(response.headers['X-Request-ID'], 'abc123')
+
+        response = self.client().get('/categories')
+        self.assertEqual(len(response.headers['X-Request-ID']), 32)
+
+    def read_events(self, response, count):
+        """Returns the first count events of a /events stream as (id, event, data)."""
+        events = []
+        for chunk in response.response:
+            for block in chunk.decode('utf-8').split('\n\n'):
+                fields = dict(line.split(': ', 1) for line in block.splitlines()
+                              if not line.startswith(':'))
+                if 'event' in fields:
+                    events.append((fields['id'], fields['event'], json.loads(fields['data'])))
+            if len(events) >= count:
+                response.close()
+                return events
+
+    def test_events(self):
+        """
+            Test case for /events endpoint, streams question changes
+            and resumes after the Last-Event-ID of a client
+        """
+        response = self.client().get('/events', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        created = json.loads(self.client().post('/questions/new', json={
+            'question': 'Who wrote Hamlet?', 'answer': 'Shakespeare',
+            'category': 4, 'difficulty': 2}).data)
+        self.client().delete('/questions/{}'.format(created['created_question']))
+
+        events = self.read_events(response, 2)
+        self.assertEqual([(event, data['action']) for _, event, data in events],
+                         [('question', 'insert'), ('question', 'delete')])
+        self.assertEqual(events[0][2], {'action': 'insert', 'id': created['created_question'],
+                                        'category': '4'})
+
+        response = self.client().get('/events', buffered=False,
+                                     headers={'Last-Event-ID': events[0][0]})
+        self.assertEqual(self.read_events(response, 1), events[1:])
+
+        response = self.client().get('/events?last_event_id=unknown-1', buffered=False)
+        self.assertEqual(self.read_events(response, 1)[0][1], 'reset')
+
+    def test_batch(self):
+        """
+            Test case for /batch endpoint, runs every sub-request
+            and loads the category list once for all of them
+        """
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(DB.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client().post('/batch', json={'requests': [
+                {'path': '/categories'},
+                {'path': '/questions?page=1'},
+                {'path': '/categories/1/questions'},
+                {'method': 'POST', 'path': '/questions/search', 'body': {'searchTerm': 'title'}},
+                {'path': '/questions/100000'}
+            ]})
+        finally:
+            event.remove(DB.engine, 'before_cursor_execute', record)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['status'] for entry in data['responses']],
+                         [200, 200, 200, 200, 405])
+        first_page = json.loads(self.client().get('/questions?page=1').data)
+        self.assertEqual(data['responses'][1]['body']['questions'], first_page['questions'])
+        self.assertTrue(data['responses'][1]['headers']['ETag'])
+        self.assertEqual(len([statement for statement in statements
+                              if 'FROM categories' in statement]), 1)
+
+    def test_batch_errors(self):
+        """
+            Test case for /batch endpoint, returns 422 for an empty, too long
+            or malformed batch, and 422 for a sub-request to /batch or /events
+        """
+        for body in ({'requests': []}, {'requests': [{'path': '/categories'}] * 21},
+                     {'requests': [{'path': 'categories'}]},
+                     {'requests': [{'method': 'PUT', 'path': '/categories'}]}):
+            response = self.client().post('/batch', json=body)
+            self.assertEqual(response.status_code, 422)
+
+        response = self.client().post('/batch', json={'requests': [
+            {'method': 'POST', 'path': '/batch', 'body': {'requests': []}},
+            {'path': '/events'}]})
+        data = json.loads(response.data)
+        self.assertEqual([entry['status'] for entry in data['responses']], [422, 422])
+        self.assertEqual(data['responses'][0]['body']['message'], 'Unprocessable Request')
+
     def test_get_categories(self):
         """
             Test case for /categories endpoint,
@@ -70,6 +258,79 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['questions'])
 
+    def test_get_questions_columnar(self):
+        """
+            Test case for /questions endpoint in columnar format,
+            returns 200 OK status code and parallel arrays
+            in case of success
+        """
+        response = self.client().get('/questions?format=columnar')
+        data = json.loads(response.data)
+        columns = data['questions']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(columns['ids'])
+        for key in ('questions', 'answers', 'categories', 'difficulties'):
+            self.assertEqual(len(columns[key]), len(columns['ids']))
+
+    def test_404_get_questions_columnar_error(self):
+        """
+            Test case for /questions endpoint in columnar format
+            for unavailable page number,
+            returns 404 NOT FOUND status code
+            in case of not success
+        """
+        response = self.client().get('/questions?page=150&format=columnar')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def capture_statements(self):
+        """Returns a list collecting every SQL statement sent for the rest of the test."""
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(DB.engine, 'before_cursor_execute', capture)
+        self.addCleanup(event.remove, DB.engine, 'before_cursor_execute', capture)
+        return statements
+
+    def test_304_get_questions_not_modified(self):
+        """
+            Test case for /questions endpoint with a matching If-None-Match,
+            returns 304 Not Modified after one version lookup,
+            without querying the questions table
+        """
+        response = self.client().get('/questions?page=1')
+        etag = response.headers['ETag']
+        statements = self.capture_statements()
+
+        response = self.client().get('/questions?page=1', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('FROM questions', statements[0])
+
+    def test_questions_etag_changes_on_write(self):
+        """
+            Test case for /questions and /categories/<id>/questions endpoints,
+            the ETag depends on the page and changes once a question is created
+        """
+        etag = self.client().get('/categories/5/questions').headers['ETag']
+        self.assertNotEqual(etag, self.client().get('/categories/6/questions').headers['ETag'])
+
+        self.client().post('/questions/new', json={
+            'question': 'Who directed Jurassic Park?', 'answer': 'Steven Spielberg',
+            'category': 5, 'difficulty': 2})
+        response = self.client().get('/categories/5/questions',
+                                     headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     def test_404_get_questions_error(self):
         """
             Test case for /questions endpoint for unavailable page number,
@@ -83,6 +344,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Resource Not found')
 
+    def test_404_get_questions_page_below_one(self):
+        """
+            Test case for /questions endpoint for page 0 and negative pages,
+            returns 404 NOT FOUND status code on every path
+            and deletes nothing
+        """
+        for path in ('/questions?page=0', '/questions?page=-1',
+                     '/questions?page=-1&format=columnar',
+                     '/questions?page=0&min_difficulty=1'):
+            response = self.client().get(path)
+            self.assertEqual(response.status_code, 404, path)
+            self.assertEqual(json.loads(response.data)['success'], False, path)
+
+        question_id = Question.query.order_by(Question.id).first().id
+        response = self.client().delete('/questions/{}?page=0'.format(question_id))
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNotNone(Question.query.get(question_id))
+
     def test_post_new_question(self):
         """
             Test case for /questions/new endpoint to create new question,
@@ -110,6 +389,72 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Unprocessable Request')
 
+    def test_new_question_near_duplicates(self):
+        """
+            Test case for /questions/new endpoint with a near duplicate question,
+            flagged by default and rejected with 409 Conflict on request
+        """
+        near_duplicate = {
+            'question': 'Which movie earned Tom Hanks his third straight Oscar nomination in 1996',
+            'answer': 'Apollo 13',
+            'category': 5,
+            'difficulty': 4
+        }
+        response = self.client().post('/questions/new',
+                                      json=dict(near_duplicate, on_duplicate='reject'))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['near_duplicates'][0]['id'], 2)
+
+        response = self.client().post('/questions/new', json=near_duplicate)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['near_duplicates'][0]['id'], 2)
+
+    def test_new_question_without_near_duplicates(self):
+        """
+            Test case for /questions/new endpoint with a new question,
+            returns no near duplicates
+        """
+        response = self.client().post('/questions/new', json={
+            'question': 'What is the chemical symbol of tungsten?',
+            'answer': 'W',
+            'category': 1,
+            'difficulty': 3,
+            'on_duplicate': 'reject'
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['near_duplicates'], [])
+
+    def test_import_questions_rejects_near_duplicates(self):
+        """
+            Test case for the import-questions command, a near duplicate
+            of the bank or of an earlier entry of the same file is rejected
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as questions_file:
+            json.dump([
+                {'question': 'Which river flows through Cairo?', 'answer': 'Nile',
+                 'category': 3, 'difficulty': 1},
+                {'question': 'Which river flows through Cairo', 'answer': 'The Nile',
+                 'category': 3, 'difficulty': 1},
+                {'question': 'What movie earned Tom Hanks his third straight Oscar nomination?',
+                 'answer': 'Apollo 13', 'category': 5, 'difficulty': 4}
+            ], questions_file)
+        self.addCleanup(os.remove, questions_file.name)
+
+        result = self.app.test_cli_runner().invoke(args=['import-questions',
+                                                         questions_file.name])
+        report = json.loads(result.output)
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(report['imported']), 1)
+        self.assertEqual(len(report['rejected']), 2)
+
     def test_questions_search(self):
         """
             Test case for /questions/search endpoint to find questions based posted data,
@@ -123,6 +468,114 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['questions'])
 
+    def test_questions_search_columnar(self):
+        """
+            Test case for /questions/search endpoint in columnar format,
+            returns 200 OK status code and the same questions
+            as the default format
+        """
+        response = self.client().post('/questions/search?format=columnar',
+                                      json={"searchTerm": "What"})
+        data = json.loads(response.data)
+        default = json.loads(self.client().post(
+            '/questions/search', json={"searchTerm": "What"}).data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(sorted(data['questions']['ids']),
+                         sorted(question['id'] for question in default['questions']))
+
+    def test_suggest_questions(self):
+        """
+            Test case for /questions/suggest endpoint,
+            returns 200 OK status code and questions with a word
+            or title starting with the prefix
+        """
+        response = self.client().get('/questions/suggest?q=WHA&limit=3')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_suggestions'], 3)
+        for suggestion in data['suggestions']:
+            self.assertIn('what', suggestion['question'].lower())
+
+    def test_400_suggest_questions_error(self):
+        """
+            Test case for /questions/suggest endpoint without a prefix,
+            returns 400 Bad Request status code
+        """
+        response = self.client().get('/questions/suggest?q=')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_signatures_follow_question_changes(self):
+        """
+            Test case for the stored MinHash signatures, written when a
+            question is created or updated and removed when it is deleted
+        """
+        def stored(question_id):
+            return DB.session.query(QuestionSignature.signature).filter(
+                QuestionSignature.question_id == question_id).scalar()
+
+        question = Question('Which river flows through Vienna?', 'Danube', '3', 2)
+        question.insert()
+        self.assertEqual(stored(question.id), encode_signature(minhash(question.question)))
+
+        question.question = 'Which river flows through Budapest?'
+        question.update()
+        self.assertEqual(stored(question.id), encode_signature(minhash(question.question)))
+
+        question_id = question.id
+        question.delete()
+        self.assertIsNone(stored(question_id))
+
+    def test_indexes_follow_writes_of_other_workers(self):
+        """
+            Test case for the in-memory question indexes, a write of this
+            worker is applied in place, one from outside rebuilds the index
+        """
+        self.client().get('/questions/suggest?q=what')
+        index = question_index('suggest_indexes')
+        self.client().post('/questions/new', json={'question': 'Zanzibar is part of which country?',
+                                                   'answer': 'Tanzania', 'category': 3,
+                                                   'difficulty': 2})
+        self.assertIs(question_index('suggest_indexes'), index)
+
+        # another worker, or psql
+        DB.session.execute(Question.__table__.insert(), {
+            'question': 'Zagreb is the capital of which country?', 'answer': 'Croatia',
+            'category': '3', 'difficulty': 2})
+        DB.session.commit()
+        data = json.loads(self.client().get('/questions/suggest?q=za').data)
+        self.assertEqual(sorted(suggestion['question'] for suggestion in data['suggestions']),
+                         ['Zagreb is the capital of which country?',
+                          'Zanzibar is part of which country?'])
+        self.assertIsNot(question_index('suggest_indexes'), index)
+
+    def test_suggest_follows_create_and_delete(self):
+        """
+            Test case for /questions/suggest endpoint, created questions
+            are suggested and deleted ones are not
+        """
+        self.client().get('/questions/suggest?q=what')
+        response = self.client().post('/questions/new', json={
+            'question': 'Zanzibar is part of which country?',
+            'answer': 'Tanzania',
+            'category': 3,
+            'difficulty': 2
+        })
+        question_id = json.loads(response.data)['created_question']
+        data = json.loads(self.client().get('/questions/suggest?q=zanz').data)
+        self.assertEqual([suggestion['id'] for suggestion in data['suggestions']],
+                         [question_id])
+
+        self.client().delete('/questions/{}'.format(question_id))
+        data = json.loads(self.client().get('/questions/suggest?q=zanz').data)
+        self.assertEqual(data['suggestions'], [])
+
     def test_questions_by_categories(self):
         """
             Test case for /categories/<int:category_id>/questions endpoint
@@ -169,6 +622,232 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['question'], False)
 
+    def test_check_answer(self):
+        """
+            Test case for /quizzes/answer endpoint, a misspelled answer
+            is accepted and a wrong one is not, returns 200 OK status code
+        """
+        response = self.client().post('/quizzes/answer', json={
+            'question_id': 2, 'answer': 'apolo 13'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['correct'], True)
+        self.assertEqual(data['answer'], 'Apollo 13')
+
+        response = self.client().post('/quizzes/answer', json={
+            'question_id': 2, 'answer': 'Titanic'})
+        self.assertEqual(json.loads(response.data)['correct'], False)
+
+    def test_check_answer_hidden(self):
+        """
+            Test case for /quizzes/answer endpoint with HIDE_QUIZ_ANSWERS,
+            the expected answer is only returned for a correct answer
+        """
+        self.app.config['HIDE_QUIZ_ANSWERS'] = True
+        self.addCleanup(self.app.config.pop, 'HIDE_QUIZ_ANSWERS')
+        response = self.client().post('/quizzes/answer', json={
+            'question_id': 2, 'answer': 'no idea'})
+        data = json.loads(response.data)
+        self.assertEqual(data['correct'], False)
+        self.assertNotIn('answer', data)
+
+        response = self.client().post('/quizzes/answer', json={'answers': [
+            {'question_id': 2, 'answer': 'apolo 13'}, {'question_id': 4, 'answer': 'no idea'}]})
+        results = json.loads(response.data)['results']
+        self.assertEqual(results[0]['answer'], 'Apollo 13')
+        self.assertNotIn('answer', results[1])
+
+    def test_check_answer_near_misses(self):
+        """
+            Test case for /quizzes/answer endpoint, an answer with another
+            number or a missing word is wrong however similar it is
+        """
+        response = self.client().post('/quizzes/answer', json={'answers': [
+            {'question_id': 2, 'answer': 'Apollo 14'},
+            {'question_id': 2, 'answer': 'apollo 12'},
+            {'question_id': 2, 'answer': 'apollo'},
+            {'question_id': 2, 'answer': 'Apollo thirteen'},
+            {'question_id': 12, 'answer': 'George Washington'},
+            {'question_id': 12, 'answer': 'George Washingtn Carver'}
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual([result['correct'] for result in data['results']],
+                         [False, False, False, True, False, True])
+
+    def test_check_quiz_answers(self):
+        """
+            Test case for /quizzes/answer endpoint with a whole quiz,
+            returns 200 OK status code and one result per answer
+        """
+        response = self.client().post('/quizzes/answer', json={'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'},
+            {'question_id': 4, 'answer': 'tom cruise'},
+            {'question_id': 9, 'answer': 'George Foreman'},
+            {'question_id': 1000, 'answer': 'anything'}
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['correct'] for result in data['results']],
+                         [True, True, False, False])
+        self.assertEqual(data['results'][3]['found'], False)
+        self.assertEqual(data['total_correct'], 2)
+
+    def test_check_answer_errors(self):
+        """
+            Test case for /quizzes/answer endpoint errors,
+            returns 404 for an unknown question and 400 for a malformed body
+        """
+        response = self.client().post('/quizzes/answer', json={
+            'question_id': 1000, 'answer': 'anything'})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client().post('/quizzes/answer', json={'answer': 'anything'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_leaderboard(self):
+        """
+            Test case for /leaderboard endpoints, correct answers score a point
+            on the global and the category boards, returns ranks and top players
+        """
+        response = self.client().post('/leaderboard/scores', json={'player': 'ada', 'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'},
+            {'question_id': 9, 'answer': 'Muhammad Ali'}]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total_correct'], 2)
+        self.assertEqual(data['player'], {'player': 'ada', 'score': 2, 'rank': 1,
+                                          'total_players': 1})
+
+        self.client().post('/leaderboard/scores', json={'player': 'bob', 'answers': [
+            {'question_id': 2, 'answer': 'apolo 13'},
+            {'question_id': 4, 'answer': 'Titanic'}]})
+        self.client().post('/leaderboard/scores', json={'player': 'cy', 'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'}]})
+
+        data = json.loads(self.client().get('/leaderboard?limit=2').data)
+        self.assertEqual(data['total_players'], 3)
+        self.assertEqual(data['leaderboard'], [{'rank': 1, 'player': 'ada', 'score': 2},
+                                               {'rank': 2, 'player': 'bob', 'score': 1}])
+
+        category = Question.query.get(2).category
+        data = json.loads(self.client().get(
+            '/leaderboard/players/cy?category={}'.format(category)).data)
+        self.assertEqual((data['score'], data['rank']), (1, 1))
+
+        data = json.loads(self.client().get('/leaderboard/players/cy').data)
+        self.assertEqual((data['score'], data['rank']), (1, 2))
+
+    def test_leaderboard_answer_scores_once(self):
+        """
+            Test case for /leaderboard/scores, a question a player already
+            scored is still checked but adds no point again
+        """
+        answers = {'player': 'mallory', 'answers': [{'question_id': 2, 'answer': 'Apollo 13'}]}
+        for attempt in range(5):
+            data = json.loads(self.client().post('/leaderboard/scores', json=answers).data)
+            self.assertEqual(data['total_correct'], 1)
+            self.assertEqual(data['total_scored'], 1 if attempt == 0 else 0)
+        self.assertEqual(data['player']['score'], 1)
+
+        answers['answers'].append({'question_id': 4, 'answer': 'Titanic'})
+        data = json.loads(self.client().post('/leaderboard/scores', json=answers).data)
+        self.assertEqual((data['total_scored'], data['player']['score']), (0, 1))
+
+        # another player still scores the question
+        answers['player'] = 'ada'
+        data = json.loads(self.client().post('/leaderboard/scores', json=answers).data)
+        self.assertEqual(data['player']['score'], 1)
+
+    def test_leaderboard_rebuild(self):
+        """
+            Test case for the leaderboard persistence, written scores are
+            loaded back when the leaderboard is rebuilt from the scores table
+        """
+        self.client().post('/leaderboard/scores', json={'player': 'ada', 'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'}]})
+        flush_scores(leaderboard(), force=True)
+        self.app.extensions.pop('leaderboards')
+
+        data = json.loads(self.client().get('/leaderboard').data)
+        self.assertEqual(data['leaderboard'], [{'rank': 1, 'player': 'ada', 'score': 1}])
+
+    def test_leaderboard_follows_other_workers(self):
+        """
+            Test case for the leaderboard refresh, scores written by another
+            worker show up, the batches of this worker do not rebuild the boards
+        """
+        self.client().post('/leaderboard/scores', json={'player': 'ada', 'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'}]})
+        board = leaderboard()
+        flush_scores(board, force=True)
+        self.assertEqual(board.generation, table_version('scores'))
+        self.assertIs(leaderboard().boards, board.boards)
+
+        # another worker
+        add_scores({('zed', 'all'): 5})
+        data = json.loads(self.client().get('/leaderboard').data)
+        self.assertEqual(data['leaderboard'], [{'rank': 1, 'player': 'zed', 'score': 5},
+                                               {'rank': 2, 'player': 'ada', 'score': 1}])
+
+    def test_leaderboard_errors(self):
+        """
+            Test case for /leaderboard endpoints errors,
+            returns 400 without a player and 404 for an unknown player
+        """
+        response = self.client().post('/leaderboard/scores', json={'answers': [
+            {'question_id': 2, 'answer': 'Apollo 13'}]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client().get('/leaderboard/players/nobody')
+        self.assertEqual(response.status_code, 404)
+
+    def test_import_questions_job(self):
+        """
+            Test case for /jobs endpoints, an import job runs to completion
+            and its result can be fetched, returns 202 Accepted on submit
+        """
+        response = self.client().post('/jobs', json={'type': 'import_questions', 'params': {
+            'questions': [{'question': 'What is the capital of Mongolia?',
+                           'answer': 'Ulaanbaatar', 'category': 3, 'difficulty': 4}]}})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(data['success'], True)
+
+        response = self.client().get('/jobs/{}'.format(data['job']['id']))
+        job = json.loads(response.data)['job']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['progress'], 1.0)
+        self.assertEqual(len(job['result']['imported']), 1)
+
+        response = self.client().delete('/jobs/{}'.format(job['id']))
+        self.assertEqual(response.status_code, 409)
+
+    def test_job_errors(self):
+        """
+            Test case for /jobs endpoints errors, unknown job types return 422,
+            unknown jobs 404 and failing jobs are reported as failed
+        """
+        response = self.client().post('/jobs', json={'type': 'drop_everything'})
+        self.assertEqual(response.status_code, 422)
+
+        response = self.client().get('/jobs/100000')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client().post('/jobs', json={'type': 'import_questions', 'params': {
+            'questions': [], 'on_duplicate': 'ignore'}})
+        job_id = json.loads(response.data)['job']['id']
+        job = json.loads(self.client().get('/jobs/{}'.format(job_id)).data)['job']
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('on_duplicate', job['error'])
+
     def test_delete_question(self):
         """
             Test case for /questions/id endpoint to delete a question,
@@ -204,6 +883,890 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Resource Not found')
 
+    def test_cors_headers(self):
+        """
+            Test case for CORS, requests and preflights from the frontend
+            origin get Access-Control-Allow-Origin
+        """
+        origin = {'Origin': 'http://localhost:3000'}
+        # every origin is allowed, flask-cors answers with the requesting one
+        response = self.client().get('/categories', headers=origin)
+        self.assertEqual(response.headers.get('Access-Control-Allow-Origin'),
+                         'http://localhost:3000')
+
+        response = self.client().options('/questions/new', headers=dict(
+            origin, **{'Access-Control-Request-Method': 'POST',
+                       'Access-Control-Request-Headers': 'Content-Type'}))
+        self.assertEqual(response.headers.get('Access-Control-Allow-Origin'),
+                         'http://localhost:3000')
+        self.assertIn('POST', response.headers.get('Access-Control-Allow-Methods'))
+
+    def test_logging_keeps_other_root_handlers(self):
+        """
+            Test case for jsonlog, setting up another app keeps the handlers
+            others added to the root logger and its one queue handler
+        """
+        root = logging.getLogger()
+        handler = logging.NullHandler()
+        root.addHandler(handler)
+        self.addCleanup(root.removeHandler, handler)
+
+        create_app(dict(self.app.config, DATABASE_PATH='sqlite://'))
+
+        self.assertIn(handler, root.handlers)
+        self.assertEqual([other.get_name() for other in root.handlers].count(jsonlog.HANDLER_NAME), 1)
+
+    def test_logged_exception_has_traceback(self):
+        """
+            Test case for jsonlog, the traceback of logger.exception
+            reaches the writer in the exception field
+        """
+        handler = jsonlog.start_listener(None, jsonlog.DEFAULT_QUEUE_SIZE, jsonlog.DEFAULT_LEVEL)
+        try:
+            raise ValueError('broken %s')
+        except ValueError:
+            record = logging.getLogger(__name__).makeRecord(
+                __name__, logging.ERROR, __file__, 0, 'failed %s', ('job',), sys.exc_info())
+
+        entry = json.loads(jsonlog.JsonFormatter().format(handler.prepare(record)))
+
+        self.assertEqual(entry['message'], 'failed job')
+        self.assertIn('Traceback', entry['exception'])
+        self.assertIn('ValueError: broken %s', entry['exception'])
+
+
+class FileDatabaseTestCase(unittest.TestCase):
+    """This class is the base of the test cases running an app on SQLite files"""
+
+    # database file of the app, in the temporary folder of the test
+    DATABASE_FILE = 'trivia.db'
+
+    def setUp(self):
+        """Define a temporary folder and the app config, the test case creates the app."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = {
+            'DATABASE_PATH': self.database_path(self.DATABASE_FILE),
+            'CREATE_SCHEMA': True,
+            'SNAPSHOT_DIR': self.directory.name
+        }
+        self.app = None
+
+    def tearDown(self):
+        """Executed after reach test"""
+        if self.app is not None:
+            with self.app.app_context():
+                DB.get_engine(self.app).dispose()
+        self.directory.cleanup()
+
+    def database_path(self, name):
+        """Returns the url of the SQLite database file name in the temporary folder."""
+        return 'sqlite:///' + os.path.join(self.directory.name, name)
+
+    def create_app(self, **config):
+        """Creates self.app from the config of the test case, updated with config."""
+        self.app = create_app(dict(self.config, **config))
+        self.client = self.app.test_client
+        return self.app
+
+    def add_rows(self, *rows):
+        """Commits model objects to the database of self.app."""
+        with self.app.app_context():
+            DB.session.add_all(rows)
+            DB.session.commit()
+
+
+class TenantTestCase(FileDatabaseTestCase):
+    """This class represents the multi-tenant routing test case"""
+
+    def setUp(self):
+        """Define one SQLite database per tenant and initialize app."""
+        super().setUp()
+        self.create_app(DATABASE_PATH=TEST_DATABASE_PATH, CREATE_SCHEMA=False,
+                        TENANT_DATABASES=self.database_path('trivia_{tenant}.db'),
+                        TENANT_DOMAIN='trivia.test', MAX_TENANT_ENGINES=1,
+                        TENANT_METRICS_TOKEN='secret')
+        for tenant in ('acme', 'globex'):
+            self.app.extensions['tenant_engines'].provision(tenant)
+        self.new_question = {
+            'question': 'Who painted the Mona Lisa?',
+            'answer': 'Leonardo da Vinci',
+            'category': 2,
+            'difficulty': 1
+        }
+
+    def tearDown(self):
+        """Executed after reach test"""
+        for engine in self.app.extensions['tenant_engines'].engines.values():
+            engine.dispose()
+        super().tearDown()
+
+    def test_tenants_are_isolated(self):
+        """
+            Test case for tenant routing, a question created for one tenant
+            is not visible to another tenant
+        """
+        response = self.client().post('/questions/new', json=self.new_question,
+                                      headers={'X-Tenant': 'acme'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client().get('/questions', headers={'X-Tenant': 'acme'})
+        data = json.loads(response.data)
+        self.assertEqual(data['total_questions'], 1)
+
+        response = self.client().get('/questions', base_url='http://globex.trivia.test')
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_unknown_tenant(self):
+        """
+            Test case for tenant routing without a valid tenant,
+            returns 404 NOT FOUND status code
+        """
+        self.assertEqual(self.client().get('/questions').status_code, 404)
+        response = self.client().get('/questions', headers={'X-Tenant': '../trivia'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_tenant_not_provisioned(self):
+        """
+            Test case for tenant routing to a valid name without a database,
+            returns 404 NOT FOUND status code and creates nothing
+        """
+        response = self.client().get('/questions', headers={'X-Tenant': 'initech'})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'trivia_initech.db')))
+        self.assertNotIn('initech', self.app.extensions['tenant_engines'].stats)
+
+    def test_tenant_stats_bounded(self):
+        """
+            Test case for the tenant metrics, beyond max_stats tenants
+            the metrics of tenants without an open engine are dropped
+        """
+        tenant_engines = TenantEngines(self.app.config['TENANT_DATABASES'], 1, max_stats=1)
+        tenant_engines.engine('acme')
+        tenant_engines.engine('globex')
+
+        self.assertEqual(list(tenant_engines.stats), ['globex'])
+        for engine in tenant_engines.engines.values():
+            engine.dispose()
+
+    def test_concurrent_first_requests_open_one_engine(self):
+        """
+            Test case for engine creation, concurrent first requests
+            of a tenant share the one engine opened for them
+        """
+        tenant_engines = self.app.extensions['tenant_engines']
+        engines = []
+        threads = [threading.Thread(target=lambda: engines.append(tenant_engines.engine('acme')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(engine) for engine in engines}), 1)
+        self.assertEqual(tenant_engines.stats['acme']['engines_created'], 1)
+
+    def test_tenant_engines_eviction_and_metrics(self):
+        """
+            Test case for /tenants/metrics endpoint, idle engines beyond
+            MAX_TENANT_ENGINES are evicted and counted per tenant
+        """
+        self.client().get('/questions', headers={'X-Tenant': 'acme'})
+        self.client().get('/questions', headers={'X-Tenant': 'globex'})
+        self.assertEqual(self.client().get('/tenants/metrics').status_code, 401)
+        response = self.client().get('/tenants/metrics',
+                                     headers={'Authorization': 'Bearer secret'})
+        tenants = json.loads(response.data)['tenants']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(tenants['acme']['engines_evicted'], 1)
+        self.assertFalse(tenants['acme']['engine_open'])
+        self.assertTrue(tenants['globex']['engine_open'])
+        self.assertEqual(tenants['globex']['requests'], 1)
+
+
+class ReplicaTestCase(FileDatabaseTestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        """Define two SQLite replica stand-ins, each test initializes the app."""
+        super().setUp()
+        self.replica_paths = []
+        for name in ('Replica A', 'Replica B'):
+            path = self.database_path(name.replace(' ', '_') + '.db')
+            engine = create_engine(path)
+            DB.Model.metadata.create_all(engine)
+            engine.execute(Category.__table__.insert(), type=name)
+            engine.dispose()
+            self.replica_paths.append(path)
+        self.missing_replica = self.database_path(os.path.join('missing', 'replica.db'))
+
+    def tearDown(self):
+        """Executed after reach test"""
+        if self.app is not None:
+            for engine in self.app.extensions['replica_router'].engines:
+                engine.dispose()
+        super().tearDown()
+
+    def replica_client(self, replica_paths, strategy='round_robin'):
+        self.create_app(DATABASE_PATH=TEST_DATABASE_PATH, DATABASE_REPLICAS=replica_paths,
+                        REPLICA_STRATEGY=strategy)
+        return self.client()
+
+    def test_round_robin_replicas(self):
+        """
+            Test case for replica routing, read-only requests
+            alternate between the replicas
+        """
+        client = self.replica_client(self.replica_paths)
+        served = [json.loads(client.get('/categories').data)['categories']
+                  for i in range(4)]
+
+        self.assertEqual(served, [['Replica A'], ['Replica B'],
+                                  ['Replica A'], ['Replica B']])
+
+    def test_least_connections_replicas(self):
+        """
+            Test case for replica routing, an idle replica
+            is preferred to a busy one
+        """
+        client = self.replica_client(self.replica_paths, 'least_connections')
+        router = self.app.extensions['replica_router']
+        busy = router.acquire()
+        data = json.loads(client.get('/categories').data)
+        router.release(busy)
+
+        self.assertEqual(busy[0], 0)
+        self.assertEqual(data['categories'], ['Replica B'])
+
+    def test_replica_failover(self):
+        """
+            Test case for replica routing, a replica that can not connect
+            is skipped and the next one serves the request
+        """
+        client = self.replica_client([self.missing_replica, self.replica_paths[1]])
+        served = [json.loads(client.get('/categories').data)['categories']
+                  for i in range(2)]
+
+        self.assertEqual(served, [['Replica B'], ['Replica B']])
+
+    def test_read_your_writes_on_primary(self):
+        """
+            Test case for replica routing, after a write the client
+            reads from the primary
+        """
+        client = self.replica_client(self.replica_paths)
+        response = client.post('/questions/new', json={
+            'question': 'Which planet is known as the red planet?',
+            'answer': 'Mars',
+            'category': 1,
+            'difficulty': 1
+        })
+        data = json.loads(client.get('/categories').data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Replica A', data.get('categories', []))
+        self.assertNotIn('Replica B', data.get('categories', []))
+
+    def test_batch_routed_by_sub_requests(self):
+        """
+            Test case for replica routing of /batch, a read-only batch is served
+            by a replica without pinning, a batch with a write pins the client
+        """
+        client = self.replica_client(self.replica_paths)
+        # only the primary has the question
+        self.add_rows(Question('Which planet is known as the red planet?', 'Mars', '1', 1))
+        search = {'method': 'POST', 'path': '/questions/search', 'body': {'searchTerm': 'planet'}}
+        response = client.post('/batch', json={'requests': [
+            {'path': '/categories'}, search, search, {'path': '/categories'}]})
+        responses = json.loads(response.data)['responses']
+        self.assertEqual([sub['status'] for sub in responses], [200] * 4)
+        self.assertEqual(responses[0]['body']['categories'], ['Replica A'])
+        self.assertEqual(responses[1]['body']['questions'], [])
+        self.assertEqual(responses[2]['body']['questions'], [])
+        self.assertEqual(responses[3]['body']['categories'], ['Replica A'])
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(json.loads(client.get('/categories').data)['categories'], ['Replica B'])
+
+        response = client.post('/batch', json={'requests': [
+            {'path': '/categories'},
+            {'method': 'DELETE', 'path': '/questions/100000'}]})
+        self.assertNotIn('Set-Cookie', response.headers)
+
+        response = client.post('/batch', json={'requests': [
+            {'method': 'POST', 'path': '/questions/new', 'body': {
+                'question': 'Which planet is known as the red planet?', 'answer': 'Mars',
+                'category': 1, 'difficulty': 1}}]})
+        self.assertIn('trivia_primary', response.headers['Set-Cookie'])
+
+
+class JobExecutorTestCase(FileDatabaseTestCase):
+    """This class represents the background job executor test case"""
+
+    DATABASE_FILE = 'jobs.db'
+
+    def setUp(self):
+        """Define a SQLite database and an app with one job worker and queue slot."""
+        super().setUp()
+        self.create_app(JOB_WORKERS=1, JOB_QUEUE_SIZE=1)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.app.extensions['jobs'].job_types['wait'] = self.wait_job
+
+    def tearDown(self):
+        """Executed after reach test"""
+        self.release.set()
+        self.app.extensions['jobs'].stop()
+        super().tearDown()
+
+    def wait_job(self, params, job):
+        self.started.set()
+        while not self.release.is_set():
+            job.progress(0, 1)
+            time.sleep(0.01)
+        return {'waited': True}
+
+    def job_status(self, job_id):
+        return json.loads(self.client().get('/jobs/{}'.format(job_id)).data)['job']['status']
+
+    def test_backpressure_and_cancel(self):
+        """
+            Test case for /jobs endpoints, jobs beyond the worker and queue
+            limits get 503 with Retry-After, queued and running jobs can be cancelled
+        """
+        running = json.loads(self.client().post('/jobs', json={'type': 'wait'}).data)['job']
+        self.assertTrue(self.started.wait(5))
+        queued = json.loads(self.client().post('/jobs', json={'type': 'wait'}).data)['job']
+
+        response = self.client().post('/jobs', json={'type': 'wait'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '30')
+
+        self.assertEqual(self.client().delete('/jobs/{}'.format(queued['id'])).status_code, 200)
+        self.assertEqual(self.job_status(queued['id']), 'cancelled')
+
+        self.client().delete('/jobs/{}'.format(running['id']))
+        deadline = time.time() + 5
+        while self.job_status(running['id']) != 'cancelled' and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.job_status(running['id']), 'cancelled')
+
+    def test_job_runs_once(self):
+        """
+            Test case for the job status updates, two workers executing
+            the same queued job run it once
+        """
+        runs = []
+        self.app.extensions['jobs'].job_types['count'] = lambda params, job: runs.append(1)
+        with self.app.app_context():
+            job = Job('count')
+            job.insert()
+            job_id = job.id
+
+        def execute():
+            with self.app.app_context():
+                self.app.extensions['jobs'].execute(job_id)
+
+        workers = [threading.Thread(target=execute) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(self.job_status(job_id), 'succeeded')
+
+    def add_stale_jobs(self):
+        """ Adds a stale job per status and a fresh queued job, returns their ids """
+        with self.app.app_context():
+            jobs = {}
+            for status in ('queued', 'running', 'cancelling', 'succeeded'):
+                job = Job('wait')
+                job.status = status
+                DB.session.add(job)
+                jobs[status] = job
+            fresh = Job('wait')
+            DB.session.add(fresh)
+            DB.session.commit()
+            Job.query.filter(Job.id != fresh.id).update({'updated_at': time.time() - 3600})
+            DB.session.commit()
+            ids = {status: job.id for status, job in jobs.items()}
+            ids['fresh'] = fresh.id
+        return ids
+
+    def assert_recovered(self, ids):
+        self.assertEqual(self.job_status(ids['queued']), 'failed')
+        self.assertEqual(self.job_status(ids['running']), 'failed')
+        self.assertEqual(self.job_status(ids['cancelling']), 'cancelled')
+        self.assertEqual(self.job_status(ids['succeeded']), 'succeeded')
+        self.assertEqual(self.job_status(ids['fresh']), 'queued')
+
+    def test_start_writes_no_jobs(self):
+        """
+            Test case for the job recovery, an app starting does not touch
+            the jobs of other processes
+        """
+        ids = self.add_stale_jobs()
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            app = create_app(dict(self.app.config, JOB_STALE_SECONDS=60))
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+        app.extensions['jobs'].stop()
+
+        self.assertFalse([statement for statement in statements
+                          if statement.lstrip().upper().startswith('UPDATE')])
+        self.assertEqual(self.job_status(ids['queued']), 'queued')
+
+    def test_stale_jobs_recovered_by_command(self):
+        """
+            Test case for flask recover-jobs, jobs left queued or running by
+            a stopped process are failed
+        """
+        ids = self.add_stale_jobs()
+
+        result = self.app.test_cli_runner().invoke(args=['recover-jobs', '--stale-seconds', '60'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('3 stale jobs recovered', result.output)
+        self.assert_recovered(ids)
+
+    def test_stale_jobs_recovered_on_first_submit(self):
+        """
+            Test case for the job recovery, the first job a process submits
+            fails the stale jobs once
+        """
+        ids = self.add_stale_jobs()
+        self.app.extensions['jobs'].stale_seconds = 60
+
+        self.client().post('/jobs', json={'type': 'wait'})
+        self.assertTrue(self.started.wait(5))
+
+        self.assert_recovered(ids)
+        self.assertEqual(self.app.extensions['jobs'].recovered, {None})
+
+    def test_heartbeat_keeps_live_jobs(self):
+        """
+            Test case for the job heartbeat, the running and queued jobs of a
+            live process are not recovered however long they wait
+        """
+        self.app.extensions['jobs'].heartbeat_seconds = 0.05
+        running = json.loads(self.client().post('/jobs', json={'type': 'wait'}).data)['job']
+        self.assertTrue(self.started.wait(5))
+        queued = json.loads(self.client().post('/jobs', json={'type': 'wait'}).data)['job']
+        with self.app.app_context():
+            Job.query.update({'updated_at': time.time() - 3600})
+            DB.session.commit()
+            deadline = time.time() + 5
+            while (Job.query.get(queued['id']).updated_at < time.time() - 60 and
+                   time.time() < deadline):
+                DB.session.rollback()
+                time.sleep(0.05)
+
+        self.app.test_cli_runner().invoke(args=['recover-jobs', '--stale-seconds', '60'])
+
+        self.assertEqual(self.job_status(running['id']), 'running')
+        self.assertEqual(self.job_status(queued['id']), 'queued')
+
+
+class RestoredDatabaseTestCase(FileDatabaseTestCase):
+    """This class represents the trivia.psql restore without flask init-db test case"""
+
+    DATABASE_FILE = 'restored.db'
+
+    def setUp(self):
+        """Define a SQLite database file with only the tables of trivia.psql and initialize app."""
+        super().setUp()
+        engine = create_engine(self.config['DATABASE_PATH'])
+        for table in (Category.__table__, Question.__table__):
+            table.create(engine)
+        engine.execute(Category.__table__.insert(), type='Science')
+        engine.dispose()
+        self.create_app(CREATE_SCHEMA=False)
+
+    def test_writes_without_table_versions(self):
+        """
+            Test case for /questions endpoints on a database without the
+            table_versions and question_signatures tables, writes still succeed
+        """
+        response = self.client().post('/questions/new', json={
+            'question': 'What is H2O?', 'answer': 'Water', 'category': 1, 'difficulty': 1})
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(self.client().get('/questions').data)
+        self.assertEqual([question['answer'] for question in data['questions']], ['Water'])
+
+        response = self.client().delete('/questions/{}'.format(data['questions'][0]['id']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client().get('/questions').status_code, 404)
+
+
+class ScoreFlusherTestCase(FileDatabaseTestCase):
+    """This class represents the background leaderboard flush test case"""
+
+    DATABASE_FILE = 'scores.db'
+
+    def setUp(self):
+        """Define a SQLite database file with one question and initialize app."""
+        super().setUp()
+        self.create_app(SCORE_FLUSH_SECONDS=0.05)
+        self.add_rows(Category('History'),
+                      Question('Which mission landed on the moon first?', 'Apollo 11', '1', 1))
+
+    def tearDown(self):
+        """Executed after reach test"""
+        stop_score_flusher(self.app)
+        super().tearDown()
+
+    def stored_scores(self):
+        with self.app.app_context():
+            return sorted(Score.query.with_entities(Score.player, Score.category, Score.score))
+
+    def submit(self, player):
+        response = self.client().post('/leaderboard/scores', json={'player': player, 'answers': [
+            {'question_id': 1, 'answer': 'Apollo 11'}]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_batch_written_in_background(self):
+        """
+            Test case for the score flusher, points are written after
+            SCORE_FLUSH_SECONDS without another submission
+        """
+        self.submit('ada')
+        deadline = time.time() + 5
+        while not self.stored_scores() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.stored_scores(), [('ada', '1', 1), ('ada', 'all', 1)])
+
+    def test_pending_scores_written_on_stop(self):
+        """
+            Test case for the exit flush, pending points are written
+            when the flusher stops
+        """
+        self.app.config['SCORE_FLUSH_SECONDS'] = 60
+        self.submit('bob')
+        self.assertEqual(self.stored_scores(), [])
+
+        stop_score_flusher(self.app)
+        self.assertEqual(self.stored_scores(), [('bob', '1', 1), ('bob', 'all', 1)])
+
+
+class SnapshotTestCase(FileDatabaseTestCase):
+    """This class represents the memory-mapped question snapshot test case"""
+
+    DATABASE_FILE = 'snapshot.db'
+
+    def setUp(self):
+        """Define a SQLite database file with two categories and initialize app."""
+        super().setUp()
+        self.create_app()
+        self.add_rows(Category('Science'), Category('Art'))
+
+    def create_question(self, question, category):
+        response = self.client().post('/questions/new', json={
+            'question': question, 'answer': 'An answer', 'category': category, 'difficulty': 1})
+        return json.loads(response.data)['created_question']
+
+    def snapshot_files(self):
+        return [name for name in os.listdir(self.directory.name) if name.endswith('.snap')]
+
+    def test_questions_from_snapshot(self):
+        """
+            Test case for /questions read from the snapshot, it is written
+            on the first read after a change and shared by other processes
+        """
+        first = self.create_question('What is H2O?', 1)
+        self.assertEqual(len(self.snapshot_files()), 1)
+        self.create_question('Who painted Guernica?', 2)
+
+        data = json.loads(self.client().get('/questions').data)
+        self.assertEqual(len(self.snapshot_files()), 1)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(data['questions'][0], {
+            'id': first, 'question': 'What is H2O?', 'answer': 'An answer',
+            'category': '1', 'difficulty': 1})
+
+        # another worker process attaches the same snapshot file
+        other = create_app(self.config)
+        with other.app_context():
+            self.assertEqual(len(snapshot_store().current()), 2)
+
+        self.client().delete('/questions/{}'.format(first))
+        data = json.loads(other.test_client().get('/questions').data)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['question'], 'Who painted Guernica?')
+
+    def test_snapshot_follows_writes_outside_the_app(self):
+        """
+            Test case for /questions read from the snapshot, a question
+            inserted with plain SQL, as psql would, is listed on the next read
+        """
+        self.create_question('What is H2O?', 1)
+        self.assertEqual(json.loads(self.client().get('/questions').data)['total_questions'], 1)
+
+        engine = create_engine(self.app.config['SQLALCHEMY_DATABASE_URI'])
+        engine.execute(Question.__table__.insert(), question='Who painted Guernica?',
+                       answer='Picasso', category='2', difficulty=1)
+        engine.dispose()
+
+        data = json.loads(self.client().get('/questions').data)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(len(self.snapshot_files()), 1)
+
+    def test_category_questions_from_snapshot(self):
+        """
+            Test case for /categories/<id>/questions read from the
+            snapshot returns only the questions of the category
+        """
+        self.create_question('What is H2O?', 1)
+        self.create_question('Who painted Guernica?', 2)
+        self.create_question('What is the speed of light?', 1)
+        self.client().get('/questions')
+
+        data = json.loads(self.client().get('/categories/1/questions').data)
+        self.assertEqual([question['question'] for question in data['questions']],
+                         ['What is H2O?', 'What is the speed of light?'])
+        self.assertEqual(data['total_questions'], 3)
+        data = json.loads(self.client().get('/categories/2/questions?format=columnar').data)
+        self.assertEqual(data['questions']['questions'], ['Who painted Guernica?'])
+
+        response = self.client().post('/quizzes', json={
+            'previous_questions': [], 'questions_per_play': 1,
+            'quiz_category': {'type': 'Art', 'id': 2}})
+        self.assertEqual(json.loads(response.data)['question']['question'],
+                         'Who painted Guernica?')
+
+
+class QuestionIndexTestCase(FileDatabaseTestCase):
+    """This class represents the background rebuild of the question indexes test case"""
+
+    DATABASE_FILE = 'indexes.db'
+
+    def setUp(self):
+        """Define a SQLite database file with one question and initialize app."""
+        super().setUp()
+        self.create_app()
+        self.add_rows(Category('Science'))
+        self.add_rows(Question('Zanzibar is part of which country?', 'Tanzania', '1', 2))
+        self.release = threading.Event()
+        self.builds = []
+
+    def suggestions(self):
+        data = json.loads(self.client().get('/questions/suggest?q=za').data)
+        return sorted(suggestion['question'] for suggestion in data['suggestions'])
+
+    def slow_build(self):
+        self.builds.append(threading.current_thread().name)
+        self.assertTrue(self.release.wait(5))
+        return SuggestIndex.build(question_rows(Question.question))
+
+    def test_rebuild_in_background(self):
+        """
+            Test case for /questions/suggest during a rebuild, requests get
+            the old index until the one build running swaps in the new one
+        """
+        self.assertEqual(self.suggestions(), ['Zanzibar is part of which country?'])
+        # another worker, or psql
+        with self.app.app_context():
+            DB.session.execute(Question.__table__.insert(), {
+                'question': 'Zagreb is the capital of which country?', 'answer': 'Croatia',
+                'category': '1', 'difficulty': 2})
+            DB.session.commit()
+
+        with mock.patch.dict(QUESTION_INDEXES, {'suggest_indexes': self.slow_build}):
+            threads = [threading.Thread(target=self.suggestions) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(self.suggestions(), ['Zanzibar is part of which country?'])
+            self.release.set()
+            deadline = time.time() + 5
+            while len(self.suggestions()) < 2 and time.time() < deadline:
+                time.sleep(0.05)
+
+        self.assertEqual(self.builds, ['question-index'])
+        self.assertEqual(self.suggestions(), ['Zagreb is the capital of which country?',
+                                              'Zanzibar is part of which country?'])
+
+
+class AdmissionTestCase(FileDatabaseTestCase):
+    """This class represents the rate limiting and load shedding test case"""
+
+    DATABASE_FILE = 'admission.db'
+
+    def setUp(self):
+        """Define a SQLite database with a few questions and initialize app."""
+        super().setUp()
+        self.create_app(ADMISSION_LIMITS={'search': {'rate': 20.0, 'burst': 3, 'concurrency': 8}})
+        self.add_rows(Category('Science'),
+                      *[Question('What is element {}?'.format(number), 'An element', '1', 1)
+                        for number in range(20)])
+        self.admission = self.app.extensions['admission']
+
+    def search(self, client_address):
+        return self.app.test_client().post('/questions/search', json={'searchTerm': 'element'},
+                                           environ_base={'REMOTE_ADDR': client_address})
+
+    def test_rate_limit_per_client(self):
+        """
+            Test case for the search rate limit, a client beyond its burst
+            gets 429 with Retry-After while other clients are served
+        """
+        statuses = [self.search('10.0.0.1').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        response = self.search('10.0.0.1')
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.search('10.0.0.2').status_code, 200)
+
+        response = self.app.test_client().post('/batch', json={'requests': [
+            {'method': 'POST', 'path': '/questions/search', 'body': {'searchTerm': 'element'}}]},
+            environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(json.loads(response.data)['responses'][0]['status'], 429)
+
+    def test_clients_behind_a_proxy(self):
+        """
+            Test case for the search rate limit behind TRUSTED_PROXIES, clients
+            sharing the proxy address are limited by their forwarded address
+        """
+        app = create_app(dict(self.app.config, TRUSTED_PROXIES=1))
+        statuses = [app.test_client().post(
+            '/questions/search', json={'searchTerm': 'element'},
+            environ_base={'REMOTE_ADDR': '10.0.0.254'},
+            headers={'X-Forwarded-For': '192.0.2.{}'.format(number % 2)}).status_code
+            for number in range(6)]
+        self.assertEqual(statuses, [200] * 6)
+
+        # limits are off unless configured
+        app = create_app(dict(self.app.config, ADMISSION_LIMITS=None))
+        self.assertNotIn('admission', app.extensions)
+
+    def test_load_shedding(self):
+        """
+            Test case for the search concurrency limit, requests beyond it
+            get 503 with Retry-After until a running request finished
+        """
+        for number in range(8):
+            self.admission.admit('search', 'running {}'.format(number))
+        response = self.search('10.0.0.1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.admission.release('search')
+        self.assertEqual(self.search('10.0.0.1').status_code, 200)
+        self.assertEqual(self.admission.metrics()['search'],
+                         {'active': 7, 'rate_limited': 0, 'overloaded': 1})
+
+    def test_well_behaved_client_under_abuse(self):
+        """
+            Test case for admission control under load, an abusive client
+            is rate limited while a client within its limit keeps a low p99
+        """
+        stop = threading.Event()
+        abusive = []
+
+        def abuse():
+            while not stop.is_set():
+                abusive.append(self.search('10.0.0.66').status_code)
+
+        threads = [threading.Thread(target=abuse) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        latencies, statuses = [], []
+        try:
+            for _ in range(20):
+                started = time.perf_counter()
+                statuses.append(self.search('10.0.0.1').status_code)
+                latencies.append(time.perf_counter() - started)
+                time.sleep(0.1)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(set(statuses), {200})
+        self.assertGreater(abusive.count(429), abusive.count(200))
+        latencies.sort()
+        self.assertLess(latencies[int(0.99 * len(latencies))], 0.5)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class QueryEngineTestCase(FileDatabaseTestCase):
+    """This class represents the NumPy query engine test case"""
+
+    DATABASE_FILE = 'engine.db'
+
+    def setUp(self):
+        """Define a SQLite database with questions of three categories and initialize app."""
+        super().setUp()
+        self.config['QUERY_ENGINE'] = 'numpy'
+        self.create_app()
+        self.add_rows(Category('Science'), Category('Art'), Category('History'),
+                      *[Question('Question {}?'.format(number), 'Answer {}'.format(number),
+                                 str(number % 3 + 1), number % 5 + 1) for number in range(30)])
+
+    def test_select(self):
+        """
+            Test case for QuestionEngine.select, every filter and
+            exclusion narrows the positions like the equivalent list comprehension
+        """
+        rows = [(number, str(number % 6 + 1), None if number == 7 else number % 5 + 1)
+                for number in range(1, 200)]
+        engine = QuestionEngine.from_rows(rows)
+        positions = engine.select(categories=[2, '5'], min_difficulty=3, exclude_ids=[9, 10])
+        self.assertEqual(engine.ids[positions].tolist(),
+                         [number for number, category, difficulty in rows
+                          if category in ('2', '5') and difficulty is not None
+                          and difficulty >= 3 and number not in (9, 10)])
+        self.assertNotIn(7, engine.ids[engine.select(max_difficulty=5)].tolist())
+        self.assertEqual(len(engine.select(categories=['unknown'])), 0)
+
+    def test_filtered_listings_match_sql(self):
+        """
+            Test case for the categories and difficulty filters of /questions
+            and /categories/<id>/questions, the engine answers like SQL
+        """
+        sql_client = create_app(dict(self.config, QUERY_ENGINE=None)).test_client()
+        for path in ('/questions?categories=1,3&min_difficulty=3',
+                     '/questions?categories=2&max_difficulty=2&page=1',
+                     '/questions?min_difficulty=2&format=columnar',
+                     '/categories/1/questions?max_difficulty=3'):
+            engine_data = json.loads(self.client().get(path).data)
+            self.assertTrue(engine_data['questions'], path)
+            self.assertEqual(engine_data, json.loads(sql_client.get(path).data), path)
+        with self.app.app_context():
+            self.assertIn(None, self.app.extensions['question_engines'])
+
+    def test_filtered_listings_page_below_one(self):
+        """
+            Test case for the engine and snapshot paths of /questions,
+            page 0 and negative pages are not sliced from the end
+        """
+        for path in ('/questions?min_difficulty=1&page=-1',
+                     '/questions?categories=1&page=0&format=columnar',
+                     '/questions?page=-1', '/questions?page=0&format=columnar'):
+            self.assertEqual(self.client().get(path).status_code, 404, path)
+
+    def test_quiz_excludes_previous_questions(self):
+        """
+            Test case for /quizzes with the engine, returns the one question
+            of the category not asked yet, then no question
+        """
+        data = json.loads(self.client().get('/categories/2/questions').data)
+        asked = [question['id'] for question in data['questions']]
+        body = {'quiz_category': {'type': 'Art', 'id': 2}, 'questions_per_play': 1,
+                'previous_questions': asked[1:]}
+        data = json.loads(self.client().post('/quizzes', json=body).data)
+        self.assertEqual(data['question']['id'], asked[0])
+
+        body['previous_questions'] = asked
+        data = json.loads(self.client().post('/quizzes', json=body).data)
+        self.assertEqual(data['question'], False)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -1,14 +1,17 @@
-import os
 from flask import Flask, request, jsonify, abort
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from fsnd_common import jsonlog, eventfeed
+from .database.models import db, db_drop_and_create_all, db_upgrade, setup_db, Drink, \
+    DrinkIngredient, normalize_ingredient, on_drink_change
 from .auth.auth import AuthError, requires_auth
 
 app = Flask(__name__)
+jsonlog.setup_logging(app)
 setup_db(app)
+eventfeed.setup_events(app)
 CORS(app)
 
 '''
@@ -18,15 +21,40 @@ CORS(app)
 '''
 # db_drop_and_create_all()
 
+'''
+uncomment the following line once to upgrade a database created before
+the drink version column and the drink_ingredients table existed, it keeps the drinks
+'''
+# db_upgrade()
+
 ## ROUTES
 '''
-@TODO implement endpoint
-    GET /drinks
-        it should be a public endpoint
-        it should contain only the drink.short() data representation
+GET /drinks
+    public endpoint, returns the drink.short() data representation
+    optional filters, answered from the drink_ingredients index:
+        ?ingredient=milk&ingredient=espresso  drinks containing the ingredients
+        ?color=%23ffffff                      drinks containing the colors
+        ?match=all (default) every ingredient and color must be in the drink
+        ?match=any at least one of them must be
     returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
-        or appropriate status code indicating reason for failure
-'''
+        or 422 for an unknown match value
+'''
+@app.route('/drinks')
+def get_drinks():
+    match = request.args.get('match', 'all')
+    if match not in ('all', 'any'):
+        abort(422)
+    ingredients = [name for name in request.args.getlist('ingredient') if name.strip()]
+    colors = [color for color in request.args.getlist('color') if color.strip()]
+    if ingredients or colors:
+        drinks = Drink.search(ingredients, colors, match_all=match == 'all').all()
+    else:
+        drinks = Drink.query.order_by(Drink.id).all()
+    return jsonify({
+        'success': True,
+        'drinks': [drink.short() for drink in drinks]
+    })
+
 
 
 '''
@@ -51,16 +79,79 @@ CORS(app)
 
 
 '''
-@TODO implement endpoint
-    PATCH /drinks/<id>
-        where <id> is the existing model id
-        it should respond with a 404 error if <id> is not found
-        it should update the corresponding row for <id>
-        it should require the 'patch:drinks' permission
-        it should contain the drink.long() data representation
-    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the updated drink
-        or appropriate status code indicating reason for failure
-'''
+valid_ingredient(ingredient)
+    True for a recipe entry drink.short() and drink.long() can show:
+    {"name": "milk", "color": "grey", "parts": 1} with a name, a color and integer parts,
+    name and color fit the drink_ingredients columns once normalized
+'''
+def valid_ingredient(ingredient):
+    return isinstance(ingredient, dict) \
+        and valid_ingredient_field(ingredient.get('name'), DrinkIngredient.name) \
+        and valid_ingredient_field(ingredient.get('color'), DrinkIngredient.color) \
+        and isinstance(ingredient.get('parts'), int) and not isinstance(ingredient['parts'], bool) \
+        and ingredient['parts'] > 0
+
+
+def valid_ingredient_field(value, column):
+    return isinstance(value, str) and 0 < len(normalize_ingredient(value)) <= column.type.length
+
+
+'''
+PATCH /drinks/<id>
+    where <id> is the existing model id
+    requires the 'patch:drinks' permission
+    body: {"title": ..., "recipe": [...], "version": 3}, title and recipe are optional
+        version (or an If-Match: "3" header) is the drink version the barista read,
+        without it the patch applies to whatever version is stored
+    the drink is updated with one UPDATE ... WHERE id = ? AND version = ? statement
+    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the updated drink.long()
+        404 if <id> is not found, 409 if the drink changed since that version,
+        422 for an invalid body: a title over 80 characters, a recipe entry without a name, color
+        or integer parts, a name over 80 or a color over 20 characters,
+        or a recipe over 180 characters once stored as json
+'''
+@app.route('/drinks/<int:drink_id>', methods=['PATCH'])
+@requires_auth('patch:drinks')
+def patch_drink(payload, drink_id):
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(422)
+    values = {}
+    if 'title' in body:
+        if not isinstance(body['title'], str) or not body['title'].strip() \
+                or len(body['title']) > Drink.title.type.length:
+            abort(422)
+        values['title'] = body['title']
+    if 'recipe' in body:
+        recipe = body['recipe'] if isinstance(body['recipe'], list) else [body['recipe']]
+        if not recipe or not all(valid_ingredient(r) for r in recipe):
+            abort(422)
+        values['recipe'] = json.dumps(recipe)
+        # longer recipes fail with a DataError on Postgres, SQLite would store them
+        if len(values['recipe']) > Drink.recipe.type.length:
+            abort(422)
+    if not values:
+        abort(422)
+
+    expected_version = body.get('version', request.headers.get('If-Match'))
+    if expected_version is not None:
+        try:
+            expected_version = int(str(expected_version).replace('W/', '').strip('"'))
+        except ValueError:
+            abort(422)
+
+    try:
+        drink, status = Drink.patch(drink_id, values, expected_version)
+    except (exc.IntegrityError, exc.DataError):
+        # a duplicate title, or a value the database column rejects
+        db.session.rollback()
+        abort(422)
+    if drink is None:
+        abort(status)
+    return jsonify({
+        'success': True,
+        'drinks': [drink.long()]
+    })
 
 
 '''
@@ -75,6 +166,19 @@ CORS(app)
 '''
 
 
+'''
+GET /events
+    public endpoint, a Server-Sent Events stream of the menu changes
+    each event is "event: drink" with data {"action": "insert" | "update" | "delete", "id": 1, "version": 2}
+    send the Last-Event-ID header (or ?last_event_id=) to resume after an event,
+        a "reset" event means events were missed and the drinks should be fetched again
+    returns status code 503 with Retry-After when EVENTS_MAX_SUBSCRIBERS streams are open
+'''
+@on_drink_change
+def publish_drink_change(action, drink):
+    eventfeed.publish('drink', {'action': action, 'id': drink.id, 'version': drink.version})
+
+
 ## Error Handling
 '''
 Example error handling for unprocessable entity
@@ -99,12 +203,35 @@ def unprocessable(error):
 '''
 
 '''
-@TODO implement error handler for 404
-    error handler should conform to general task above 
+error handler for 404
 '''
+@app.errorhandler(404)
+def not_found(error):
+    return jsonify({
+                    "success": False, 
+                    "error": 404,
+                    "message": "resource not found"
+                    }), 404
+
+'''
+error handler for 409, a PATCH based on an outdated drink version
+'''
+@app.errorhandler(409)
+def conflict(error):
+    return jsonify({
+                    "success": False, 
+                    "error": 409,
+                    "message": "drink was changed, reload it and retry"
+                    }), 409
 
 
 '''
-@TODO implement error handler for AuthError
-    error handler should conform to general task above 
+error handler for AuthError
 '''
+@app.errorhandler(AuthError)
+def auth_error(error):
+    return jsonify({
+                    "success": False, 
+                    "error": error.status_code,
+                    "message": error.error['description']
+                    }), error.status_code
@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import Column, String, Integer
+import logging
+from sqlalchemy import Column, String, Integer, ForeignKey, func, inspect, or_
+from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -8,6 +10,7 @@ project_dir = os.path.dirname(os.path.abspath(__file__))
 database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
 
 db = SQLAlchemy()
+logger = logging.getLogger(__name__)
 
 '''
 setup_db(app)
@@ -29,6 +32,64 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+'''
+db_upgrade()
+    brings a database created by an earlier version of this file up to date,
+    keeping its drinks: creates the missing tables (drink_ingredients),
+    adds the drink version column and indexes the ingredients of every drink
+    it can be run more than once
+'''
+def db_upgrade():
+    db.create_all()
+    columns = {column['name'] for column in inspect(db.engine).get_columns('drink')}
+    if 'version' not in columns:
+        # create_all never adds columns to an existing table
+        db.session.execute('ALTER TABLE drink ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        db.session.commit()
+    db_index_ingredients()
+
+'''
+db_index_ingredients()
+    rebuilds the drink_ingredients rows of every drink from its recipe
+'''
+def db_index_ingredients():
+    for drink in Drink.query.all():
+        drink.index_ingredients()
+    db.session.commit()
+
+'''
+normalize_ingredient(value)
+    ingredient names and colors are matched case and whitespace insensitively
+'''
+def normalize_ingredient(value):
+    return ' '.join(str(value or '').lower().split())
+
+'''
+recipe_ingredients(recipe)
+    returns the drink_ingredients values of each entry of a json recipe
+'''
+def recipe_ingredients(recipe):
+    return [{'name': normalize_ingredient(r.get('name')),
+             'color': normalize_ingredient(r.get('color')),
+             'parts': r.get('parts')} for r in json.loads(recipe)]
+
+'''
+on_drink_change(listener)
+    registers listener(action, drink), called with 'insert', 'update' or 'delete'
+    and the changed drink once the change is committed
+'''
+DRINK_LISTENERS = []
+
+
+def on_drink_change(listener):
+    DRINK_LISTENERS.append(listener)
+    return listener
+
+
+def notify_drink_change(action, drink):
+    for listener in DRINK_LISTENERS:
+        listener(action, drink)
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -41,14 +102,22 @@ class Drink(db.Model):
     # the ingredients blob - this stores a lazy json blob
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
     recipe =  Column(String(180), nullable=False)
+    # bumped by every update, PATCH /drinks/<id> only applies to the version it read
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # one row per recipe entry, kept in step with recipe by insert() and update()
+    ingredients = relationship('DrinkIngredient', cascade='all, delete-orphan')
+
+    # ORM flushes also check and bump the version, raising StaleDataError on a conflict
+    __mapper_args__ = {'version_id_col': version}
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
+        recipe = json.loads(self.recipe)
+        logger.debug('drink recipe', extra={'drink_id': self.id, 'recipe': recipe})
+        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in recipe]
         return {
             'id': self.id,
             'title': self.title,
@@ -63,9 +132,45 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': json.loads(self.recipe),
+            'version': self.version
         }
 
+    '''
+    index_ingredients()
+        replaces the drink_ingredients rows of the drink with the entries of its recipe
+    '''
+    def index_ingredients(self):
+        self.ingredients = [DrinkIngredient(**entry) for entry in recipe_ingredients(self.recipe)]
+
+    '''
+    search(ingredients, colors, match_all)
+        returns a query of the drinks containing the ingredients and colors,
+        every one of them when match_all, at least one otherwise
+        EXAMPLE
+            drinks = Drink.search(['milk', 'espresso'], [], match_all=True).all()
+    '''
+    @classmethod
+    def search(cls, ingredients=(), colors=(), match_all=True):
+        names = {normalize_ingredient(name) for name in ingredients}
+        colors = {normalize_ingredient(color) for color in colors}
+        query = cls.query
+        if not match_all:
+            conditions = [DrinkIngredient.name.in_(names)] if names else []
+            conditions += [DrinkIngredient.color.in_(colors)] if colors else []
+            if conditions:
+                matching = db.session.query(DrinkIngredient.drink_id).filter(or_(*conditions))
+                query = query.filter(cls.id.in_(matching))
+            return query.order_by(cls.id)
+        for column, values in ((DrinkIngredient.name, names), (DrinkIngredient.color, colors)):
+            if values:
+                matching = db.session.query(DrinkIngredient.drink_id) \
+                    .filter(column.in_(values)) \
+                    .group_by(DrinkIngredient.drink_id) \
+                    .having(func.count(func.distinct(column)) == len(values))
+                query = query.filter(cls.id.in_(matching))
+        return query.order_by(cls.id)
+
     '''
     insert()
         inserts a new model into a database
@@ -76,8 +181,10 @@ class Drink(db.Model):
             drink.insert()
     '''
     def insert(self):
+        self.index_ingredients()
         db.session.add(self)
         db.session.commit()
+        notify_drink_change('insert', self)
 
     '''
     delete()
@@ -90,6 +197,7 @@ class Drink(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_drink_change('delete', self)
 
     '''
     update()
@@ -101,7 +209,69 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
+        self.index_ingredients()
+        db.session.commit()
+        notify_drink_change('update', self)
+
+    '''
+    patch(drink_id, values, expected_version)
+        updates the title and/or recipe of a drink with a single
+        UPDATE ... WHERE id = ? AND version = ? statement, without loading it first
+        expected_version None skips the version check
+        returns (drink, status): the updated drink (a detached row) and 200,
+            (None, 404) when the drink does not exist,
+            (None, 409) when its version is not expected_version
+        EXAMPLE
+            drink, status = Drink.patch(id, {'title': 'Black Coffee'}, expected_version=3)
+    '''
+    @classmethod
+    def patch(cls, drink_id, values, expected_version=None):
+        table = cls.__table__
+        statement = table.update() \
+            .where(table.c.id == drink_id) \
+            .values(version=table.c.version + 1, **values)
+        if expected_version is not None:
+            statement = statement.where(table.c.version == expected_version)
+        returning = db.session.get_bind().dialect.implicit_returning
+        if returning:
+            # Postgres: the new row comes back with the update, still one round trip
+            statement = statement.returning(table.c.id, table.c.title,
+                                            table.c.recipe, table.c.version)
+        result = db.session.execute(statement)
+        row = result.fetchone() if returning else None
+        if (returning and row is None) or (not returning and result.rowcount == 0):
+            db.session.rollback()
+            exists = db.session.query(table.c.id).filter(table.c.id == drink_id).scalar()
+            return None, 409 if exists is not None else 404
+        if row is None:
+            row = db.session.execute(table.select().where(table.c.id == drink_id)).fetchone()
+        drink = cls(id=row.id, title=row.title, recipe=row.recipe, version=row.version)
+        if 'recipe' in values:
+            ingredients = DrinkIngredient.__table__
+            db.session.execute(ingredients.delete().where(ingredients.c.drink_id == drink_id))
+            entries = [dict(entry, drink_id=drink_id) for entry in recipe_ingredients(row.recipe)]
+            if entries:
+                db.session.execute(ingredients.insert(), entries)
         db.session.commit()
+        notify_drink_change('update', drink)
+        return drink, 200
+
+    def __repr__(self):
+        return json.dumps(self.short())
+
+'''
+DrinkIngredient
+one entry of a drink recipe, an inverted index from ingredient names and colors to drinks
+'''
+class DrinkIngredient(db.Model):
+    __tablename__ = 'drink_ingredients'
+
+    id = Column(Integer, primary_key=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), nullable=False, index=True)
+    # normalized with normalize_ingredient()
+    name = Column(String(80), nullable=False, index=True)
+    color = Column(String(20), nullable=False, index=True)
+    parts = Column(Integer)
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps({'drink_id': self.drink_id, 'name': self.name, 'color': self.color})
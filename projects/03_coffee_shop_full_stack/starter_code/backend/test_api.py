@@ -0,0 +1,214 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+from jose import jwt
+
+from src.api import app
+from fsnd_common import jwks
+from src.auth import auth
+from src.database.models import db, Drink, DrinkIngredient
+
+BARISTA = {'permissions': ['patch:drinks']}
+# the real verify_decode_jwt, setUp replaces it
+VERIFY_DECODE_JWT = auth.verify_decode_jwt
+LATTE = [{'name': 'espresso', 'color': 'brown', 'parts': 1},
+         {'name': 'milk', 'color': 'white', 'parts': 3}]
+MOCHA = [{'name': 'Espresso', 'color': 'brown', 'parts': 1},
+         {'name': 'Chocolate', 'color': '#3d1c02', 'parts': 1},
+         {'name': ' whipped  cream', 'color': 'white', 'parts': 1}]
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Points the app at a database file of its own, the committed database.db is left alone"""
+        cls.directory = tempfile.mkdtemp(prefix='coffee-test-')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(cls.directory, 'drinks.db')
+        app.config['TESTING'] = True
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        self.auth = mock.patch('src.auth.auth.verify_decode_jwt', return_value=BARISTA)
+        self.auth.start()
+        self.drink = Drink(title='Latte', recipe=json.dumps(LATTE))
+        self.drink.insert()
+        self.drink_id = self.drink.id
+
+    def tearDown(self):
+        """Executed after reach test"""
+        self.auth.stop()
+        db.session.rollback()
+        for drink in Drink.query.all():
+            drink.delete()
+        self.context.pop()
+
+    def indexed(self, drink_id):
+        return sorted((row.name, row.color, row.parts)
+                      for row in DrinkIngredient.query.filter_by(drink_id=drink_id))
+
+    def titles(self, query):
+        res = self.client.get('/drinks' + query)
+        self.assertEqual(res.status_code, 200)
+        return [drink['title'] for drink in json.loads(res.data)['drinks']]
+
+    def patch(self, body, headers=None):
+        return self.client.patch('/drinks/{}'.format(self.drink_id), json=body,
+                                 headers=dict({'Authorization': 'Bearer token'}, **(headers or {})))
+
+    def test_insert_indexes_ingredients(self):
+        mocha = Drink(title='Mocha', recipe=json.dumps(MOCHA))
+        mocha.insert()
+
+        # names and colors are normalized
+        self.assertEqual(self.indexed(mocha.id), [('chocolate', '#3d1c02', 1),
+                                                  ('espresso', 'brown', 1),
+                                                  ('whipped cream', 'white', 1)])
+        self.assertEqual(self.titles('?ingredient=espresso'), ['Latte', 'Mocha'])
+        self.assertEqual(self.titles('?ingredient=ESPRESSO&ingredient=Whipped%20Cream'), ['Mocha'])
+        self.assertEqual(self.titles('?ingredient=milk&ingredient=chocolate'), [])
+        self.assertEqual(self.titles('?ingredient=milk&ingredient=chocolate&match=any'),
+                         ['Latte', 'Mocha'])
+        self.assertEqual(self.titles('?color=%233D1C02'), ['Mocha'])
+        self.assertEqual(self.titles('?ingredient=milk&color=white'), ['Latte'])
+
+    def test_update_reindexes_ingredients(self):
+        self.drink.recipe = json.dumps([{'name': 'oat milk', 'color': 'beige', 'parts': 4}])
+        self.drink.update()
+
+        self.assertEqual(self.indexed(self.drink_id), [('oat milk', 'beige', 4)])
+        self.assertEqual(self.titles('?ingredient=milk'), [])
+        self.assertEqual(self.titles('?ingredient=oat%20milk'), ['Latte'])
+
+    def test_patch_reindexes_ingredients(self):
+        res = self.patch({'recipe': MOCHA, 'version': 1})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([row[0] for row in self.indexed(self.drink_id)],
+                         ['chocolate', 'espresso', 'whipped cream'])
+        self.assertEqual(self.titles('?ingredient=milk'), [])
+        self.assertEqual(self.titles('?ingredient=chocolate'), ['Latte'])
+
+    def test_delete_removes_ingredients(self):
+        self.drink.delete()
+
+        self.assertEqual(self.indexed(self.drink_id), [])
+        self.assertEqual(DrinkIngredient.query.count(), 0)
+        self.assertEqual(self.titles('?ingredient=espresso'), [])
+
+    def test_get_drinks_invalid_match(self):
+        res = self.client.get('/drinks?ingredient=milk&match=some')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_patch_drink(self):
+        res = self.patch({'title': 'Flat White', 'version': 1})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['drinks'][0]['title'], 'Flat White')
+        self.assertEqual(data['drinks'][0]['version'], 2)
+
+    def test_patch_drink_invalid_recipe(self):
+        invalid = [
+            [{'name': 'milk'}],
+            [{'name': 'milk', 'color': 'white'}],
+            [{'name': 'milk', 'color': 'white', 'parts': '1'}],
+            [{'name': 'milk', 'color': 'white', 'parts': True}],
+            [{'name': '', 'color': 'white', 'parts': 1}],
+            [{'color': 'white', 'parts': 1}],
+            ['milk'],
+            [],
+            [{'name': 'milk' * 20, 'color': 'white', 'parts': 1}] * 3,
+            [{'name': 'milk', 'color': 'rgba(255, 255, 255, 0.5)', 'parts': 1}],
+            [{'name': 'm' * 81, 'color': 'white', 'parts': 1}]
+        ]
+        for recipe in invalid:
+            res = self.patch({'recipe': recipe})
+            self.assertEqual(res.status_code, 422, recipe)
+
+        res = self.patch({'title': 'T' * 81})
+        self.assertEqual(res.status_code, 422)
+        # the menu still renders
+        res = self.client.get('/drinks')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['drinks'][0]['recipe'],
+                         [{'color': 'brown', 'parts': 1}, {'color': 'white', 'parts': 3}])
+
+    def test_patch_drink_outdated_version(self):
+        self.assertEqual(self.patch({'title': 'Flat White'}, {'If-Match': '"1"'}).status_code, 200)
+        res = self.patch({'title': 'Cortado'}, {'If-Match': '"1"'})
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(Drink.query.get(self.drink_id).title, 'Flat White')
+
+    def test_concurrent_patches_one_wins(self):
+        writers = 8
+        barrier = threading.Barrier(writers)
+        statuses = []
+
+        def patch(number):
+            with app.app_context():
+                barrier.wait()
+                res = self.patch({'title': 'Latte {}'.format(number), 'version': 1})
+                statuses.append(res.status_code)
+                db.session.remove()
+
+        threads = [threading.Thread(target=patch, args=(number,)) for number in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] + [409] * (writers - 1))
+        db.session.expire_all()
+        self.assertEqual(Drink.query.get(self.drink_id).version, 2)
+
+    def test_patch_drink_keys_unavailable(self):
+        token = jwt.encode({'aud': auth.API_AUDIENCE, 'iss': auth.ISSUER,
+                            'exp': int(time.time()) + 60}, 'secret', headers={'kid': 'new-key'})
+        with mock.patch('src.auth.auth.verify_decode_jwt', VERIFY_DECODE_JWT), \
+                mock.patch.object(auth, 'KEYS', jwks.KeyCache(auth.JWKS_URL)), \
+                mock.patch('fsnd_common.jwks.urlopen', side_effect=URLError('unreachable')):
+            res = self.patch({'title': 'Mocha'}, {'Authorization': 'Bearer ' + token})
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(json.loads(res.data)['message'], 'Unable to fetch the signing keys.')
+
+    def test_check_claims(self):
+        claims = {'aud': ['other', auth.API_AUDIENCE], 'iss': auth.ISSUER, 'exp': time.time() + 60}
+        jwks.check_claims(claims, auth.API_AUDIENCE, auth.ISSUER)
+        for invalid in ({'aud': 'other'}, {'iss': 'https://example.com/'}, {'exp': time.time() - 1},
+                        {'exp': None}):
+            with self.assertRaises(jwks.AuthError) as raised:
+                jwks.check_claims(dict(claims, **invalid), auth.API_AUDIENCE, auth.ISSUER)
+            self.assertEqual(raised.exception.status_code, 401)
+
+    def test_patch_drink_requires_auth(self):
+        res = self.client.patch('/drinks/{}'.format(self.drink_id), json={'title': 'Mocha'})
+
+        self.assertEqual(res.status_code, 401)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()